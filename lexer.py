@@ -96,7 +96,7 @@ def tokenize(code: str) -> List[Dict[str, Any]]:
                     if identifier in KEYWORDS:
                         tokens.append({"token": KEYWORDS[identifier], "value": None, "line": lexeme_line, "col": lexeme_col})
                     elif identifier == "true" or identifier == "false":
-                        tokens.append({"token": "value", "value": bool(identifier), "line": lexeme_line, "col": lexeme_col})
+                        tokens.append({"token": "value", "value": identifier == "true", "line": lexeme_line, "col": lexeme_col})
                     else:
                         tokens.append({"token": "identifier", "value": identifier, "line": lexeme_line, "col": lexeme_col})
                     
@@ -0,0 +1,1022 @@
+'''
+Explicit-state model checking of the systems translated with `state_classes`: the reachable global states of a system are enumerated by running the `step()` of its automata from every state, in every possible order and with every possible choice. The exploration runs in a process (see `ModelChecker`), or is split across processes by a hash of the states (see `ParallelModelChecker`).
+'''
+from typing import Any, Callable, Dict, List, Tuple
+from collections import deque
+from array import array
+import tempfile
+import hashlib
+import multiprocessing
+import marshal
+import random
+import shutil
+import struct
+import mmap
+import time
+import sys
+import os
+from m_lib import Port, Pipeline, Scheduler, MUnion, record_class
+from m_par import Mailbox, get_slot_format
+
+def freeze(value: Any, s11n_code: Tuple | str) -> Any:
+    '''
+    The canonical form of a value serialized with `s11n_code`, made of the types `marshal` writes: equal values have the same form. The numeric arrays are kept as their bytes, after their typecode.
+    '''
+    mode = s11n_code if isinstance(s11n_code, str) else s11n_code[0]
+
+    if mode in ("direct", "bounded") or value is None:
+        return value
+
+    if mode == "tuple":
+        return tuple([freeze(value[i - 1], s11n_code[i]) for i in range(1, len(s11n_code))])
+
+    if mode == "union":
+        return (value.label, freeze(value.value, s11n_code[value.label + 1]))
+
+    if mode in ("array", "list"):
+        if isinstance(value, array):
+            return value.typecode.encode() + value.tobytes()
+
+        return tuple([freeze(entry, s11n_code[-1]) for entry in value])
+
+    if mode == "map":
+        _, _, value_s11n_code = s11n_code
+        return tuple(sorted([(key, freeze(value[key], value_s11n_code)) for key in value], key=repr))
+
+    if mode == "struct":
+        return tuple([freeze(getattr(value, field), field_s11n_code) for field, field_s11n_code in s11n_code[1:]])
+
+    raise ValueError(f"Invalid serialization code '{s11n_code}'")
+
+def thaw(data: Any, s11n_code: Tuple | str) -> Any:
+    '''
+    The value of a canonical form (see `freeze`), as the generated code holds it.
+    '''
+    mode = s11n_code if isinstance(s11n_code, str) else s11n_code[0]
+
+    if mode in ("direct", "bounded") or data is None:
+        return data
+
+    if mode == "tuple":
+        return tuple([thaw(data[i - 1], s11n_code[i]) for i in range(1, len(s11n_code))])
+
+    if mode == "union":
+        return MUnion(data[0], thaw(data[1], s11n_code[data[0] + 1]))
+
+    if mode in ("array", "list"):
+        if isinstance(data, bytes):
+            entries = array(chr(data[0]))
+            entries.frombytes(data[1:])
+            return entries
+
+        return [thaw(entry, s11n_code[-1]) for entry in data]
+
+    if mode == "map":
+        _, _, value_s11n_code = s11n_code
+        return {key: thaw(value, value_s11n_code) for key, value in data}
+
+    if mode == "struct":
+        fields = tuple([field for field, _ in s11n_code[1:]])
+        return record_class(fields)(*[thaw(data[i - 1], s11n_code[i][1]) for i in range(1, len(s11n_code))])
+
+    raise ValueError(f"Invalid serialization code '{s11n_code}'")
+
+def is_mutable_code(s11n_code: Tuple | str) -> bool:
+    '''
+    Whether the values serialized with `s11n_code` hold containers updated in place by the generated code, without copy (the "mutable" transfer class of `type_tree.get_transfer_class`).
+    '''
+    if isinstance(s11n_code, str) or s11n_code[0] == "bounded":
+        return False
+
+    if s11n_code[0] in ("tuple", "union"):
+        return any([is_mutable_code(code) for code in s11n_code[1:]])
+
+    entry_codes = [code for _, code in s11n_code[1:]] if s11n_code[0] == "struct" else [code for code in s11n_code[1:] if not isinstance(code, int)]
+    return any([not isinstance(code, str) and code[0] != "bounded" for code in entry_codes])
+
+class StateCodec:
+    '''
+    Encodes the global states of a system as bytes.
+
+    A global state is a tuple of three tuples:
+    - per automaton, the values of its variables followed by the index of its continuation (0 if none, k + 1 for `_cont_k`);
+    - per port, its value, `reqRead` and `reqWrite`;
+    - per automaton, its synchronization in progress: None, or the indices of the ports to synchronize, the index of the current one, and whether the automaton has arrived there (and waits for the other parties).
+
+    The bounded integers, the continuations and the port flags are packed in a `struct` of fixed layout, with the smallest integer formats holding them (see `m_par.get_slot_format`). The other values and the synchronizations follow, in their canonical form (see `freeze`) written by `marshal`. A bounded integer without value (None) is packed as 0, and listed after the other values.
+    '''
+    def __init__(self, var_codes: List[List[Tuple | str]], n_continuations: List[int], port_codes: List[Tuple | str]):
+        self.var_codes = var_codes
+        self.port_codes = port_codes
+
+        # The fixed fields: (automaton, index in its tuple) of the variables and continuations, then the ports, with their formats
+        fixed_vars: List[Tuple[int, int]] = []
+        fixed_ports: List[int] = []
+        formats = ["<"]
+
+        # The other fields: (automaton, index in its tuple, s11n code), or (port, -1, s11n code) for the value of a port
+        free_fields: List[Tuple[int, int, Tuple | str]] = []
+
+        for i in range(len(var_codes)):
+            codes = var_codes[i]
+            for k in range(len(codes)):
+                slot_format = get_slot_format(codes[k])
+                if slot_format is not None and len(slot_format) == 1:
+                    fixed_vars.append((i, k))
+                    formats.append(slot_format)
+                else:
+                    free_fields.append((i, k, codes[k]))
+
+            fixed_vars.append((i, len(codes)))
+            formats.append("B" if n_continuations[i] < 256 else "H")
+
+        for p in range(len(port_codes)):
+            slot_format = get_slot_format(port_codes[p])
+            if slot_format is not None and len(slot_format) == 1:
+                fixed_ports.append(p)
+                formats.append(slot_format)
+            else:
+                free_fields.append((p, -1, port_codes[p]))
+
+        # The two flags of each port in a byte
+        formats.append("B" * len(port_codes))
+
+        self._fixed_vars = fixed_vars
+        self._fixed_ports = fixed_ports
+        self._free_fields = free_fields
+        self._struct = struct.Struct("".join(formats))
+
+    def encode(self, state: Tuple) -> bytes:
+        automata, ports, syncs = state
+
+        fixed = [automata[i][k] for i, k in self._fixed_vars]
+        fixed += [ports[p][0] for p in self._fixed_ports]
+
+        nones = ()
+        if None in fixed:
+            nones = tuple([position for position in range(len(fixed)) if fixed[position] is None])
+            for position in nones:
+                fixed[position] = 0
+
+        fixed += [reqRead | reqWrite << 1 for _, reqRead, reqWrite in ports]
+
+        free = tuple([freeze(automata[i][k] if k >= 0 else ports[i][0], s11n_code) for i, k, s11n_code in self._free_fields])
+
+        pending = ()
+        if syncs.count(None) < len(syncs):
+            pending = tuple([(i,) + syncs[i] for i in range(len(syncs)) if syncs[i] is not None])
+
+        if not free and not nones and not pending:
+            return self._struct.pack(*fixed)
+
+        # Version 0 writes the same bytes for equal values (no references, nor interned strings)
+        return self._struct.pack(*fixed) + marshal.dumps((free, nones, pending), 0)
+
+    def decode(self, data: bytes) -> Tuple:
+        fixed = self._struct.unpack_from(data)
+        free, nones, pending = marshal.loads(data[self._struct.size:]) if len(data) > self._struct.size else ((), (), ())
+
+        if nones:
+            fixed = list(fixed)
+            for position in nones:
+                fixed[position] = None
+
+        automata = [[None] * (len(codes) + 1) for codes in self.var_codes]
+        port_values = [None] * len(self.port_codes)
+
+        position = 0
+        for i, k in self._fixed_vars:
+            automata[i][k] = fixed[position]
+            position += 1
+        for p in self._fixed_ports:
+            port_values[p] = fixed[position]
+            position += 1
+        flags = fixed[position:]
+
+        for position in range(len(self._free_fields)):
+            i, k, s11n_code = self._free_fields[position]
+            if k >= 0:
+                automata[i][k] = thaw(free[position], s11n_code)
+            else:
+                port_values[i] = thaw(free[position], s11n_code)
+
+        ports = tuple([(port_values[p], bool(flags[p] & 1), bool(flags[p] & 2)) for p in range(len(self.port_codes))])
+
+        syncs = [None] * len(self.var_codes)
+        for i, port_indices, position, arrived in pending:
+            syncs[i] = (port_indices, position, arrived)
+
+        return (tuple([tuple(values) for values in automata]), ports, tuple(syncs))
+
+def fingerprint(data: bytes, size: int = 8) -> int:
+    '''
+    A hash of `size` bytes of an encoded state, the same in every process (unlike `hash`).
+    '''
+    return int.from_bytes(hashlib.blake2b(data, digest_size=size).digest(), "little")
+
+class ExactStore:
+    '''
+    The visited states, as a set of their encodings (see `StateCodec`).
+
+    Like the other stores, `add` tells whether a state is new, `memory()` is the number of bytes the store takes, and `coverage()` estimates the fraction of the reachable states it let the exploration reach (1.0 for the exact stores).
+    '''
+    def __init__(self):
+        self._states = set()
+        self._state_bytes = 0
+
+    def add(self, data: bytes) -> bool:
+        states = self._states
+        n = len(states)
+        states.add(data)
+        if len(states) == n:
+            return False
+
+        self._state_bytes += sys.getsizeof(data)
+        return True
+
+    def memory(self) -> int:
+        return sys.getsizeof(self._states) + self._state_bytes
+
+    def coverage(self) -> float:
+        return 1.0
+
+    def close(self):
+        self._states = set()
+
+class BitstateStore:
+    '''
+    The visited states as a Bloom filter of `n_bytes` bytes: each state sets `n_hashes` bits, and a state whose bits are all set is taken as visited. The memory is fixed whatever the number of states, but a state colliding with visited ones is wrongly skipped, with its successors.
+
+    The bits are derived from two hashes of the state (double hashing). The coverage is estimated from the fraction of the bits set at each insertion: the probability that a new state is skipped is that fraction to the power `n_hashes`.
+    '''
+    def __init__(self, n_bytes: int = 1 << 26, n_hashes: int = 3):
+        if n_bytes < 1 or n_hashes < 1:
+            raise ValueError(f"A bitstate store needs a positive size and number of hashes, not {n_bytes} and {n_hashes}")
+
+        self.n_hashes = n_hashes
+        self._bits = bytearray(n_bytes)
+        self._n_bits = 8 * n_bytes
+        self._n_set = 0
+        self._n_states = 0
+
+        # The expected number of new states skipped so far
+        self._n_omitted = 0.0
+
+    def add(self, data: bytes) -> bool:
+        digest = fingerprint(data, 16)
+        h1 = digest & 0xFFFFFFFFFFFFFFFF
+        h2 = digest >> 64 | 1
+
+        bits = self._bits
+        n_bits = self._n_bits
+        n_set = self._n_set
+        for j in range(self.n_hashes):
+            bit = (h1 + j * h2) % n_bits
+            mask = 1 << (bit & 7)
+            if not bits[bit >> 3] & mask:
+                bits[bit >> 3] |= mask
+                self._n_set += 1
+
+        if self._n_set == n_set:
+            return False
+
+        # This state would have been skipped with the probability that all its bits were set already
+        skipped = (n_set / n_bits) ** self.n_hashes
+        self._n_omitted += skipped / (1.0 - skipped)
+        self._n_states += 1
+        return True
+
+    def memory(self) -> int:
+        return len(self._bits)
+
+    def coverage(self) -> float:
+        if self._n_states == 0:
+            return 1.0
+
+        return self._n_states / (self._n_states + self._n_omitted)
+
+    def close(self):
+        self._bits = bytearray()
+
+# The slots of the hash table of a `DiskStore`: the fingerprint of a state (never 0, which marks an empty slot) and the offset of its record
+DISK_SLOT = struct.Struct("<QQ")
+DISK_LENGTH = struct.Struct("<I")
+
+class DiskStore:
+    '''
+    The visited states in two files mapped in memory, in a temporary directory created in `directory`: the records of the states (their length, then their encoding), appended one after another, and an open-addressing hash table of their fingerprints and offsets, doubled when half full. The pages not used recently are written back to the files by the OS, so the states need not fit in RAM.
+
+    A fingerprint match is confirmed by comparing the records, so the store is exact. `memory()` is the size of the files.
+    '''
+    def __init__(self, directory: str | None = None, n_slots: int = 1 << 16, data_size: int = 1 << 20):
+        self._directory = tempfile.mkdtemp(prefix="m_check_", dir=directory)
+        self._n_states = 0
+
+        self._data_file = open(os.path.join(self._directory, "states"), "w+b")
+        self._data_size = data_size
+        self._data_file.truncate(data_size)
+        self._data = mmap.mmap(self._data_file.fileno(), data_size)
+        self._data_end = 0
+
+        self._n_tables = 0
+        self._table_file, self._table = self._create_table(n_slots)
+        self._n_slots = n_slots
+
+    def _create_table(self, n_slots: int) -> Tuple[Any, mmap.mmap]:
+        table_file = open(os.path.join(self._directory, "table" + str(self._n_tables)), "w+b")
+        self._n_tables += 1
+        table_file.truncate(n_slots * DISK_SLOT.size)
+
+        return table_file, mmap.mmap(table_file.fileno(), n_slots * DISK_SLOT.size)
+
+    def _record(self, offset: int) -> bytes:
+        length, = DISK_LENGTH.unpack_from(self._data, offset)
+        start = offset + DISK_LENGTH.size
+
+        return self._data[start:start + length]
+
+    def _append(self, data: bytes) -> int:
+        offset = self._data_end
+        end = offset + DISK_LENGTH.size + len(data)
+        if end > self._data_size:
+            while end > self._data_size:
+                self._data_size *= 2
+            self._data.close()
+            self._data_file.truncate(self._data_size)
+            self._data = mmap.mmap(self._data_file.fileno(), self._data_size)
+
+        DISK_LENGTH.pack_into(self._data, offset, len(data))
+        self._data[offset + DISK_LENGTH.size:end] = data
+        self._data_end = end
+
+        return offset
+
+    def add(self, data: bytes) -> bool:
+        key = fingerprint(data) or 1
+        table = self._table
+        mask = self._n_slots - 1
+
+        slot = key & mask
+        while True:
+            slot_key, offset = DISK_SLOT.unpack_from(table, slot * DISK_SLOT.size)
+            if slot_key == 0:
+                break
+            if slot_key == key and self._record(offset) == data:
+                return False
+            slot = (slot + 1) & mask
+
+        DISK_SLOT.pack_into(table, slot * DISK_SLOT.size, key, self._append(data))
+        self._n_states += 1
+        if 2 * self._n_states > self._n_slots:
+            self._grow()
+
+        return True
+
+    def _grow(self):
+        n_slots = 2 * self._n_slots
+        table_file, table = self._create_table(n_slots)
+        mask = n_slots - 1
+
+        old_table = self._table
+        for position in range(0, len(old_table), DISK_SLOT.size):
+            key, offset = DISK_SLOT.unpack_from(old_table, position)
+            if key == 0:
+                continue
+
+            slot = key & mask
+            while DISK_SLOT.unpack_from(table, slot * DISK_SLOT.size)[0] != 0:
+                slot = (slot + 1) & mask
+            DISK_SLOT.pack_into(table, slot * DISK_SLOT.size, key, offset)
+
+        old_table.close()
+        self._table_file.close()
+        os.remove(self._table_file.name)
+
+        self._table_file, self._table = table_file, table
+        self._n_slots = n_slots
+
+    def memory(self) -> int:
+        return self._data_size + self._n_slots * DISK_SLOT.size
+
+    def coverage(self) -> float:
+        return 1.0
+
+    def close(self):
+        self._data.close()
+        self._table.close()
+        self._data_file.close()
+        self._table_file.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+class ExplorationResult:
+    '''
+    The outcome of `ModelChecker.explore`. `violation` names the violated invariant ("deadlock" for a state without successor), or is None. `trace` leads from the initial state to the violating state: its entries are the moving automaton (None for the initial state) and the state reached (see `ModelChecker.describe`).
+    '''
+    def __init__(self):
+        self.n_states: int = 0
+        self.n_transitions: int = 0
+
+        # Whether every reachable state was explored (no violation, and `max_states` was not reached). With a lossy store, up to its coverage.
+        self.complete: bool = False
+
+        self.violation: str | None = None
+        self.trace: List[Tuple[str | None, Dict[str, Any]]] = []
+
+        self.elapsed: float = 0.0
+        self.states_per_second: float = 0.0
+
+        # The mean length of the encoded states, the memory taken by the store and by the trail of the traces per state, and the coverage estimated by the store
+        self.state_bytes: float = 0.0
+        self.store_bytes: int = 0
+        self.bytes_per_state: float = 0.0
+        self.coverage: float = 1.0
+
+    def __repr__(self):
+        status = "complete" if self.complete else "violation " + repr(self.violation) if self.violation is not None else "incomplete"
+        return f"{self.n_states} states, {self.n_transitions} transitions, {status}, {self.states_per_second:.0f} states/s, {self.state_bytes:.1f} bytes/encoded state, {self.bytes_per_state:.1f} bytes/stored state, coverage {self.coverage:.6f}"
+
+class _Choices:
+    '''
+    Replaces `random.random` while an automaton steps, to pick the statement of a group (see `AutomatonTranslator._translate_guarded_stmt_grp`): the enabled statement whose draw is `chosen` is kept, and the first one if `chosen` is -1. Counts the draws.
+    '''
+    def __init__(self):
+        self.chosen = -1
+        self.n_draws = 0
+
+    def __call__(self) -> float:
+        draw = self.n_draws
+        self.n_draws += 1
+
+        return 0.0 if draw == self.chosen else 1.0
+
+class ModelChecker(Scheduler):
+    '''
+    Enumerates the reachable states of a system: the generated system function adds its components to the checker, like to the other schedulers.
+
+    From a state, every automaton may move (in any order): it fires any of its enabled transitions, and any of the enabled statements of a group, or runs the statements following a synchronization, then arrives at the ports to synchronize until a round is not complete. The last party arriving at a port releases the others, which move on to their next ports in their next moves. The transitions are fired by the generated `step()`, with `pc` set to each transition in turn, and with the draws of `random.random` replaced to choose the statements of the groups. The pipelines are explored stage by stage, and the products as single automata.
+
+    `invariants` maps names to predicates taking the list of the components, with the state being checked restored into them. With `deadlocks`, a state in which no automaton can move is a violation too.
+    '''
+    def __init__(self, invariants: Dict[str, Callable[[List[Any]], bool]] | None = None, deadlocks: bool = True):
+        super().__init__()
+        self.invariants = {} if invariants is None else invariants
+        self.deadlocks = deadlocks
+
+    def _prepare(self):
+        automata = []
+        for component in self._components:
+            automata += component.stages if isinstance(component, Pipeline) else [component]
+
+        port_indices: Dict[int, int] = {}
+        ports: List[Port] = []
+        port_codes: List[Tuple | str] = []
+
+        self._automata = automata
+        self._var_slots: List[Tuple[str, ...]] = []
+        self._port_slots: List[Tuple[int, ...]] = []
+        self._owner_slots: List[Tuple[str, ...]] = []
+        self._mutable_vars: List[Tuple[Tuple[int, Tuple], ...]] = []
+        self._continuations: List[Tuple[str, ...]] = []
+        var_codes = []
+
+        for automaton in automata:
+            if not hasattr(automaton, "state_codes"):
+                raise TypeError(f"{type(automaton).__name__} cannot be explored: only the automata translated with `state_classes` (and no batch) have a known state")
+
+            var_slots = []
+            codes = []
+            automaton_ports = []
+            for slot, s11n_code in automaton.state_codes:
+                value = getattr(automaton, slot)
+                if isinstance(value, Port):
+                    if id(value) not in port_indices:
+                        port_indices[id(value)] = len(ports)
+                        ports.append(value)
+                        port_codes.append(s11n_code)
+                    automaton_ports.append(port_indices[id(value)])
+                else:
+                    var_slots.append(slot)
+                    codes.append(s11n_code)
+
+            self._var_slots.append(tuple(var_slots))
+            self._port_slots.append(tuple(automaton_ports))
+            self._mutable_vars.append(tuple([(k, codes[k]) for k in range(len(codes)) if is_mutable_code(codes[k])]))
+            self._owner_slots.append(tuple([slot for slot in type(automaton).__slots__ if slot.startswith("ow_")]))
+            self._continuations.append(tuple(sorted([name for name in dir(type(automaton)) if name.startswith("_cont_")], key=lambda name: int(name[len("_cont_"):]))))
+            var_codes.append(codes)
+
+        self._ports = ports
+        self._port_indices = port_indices
+        self._codec = StateCodec(var_codes, [len(continuations) + 1 for continuations in self._continuations], port_codes)
+
+    def _capture(self) -> Tuple:
+        automata = []
+        for i in range(len(self._automata)):
+            automata.append(self._capture_automaton(i))
+
+        ports = tuple([(port._value, port._reqRead, port._reqWrite) for port in self._ports])
+
+        return (tuple(automata), ports, (None,) * len(self._automata))
+
+    def _capture_automaton(self, i: int) -> Tuple:
+        automaton = self._automata[i]
+        cont = getattr(automaton, "cont", None)
+        cont_index = 0 if cont is None else int(cont.__name__[len("_cont_"):]) + 1
+
+        return tuple([getattr(automaton, slot) for slot in self._var_slots[i]]) + (cont_index,)
+
+    def _restore_automaton(self, i: int, values: Tuple, ports: Tuple):
+        automaton = self._automata[i]
+        var_slots = self._var_slots[i]
+        for k in range(len(var_slots)):
+            setattr(automaton, var_slots[k], values[k])
+
+        # The mutable values are updated in place without copy, so each restoring gets its own
+        for k, s11n_code in self._mutable_vars[i]:
+            setattr(automaton, var_slots[k], thaw(freeze(values[k], s11n_code), s11n_code))
+
+        # The other values may be shared with other states, so they are copied before any update in place
+        for slot in self._owner_slots[i]:
+            setattr(automaton, slot, None)
+
+        if not hasattr(automaton, "t_fns"):
+            return
+
+        cont_index = values[-1]
+        automaton.cont = None if cont_index == 0 else getattr(automaton, self._continuations[i][cont_index - 1])
+        automaton.g_dirty.update(range(len(automaton.g_fns)))
+
+        for p in self._port_slots[i]:
+            port = self._ports[p]
+            port._value, port._reqRead, port._reqWrite = ports[p]
+            port.version += 1
+
+    def restore(self, state: Tuple):
+        '''
+        Set the variables of the automata and the ports to a state.
+        '''
+        automata, ports, _ = state
+        for i in range(len(automata)):
+            self._restore_automaton(i, automata[i], ports)
+
+        for p in range(len(self._ports)):
+            port = self._ports[p]
+            port._value, port._reqRead, port._reqWrite = ports[p]
+            port.version += 1
+
+    def describe(self, state: Tuple) -> Dict[str, Any]:
+        '''
+        A readable form of a state: the variables of each automaton (with its synchronization in progress, if any) and the fields of each port.
+        '''
+        automata, ports, syncs = state
+        result = {}
+        for i in range(len(automata)):
+            name = str(i) + ":" + type(self._automata[i]).__name__
+            variables = {self._var_slots[i][k][len("id_"):]: automata[i][k] for k in range(len(self._var_slots[i]))}
+            if syncs[i] is not None:
+                port_indices, position, arrived = syncs[i]
+                variables["@sync"] = ("waits at " if arrived else "next ") + "p" + str(port_indices[position])
+            result[name] = variables
+
+        for p in range(len(ports)):
+            result["p" + str(p)] = dict(zip(("value", "reqRead", "reqWrite"), ports[p]))
+
+        return result
+
+    def _arrive(self, syncs: List, i: int, port_indices: Tuple[int, ...], position: int):
+        '''
+        Make the automaton `i` arrive at its ports from `position`, until one does not complete its round.
+        '''
+        while position < len(port_indices):
+            p = port_indices[position]
+            waiting = [j for j in range(len(syncs)) if syncs[j] is not None and syncs[j][2] and syncs[j][0][syncs[j][1]] == p]
+            if len(waiting) + 1 < self._ports[p]._parties:
+                syncs[i] = (port_indices, position, True)
+                return
+
+            for j in waiting:
+                port_indices_j, position_j, _ = syncs[j]
+                syncs[j] = (port_indices_j, position_j + 1, False) if position_j + 1 < len(port_indices_j) else None
+
+            position += 1
+
+        syncs[i] = None
+
+    def _fire(self, state: Tuple, i: int, choices: _Choices) -> List[Tuple]:
+        '''
+        The states reached by the moves of the automaton `i`.
+        '''
+        automata, ports, syncs = state
+        automaton = self._automata[i]
+
+        if syncs[i] is not None:
+            port_indices, position, arrived = syncs[i]
+            if arrived:
+                return []
+
+            new_syncs = list(syncs)
+            self._arrive(new_syncs, i, port_indices, position)
+            return [(automata, ports, tuple(new_syncs))]
+
+        if not hasattr(automaton, "t_fns"):
+            return []
+
+        n_transitions = len(automaton.t_fns)
+        runs = [(t, -1) for t in range(n_transitions)] if automata[i][-1] == 0 else [(0, -1)]
+        successors = []
+        k = 0
+        while k < len(runs):
+            t, chosen = runs[k]
+            k += 1
+
+            self._restore_automaton(i, automata[i], ports)
+            automaton.pc = t
+            choices.chosen = chosen
+            choices.n_draws = 0
+            result = automaton.step()
+
+            # Each draw may keep another statement of the group (with the first enabled one, or none, kept without draw)
+            if chosen == -1 and choices.n_draws:
+                runs[k:k] = [(t, draw) for draw in range(choices.n_draws)]
+
+            if result is None:
+                if chosen == -1 and choices.n_draws == 0:
+                    # No transition is enabled at all
+                    break
+                continue
+
+            if automata[i][-1] == 0 and (automaton.pc - 1) % n_transitions != t:
+                # Found from the transition it fired
+                continue
+
+            new_automata = list(automata)
+            new_automata[i] = self._capture_automaton(i)
+            new_ports = list(ports)
+            for p in self._port_slots[i]:
+                port = self._ports[p]
+                new_ports[p] = (port._value, port._reqRead, port._reqWrite)
+
+            new_syncs = list(syncs)
+            if result:
+                self._arrive(new_syncs, i, tuple([self._port_indices[id(port)] for port in result]), 0)
+
+            successors.append((tuple(new_automata), tuple(new_ports), tuple(new_syncs)))
+
+        return successors
+
+    def _check(self, state: Tuple) -> str | None:
+        if not self.invariants:
+            return None
+
+        self.restore(state)
+        for name, predicate in self.invariants.items():
+            if not predicate(self._components):
+                return name
+
+        return None
+
+    def explore(self, order: str = "bfs", max_states: int = -1, store: Any = None, traces: bool = True) -> ExplorationResult:
+        '''
+        Explore the states reachable from the current state of the system, breadth-first ("bfs") or depth-first ("dfs"), until a violation is found or `max_states` states are visited (no limit if negative).
+
+        `store` keeps the visited states (an `ExactStore` by default, see also `BitstateStore` and `DiskStore`), and is closed at the end. The frontier holds the encoded states still to expand.
+
+        With `traces`, the trail keeps for each state the index of its parent, the automaton which moved and the index of the move among those of the automaton (16 bytes per state), and the trace of a violation is rebuilt by replaying the moves from the initial state. Otherwise, the trace only holds the violating state.
+        '''
+        if order not in ("bfs", "dfs"):
+            raise ValueError(f"Unknown exploration order '{order}'")
+
+        self._prepare()
+        codec = self._codec
+        store = ExactStore() if store is None else store
+        result = ExplorationResult()
+
+        initial = codec.encode(self._capture())
+        store.add(initial)
+        n_states = 1
+        n_state_bytes = len(initial)
+
+        parents = array("q", [-1])
+        movers = array("l", [-1])
+        ordinals = array("l", [0])
+
+        frontier = deque([(0, initial)])
+        pop = frontier.popleft if order == "bfs" else frontier.pop
+
+        choices = _Choices()
+        saved_random = random.random
+        random.random = choices
+        start = time.perf_counter()
+        try:
+            violating_state = codec.decode(initial)
+            violation = self._check(violating_state)
+            violating = 0
+            while violation is None and frontier:
+                index, data = pop()
+                state = codec.decode(data)
+
+                n_successors = 0
+                for i in range(len(self._automata)):
+                    successors = self._fire(state, i, choices)
+                    n_successors += len(successors)
+                    for ordinal in range(len(successors)):
+                        successor = successors[ordinal]
+                        data = codec.encode(successor)
+                        if not store.add(data):
+                            continue
+
+                        if traces:
+                            parents.append(index)
+                            movers.append(i)
+                            ordinals.append(ordinal)
+                        frontier.append((n_states, data))
+                        n_states += 1
+                        n_state_bytes += len(data)
+
+                        violation = self._check(successor)
+                        if violation is not None:
+                            violating, violating_state = n_states - 1, successor
+                            break
+
+                    if violation is not None:
+                        break
+
+                result.n_transitions += n_successors
+                if n_successors == 0 and self.deadlocks and violation is None:
+                    violation = "deadlock"
+                    violating, violating_state = index, state
+
+                if 0 <= max_states <= n_states:
+                    break
+
+            result.elapsed = time.perf_counter() - start
+
+            if violation is not None and traces:
+                path = []
+                while violating > 0:
+                    path.append(violating)
+                    violating = parents[violating]
+
+                state = codec.decode(initial)
+                result.trace.append((None, self.describe(state)))
+                for index in reversed(path):
+                    mover = movers[index]
+                    state = self._fire(state, mover, choices)[ordinals[index]]
+                    result.trace.append((str(mover) + ":" + type(self._automata[mover]).__name__, self.describe(state)))
+            elif violation is not None:
+                result.trace.append((None, self.describe(violating_state)))
+        finally:
+            random.random = saved_random
+
+        result.n_states = n_states
+        result.states_per_second = n_states / result.elapsed if result.elapsed > 0 else 0.0
+        result.violation = violation
+        result.complete = violation is None and not frontier
+
+        result.state_bytes = n_state_bytes / n_states
+        result.store_bytes = store.memory()
+        result.coverage = store.coverage()
+        trail_bytes = parents.itemsize * len(parents) + movers.itemsize * len(movers) + ordinals.itemsize * len(ordinals)
+        result.bytes_per_state = (result.store_bytes + trail_bytes) / n_states
+        store.close()
+
+        return result
+
+class ParallelModelChecker(ModelChecker):
+    '''
+    Explores the states of a system on `n_workers` processes, forked from the process building the system (like `m_par.PartitionedScheduler`). Each worker owns the states whose fingerprint (see `fingerprint`) is its index modulo `n_workers`: it keeps them in its own store and expands them. The successors owned by other workers are sent to them in batches of `batch_size` states, through a queue per worker.
+
+    The exploration runs in rounds, breadth-first. In each round, every worker expands the states it has not expanded yet, sends its batches, and writes in its mailbox how many batches it sent to each worker, the violation it found (if any) and its number of states. After a barrier, every worker reads all the mailboxes and receives the batches sent to it. Since all the workers read the same messages, they all stop after the same round: when no batch was sent and no worker has states left to expand, or when a violation was found or `max_states` states are visited.
+
+    The trail of a state is kept by its owner, with the global index of its parent (its local index times `n_workers`, plus its owner). The trace of a violation is rebuilt by the parent process, from the trails sent back by the workers.
+    '''
+    def __init__(self, n_workers: int, invariants: Dict[str, Callable[[List[Any]], bool]] | None = None, deadlocks: bool = True, batch_size: int = 1024, mailbox_size: int = 1 << 16):
+        super().__init__(invariants, deadlocks)
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.mailbox_size = mailbox_size
+
+    def explore(self, order: str = "bfs", max_states: int = -1, store: Callable[[], Any] | None = None, traces: bool = True) -> ExplorationResult:
+        '''
+        Explore the states reachable from the current state of the system, breadth-first only, with the stopping conditions of `ModelChecker.explore`. `store` is a function creating the store of each worker (an `ExactStore` by default).
+
+        The numbers of states and transitions, the encoded sizes and the memory are summed over the workers, and the coverage is the lowest one.
+        '''
+        if order != "bfs":
+            raise ValueError(f"The parallel exploration is breadth-first, not '{order}'")
+
+        self._prepare()
+        initial = self._codec.encode(self._capture())
+
+        context = multiprocessing.get_context("fork")
+        barrier = context.Barrier(self.n_workers)
+        results = context.Queue()
+        inboxes = [context.Queue() for _ in range(self.n_workers)]
+        mailboxes = [Mailbox(self.mailbox_size) for _ in range(self.n_workers)]
+
+        workers = []
+        worker_results: List[Tuple] = [None] * self.n_workers
+        failed = True
+        start = time.perf_counter()
+        try:
+            for index in range(self.n_workers):
+                worker = context.Process(target=self._explore_worker, args=(index, initial, inboxes, mailboxes, barrier, max_states, store, traces, results))
+                worker.start()
+                workers.append(worker)
+
+            for _ in range(self.n_workers):
+                index, worker_result, error = results.get()
+                if error is not None:
+                    raise RuntimeError(f"Worker {index} failed: {error}")
+
+                worker_results[index] = worker_result
+            failed = False
+        finally:
+            for worker in workers:
+                if failed:
+                    worker.terminate()
+                worker.join()
+
+            for mailbox in mailboxes:
+                mailbox.close()
+
+        result = ExplorationResult()
+        result.elapsed = time.perf_counter() - start
+
+        n_state_bytes = 0
+        trail_bytes = 0
+        violations = []
+        for n_states, n_transitions, worker_state_bytes, store_bytes, coverage, worker_trail_bytes, violation, _, _ in worker_results:
+            result.n_states += n_states
+            result.n_transitions += n_transitions
+            n_state_bytes += worker_state_bytes
+            result.store_bytes += store_bytes
+            result.coverage = min(result.coverage, coverage)
+            trail_bytes += worker_trail_bytes
+            if violation is not None:
+                violations.append(violation)
+
+        result.complete = all([worker_result[7] for worker_result in worker_results])
+        result.states_per_second = result.n_states / result.elapsed if result.elapsed > 0 else 0.0
+        result.state_bytes = n_state_bytes / result.n_states
+        result.bytes_per_state = (result.store_bytes + trail_bytes) / result.n_states
+
+        if violations:
+            # The violation of the first worker which found one, as each worker stops at the first one it finds
+            name, violating, data = violations[0]
+            result.violation = name
+
+            # The moves leading to the violating state, unless a worker on the way did not send its trail
+            moves = [] if traces else None
+            while moves is not None and violating >= 0:
+                trail = worker_results[violating % self.n_workers][-1]
+                if trail is None:
+                    moves = None
+                    break
+
+                parents, movers, ordinals = trail
+                local_index = violating // self.n_workers
+                if parents[local_index] >= 0:
+                    moves.append((movers[local_index], ordinals[local_index]))
+                violating = parents[local_index]
+
+            if moves is not None:
+                choices = _Choices()
+                saved_random = random.random
+                random.random = choices
+                try:
+                    state = self._codec.decode(initial)
+                    result.trace.append((None, self.describe(state)))
+                    for mover, ordinal in reversed(moves):
+                        state = self._fire(state, mover, choices)[ordinal]
+                        result.trace.append((str(mover) + ":" + type(self._automata[mover]).__name__, self.describe(state)))
+                finally:
+                    random.random = saved_random
+            else:
+                result.trace.append((None, self.describe(self._codec.decode(data))))
+
+        return result
+
+    def _explore_worker(self, index: int, initial: bytes, inboxes: List[Any], mailboxes: List[Mailbox], barrier: Any, max_states: int, store_factory: Callable[[], Any] | None, traces: bool, results: Any):
+        try:
+            results.put((index, self._explore_partition(index, initial, inboxes, mailboxes, barrier, max_states, store_factory, traces), None))
+        except BaseException as error:
+            barrier.abort()
+            results.put((index, None, repr(error)))
+
+    def _explore_partition(self, index: int, initial: bytes, inboxes: List[Any], mailboxes: List[Mailbox], barrier: Any, max_states: int, store_factory: Callable[[], Any] | None, traces: bool) -> Tuple:
+        codec = self._codec
+        n_workers = self.n_workers
+        store = ExactStore() if store_factory is None else store_factory()
+
+        # The trail of the states owned by this worker, by local index
+        parents = array("q")
+        movers = array("l")
+        ordinals = array("l")
+
+        frontier = []
+        n_states = 0
+        n_transitions = 0
+        n_state_bytes = 0
+        violation = None
+
+        def insert(data: bytes, state: Tuple | None, parent: int, mover: int, ordinal: int) -> str | None:
+            '''
+            Add a state owned by this worker, if it is new. Return the invariant it violates, if any.
+            '''
+            nonlocal n_states, n_state_bytes
+            if not store.add(data):
+                return None
+
+            if traces:
+                parents.append(parent)
+                movers.append(mover)
+                ordinals.append(ordinal)
+            global_index = n_states * n_workers + index
+            frontier.append((global_index, data))
+            n_states += 1
+            n_state_bytes += len(data)
+
+            name = self._check(codec.decode(data) if state is None else state) if self.invariants else None
+            return None if name is None else (name, global_index, data)
+
+        choices = _Choices()
+        random.random = choices
+
+        if fingerprint(initial) % n_workers == index:
+            violation = insert(initial, None, -1, -1, 0)
+
+        round_index = 0
+        while True:
+            outgoing = [[] for _ in range(n_workers)]
+            n_batches = [0] * n_workers
+
+            level = frontier
+            frontier = []
+            for global_index, data in level:
+                if violation is not None:
+                    break
+
+                state = codec.decode(data)
+                n_successors = 0
+                for i in range(len(self._automata)):
+                    successors = self._fire(state, i, choices)
+                    n_successors += len(successors)
+                    for ordinal in range(len(successors)):
+                        successor = successors[ordinal]
+                        successor_data = codec.encode(successor)
+                        owner = fingerprint(successor_data) % n_workers
+                        if owner == index:
+                            violation = insert(successor_data, successor, global_index, i, ordinal)
+                            if violation is not None:
+                                break
+                            continue
+
+                        batch = outgoing[owner]
+                        batch.append((successor_data, global_index, i, ordinal))
+                        if len(batch) >= self.batch_size:
+                            inboxes[owner].put(batch)
+                            n_batches[owner] += 1
+                            outgoing[owner] = []
+
+                    if violation is not None:
+                        break
+
+                n_transitions += n_successors
+                if n_successors == 0 and self.deadlocks and violation is None:
+                    violation = ("deadlock", global_index, data)
+
+            for owner in range(n_workers):
+                if outgoing[owner]:
+                    inboxes[owner].put(outgoing[owner])
+                    n_batches[owner] += 1
+
+            mailboxes[index].write(round_index, (n_batches, violation, n_states, len(frontier)))
+            barrier.wait()
+
+            messages = [mailboxes[worker].read(round_index) for worker in range(n_workers)]
+            round_index += 1
+
+            for _ in range(sum([message[0][index] for message in messages])):
+                for data, parent, mover, ordinal in inboxes[index].get():
+                    found = insert(data, None, parent, mover, ordinal)
+                    if violation is None:
+                        violation = found
+
+            any_violation = any([message[1] is not None for message in messages])
+            exhausted = sum([sum(message[0]) for message in messages]) == 0 and all([message[3] == 0 for message in messages])
+            if any_violation or exhausted or 0 <= max_states <= sum([message[2] for message in messages]):
+                break
+
+        # The violations found while receiving the batches of the last round are only known by their owners, which tell the others so that they all send back their trails
+        mailboxes[index].write(round_index, violation is not None)
+        barrier.wait()
+        any_violation = any([mailboxes[worker].read(round_index) for worker in range(n_workers)])
+
+        complete = exhausted and not any_violation
+        trail = (parents, movers, ordinals) if traces and (any_violation or violation is not None) else None
+        trail_bytes = parents.itemsize * len(parents) + movers.itemsize * len(movers) + ordinals.itemsize * len(ordinals)
+        result = (n_states, n_transitions, n_state_bytes, store.memory(), store.coverage(), trail_bytes, violation, complete, trail)
+        store.close()
+
+        return result
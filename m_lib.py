@@ -1,40 +1,714 @@
 from typing import Any, Callable, Dict, List, Set, Tuple
+from array import array
+from operator import attrgetter
 import random
 import asyncio
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Port:
-    def __init__(self, s11n_code: Tuple = ("direct"), value: Any = None):
+    def __init__(self, s11n_code: Tuple = ("direct"), value: Any = None, parties: int = 2):
+        '''
+        `parties` is the number of participants synchronizing on the port, fixed when the system connects it.
+        '''
         self._value = value
         self.s11n_code = s11n_code
-        self.reqRead: bool = False
-        self.reqWrite: bool = False
-        self._rendez_vous: Dict[int, asyncio.Event] = {}
-    
-    async def set(self, ID: int):
-        if ID not in self._rendez_vous:
-            self._rendez_vous.update({ID: asyncio.Event()})
-        await self._rendez_vous[ID].set()
-    
-    async def wait(self, ID: int):
-        for key in self._rendez_vous:
-            if key != ID:
-                return await self._rendez_vous[key].wait()
+        self._reqRead: bool = False
+        self._reqWrite: bool = False
+        
+        # Rendezvous state: the participants arrived in the current round, and the future they wait on (allocated when the previous round completes)
+        self._parties = parties
+        self._arrived: int = 0
+        self._round: asyncio.Future | None = None
+
+        # Number of completed rounds
+        self.generation: int = 0
+        
+        # Incremented whenever `reqRead`, `reqWrite` or `value` changes, so that the automata can tell whether the guards reading this port need to be re-evaluated.
+        self.version: int = 0
+
+        # The callbacks of the parked components reading this port in their guards, called at its next change (see `watch`)
+        self._waiters: Dict[int, Callable[[], Any]] = {}
+    
+    @property
+    def reqRead(self) -> bool:
+        return self._reqRead
+    
+    @reqRead.setter
+    def reqRead(self, val: bool):
+        if val != self._reqRead:
+            self._reqRead = val
+            self.version += 1
+            if self._waiters:
+                self._wake()
+    
+    @property
+    def reqWrite(self) -> bool:
+        return self._reqWrite
+    
+    @reqWrite.setter
+    def reqWrite(self, val: bool):
+        if val != self._reqWrite:
+            self._reqWrite = val
+            self.version += 1
+            if self._waiters:
+                self._wake()
+    
+    def arrive(self) -> bool:
+        '''
+        Register a party at the rendezvous, and return whether it is the last one of the round (which completes the round).
+        '''
+        self._arrived += 1
+
+        if self._arrived < self._parties:
+            return False
+        
+        self._arrived = 0
+        self.generation += 1
+        return True
+
+    def _wake(self):
+        waiters = self._waiters
+        self._waiters = {}
+        for waiter in waiters.values():
+            waiter()
+
+    async def sync(self):
+        '''
+        Wait until all the parties of the port have reached the rendezvous. The last one to arrive completes the round without waiting.
+
+        A handshake costs O(1) whatever the number of parties: the waiting parties share the future of the round. Cancelling a waiting party cancels the round for all of them.
+        '''
+        if self.arrive():
+            round_ = self._round
+            if round_ is not None:
+                self._round = round_.get_loop().create_future()
+                round_.set_result(None)
+            return
+        
+        if self._round is None:
+            self._round = asyncio.get_running_loop().create_future()
+        
+        await self._round
             
     @property
     def value(self):
-        return unpack(pack(self.value, self._s11n_code))
+        return unpack(pack(self._value, self.s11n_code))
     
     @value.setter
     def value(self, val):
         self._value = val
+        self.version += 1
+        if self._waiters:
+            self._wake()
+    
+    @property
+    def shared(self):
+        '''
+        The value itself, for the immutable and copy-on-write types (see `type_tree.get_transfer_class`), whose readers never update it in place.
+        '''
+        return self._value
+    
+    @shared.setter
+    def shared(self, val):
+        self._value = val
+        self.version += 1
+        if self._waiters:
+            self._wake()
+
+# The nodes connecting the entities of a system are plain ports
+Node = Port
+
+def watch(ports: Tuple[Port, ...], key: int, callback: Callable[[], Any]):
+    '''
+    Call `callback` once, at the next change of `reqRead`, `reqWrite` or `value` of one of `ports`. `key` identifies the watcher on the ports.
+
+    A component whose guards are all false is parked this way on the ports its guards read (its `watched()`, computed by `AutomatonTranslator`): its variables are only written by its own transitions, so nothing else can enable it.
+    '''
+    def wake():
+        for port in ports:
+            port._waiters.pop(key, None)
+        callback()
+    
+    for port in ports:
+        port._waiters[key] = wake
+
+async def wait_change(ports: Tuple[Port, ...]):
+    '''
+    Wait until one of `ports` changes (see `watch`). If `ports` is empty, wait forever.
+    '''
+    future = asyncio.get_running_loop().create_future()
+    watch(ports, id(future), lambda: future.set_result(None))
+
+    try:
+        await future
+    finally:
+        for port in ports:
+            port._waiters.pop(id(future), None)
+
+class Channel:
+    '''
+    The bounded buffer of an asynchronous connection (`Async, <buffer>, ...`): a FIFO ring of `capacity` preallocated slots. The values are copied in with the s11n code of the connection, like `Port.value`.
+
+    `push` refuses a value when the buffer is full and `put` waits for a free slot (backpressure). `pop` raises IndexError when the buffer is empty and `get` waits for a value. `push_many` and `pop_many` move a batch at once.
+    '''
+    def __init__(self, s11n_code: Tuple | str = ("direct"), capacity: int = 1):
+        if capacity < 1:
+            raise ValueError(f"The capacity of a channel must be positive, not {capacity}")
+
+        self.s11n_code = s11n_code
+        self.capacity = capacity
+        self._slots: List[Any] = [None] * capacity
+        self._copy = s11n_code != "direct"
+
+        # The numbers of values popped and pushed so far: the n-th value is in the slot n % capacity
+        self._head: int = 0
+        self._tail: int = 0
+
+        # The future of the parties waiting in `put` or `get`, completed by the next push or pop
+        self._change: asyncio.Future | None = None
+
+        # Incremented by every push and pop, like `Port.version`
+        self.version: int = 0
+
+    def __len__(self) -> int:
+        return self._tail - self._head
+
+    def push(self, value: Any) -> bool:
+        '''
+        Append a value, unless the buffer is full. Return whether it was appended.
+        '''
+        tail = self._tail
+        if tail - self._head == self.capacity:
+            return False
+
+        self._slots[tail % self.capacity] = convert(value, self.s11n_code) if self._copy else value
+        self._tail = tail + 1
+        self.version += 1
+        if self._change is not None:
+            self._notify()
+
+        return True
+
+    def pop(self) -> Any:
+        head = self._head
+        if head == self._tail:
+            raise IndexError("pop from an empty channel")
+
+        slot = head % self.capacity
+        value = self._slots[slot]
+        self._slots[slot] = None
+        self._head = head + 1
+        self.version += 1
+        if self._change is not None:
+            self._notify()
+
+        return value
+
+    def push_many(self, values: List[Any]) -> int:
+        '''
+        Append the first values of `values` fitting in the buffer. Return how many were appended.
+        '''
+        capacity = self.capacity
+        n = min(len(values), capacity - (self._tail - self._head))
+        if n <= 0:
+            return 0
+
+        values = [convert(value, self.s11n_code) for value in values[:n]] if self._copy else values[:n]
+
+        # The free slots are at most two ranges: up to the end of the ring, then from its start
+        start = self._tail % capacity
+        first = min(n, capacity - start)
+        self._slots[start:start + first] = values[:first]
+        self._slots[:n - first] = values[first:]
+
+        self._tail += n
+        self.version += 1
+        if self._change is not None:
+            self._notify()
+
+        return n
+
+    def pop_many(self, max_count: int = -1) -> List[Any]:
+        '''
+        Remove and return the oldest values, at most `max_count` of them (all of them if negative).
+        '''
+        capacity = self.capacity
+        n = self._tail - self._head
+        if 0 <= max_count < n:
+            n = max_count
+        if n == 0:
+            return []
+
+        start = self._head % capacity
+        first = min(n, capacity - start)
+        slots = self._slots
+        values = slots[start:start + first] + slots[:n - first]
+        slots[start:start + first] = [None] * first
+        slots[:n - first] = [None] * (n - first)
+
+        self._head += n
+        self.version += 1
+        if self._change is not None:
+            self._notify()
+
+        return values
+
+    async def put(self, value: Any):
+        while not self.push(value):
+            await self._wait()
+
+    async def get(self) -> Any:
+        while self._head == self._tail:
+            await self._wait()
+
+        return self.pop()
+
+    def _wait(self) -> asyncio.Future:
+        if self._change is None:
+            self._change = asyncio.get_running_loop().create_future()
+
+        return self._change
+
+    def _notify(self):
+        change = self._change
+        self._change = None
+        change.set_result(None)
+
+class Pipeline:
+    '''
+    The automata of an acyclic part of a system, stepped as a single component in the topological order of their data flow (computed by `SystemTranslator`), so that a value written by a stage is read by the next stages in the same step.
+
+    The synchronizations of the stages are completed here, by counting the arrivals on the ports: their parties are all stages of the pipeline, so no party is woken by the event loop or the scheduler. A stage waiting for a synchronization is skipped until the round of its port has been completed by a later stage.
+    '''
+    def __init__(self, *stages: Any):
+        self.stages = stages
+        self._steps = [stage.step for stage in stages]
+
+        # Ports still to synchronize by each stage, the index of the next one, and the round the stage waits for (-1 if it does not wait)
+        self._pending: List[Tuple] = [()] * len(stages)
+        self._positions = [0] * len(stages)
+        self._rounds = [-1] * len(stages)
+
+    def step(self):
+        '''
+        Step every stage once. Return None if no stage fired a transition or made progress in a synchronization, and () otherwise.
+        '''
+        pending = self._pending
+        positions = self._positions
+        rounds = self._rounds
+        fired = False
+
+        for i in range(len(self._steps)):
+            ports = pending[i]
+            if ports:
+                k = positions[i]
+                if ports[k].generation == rounds[i]:
+                    continue
+
+                k += 1
+            else:
+                ports = self._steps[i]()
+                if ports is None:
+                    continue
+
+                fired = True
+                if not ports:
+                    continue
+
+                k = 0
+
+            fired = True
+            while k < len(ports):
+                port = ports[k]
+                round_ = port.generation
+                if not port.arrive():
+                    rounds[i] = round_
+                    break
+
+                k += 1
+
+            if k < len(ports):
+                pending[i] = ports
+                positions[i] = k
+            else:
+                pending[i] = ()
+
+        return () if fired else None
+
+    def watched(self) -> Tuple[Port, ...]:
+        '''
+        The ports read by the guards of the stages. When no stage fired, the synchronizations in progress wait for stages of the pipeline, so only a change of these ports can make progress.
+        '''
+        return tuple(dict.fromkeys([port for stage in self.stages for port in stage.watched()]))
+
+    async def run(self):
+        step = self.step
+        watched = self.watched()
+        while True:
+            if step() is None:
+                await wait_change(watched)
+                continue
+            await asyncio.sleep(0)
+
+class Batch:
+    '''
+    Many instances of an automaton, run as a single component (generated by `translator.BatchTranslator`). Each variable is a numpy column with an entry per instance, and each port parameter a tuple with a port per instance.
+
+    A step evaluates every guard for all the instances at once, as boolean masks (`guards()`), and fires in each instance the first enabled transition after the last one it fired, like the `step()` of the automaton. The statements of a guarded statement are masked assignments to the columns (`f_fns`, taking the mask of the firing instances); the ports are read and written entry by entry (see `gather` and `scatter`). In a group of guarded statements, each instance chooses one of its enabled statements uniformly at random, from a generator seeded by `random` (and so by the scheduler).
+    '''
+    # The guarded statements of each transition, and the port parameters read by the guards
+    groups: Tuple[Tuple[int, ...], ...] = ()
+    watched_ports: Tuple[str, ...] = ()
+    f_fns: Tuple[Callable, ...] = ()
+
+    def __init__(self, n: int):
+        if numpy is None:
+            raise ImportError("numpy is needed to run a batch")
+        
+        self.n = n
+        self.pc = numpy.zeros(n, numpy.int64)
+        self._offsets = numpy.arange(len(self.groups))[:, None]
+        self._rng = None
+
+    def guards(self) -> Tuple[Any, ...]:
+        return ()
+
+    def step(self):
+        '''
+        Step every instance once. Return None if no instance fired a transition, and () otherwise.
+        '''
+        groups = self.groups
+        n_transitions = len(groups)
+        if n_transitions == 0:
+            return None
+        
+        masks = self.guards()
+        enabled = numpy.empty((n_transitions, self.n), bool)
+        for t in range(n_transitions):
+            group = groups[t]
+            if len(group) == 1:
+                enabled[t] = masks[group[0]]
+            else:
+                numpy.logical_or.reduce([masks[g] for g in group], out=enabled[t])
+        
+        # The rank of each transition after the last fired one, the disabled ones last
+        ranks = (self._offsets - self.pc) % n_transitions
+        ranks[~enabled] = n_transitions
+        chosen = ranks.argmin(0)
+        fired = numpy.take_along_axis(enabled, chosen[None, :], 0)[0]
+        if not fired.any():
+            return None
+        
+        numpy.copyto(self.pc, (chosen + 1) % n_transitions, where=fired)
+
+        for t in range(n_transitions):
+            mask = fired & (chosen == t) if n_transitions > 1 else fired
+            if not mask.any():
+                continue
+            
+            group = groups[t]
+            if len(group) == 1:
+                self.f_fns[group[0]](self, mask)
+                continue
+            
+            # The index of the chosen statement among the enabled ones of each instance
+            if self._rng is None:
+                self._rng = numpy.random.default_rng(random.getrandbits(64))
+            counts = numpy.zeros(self.n, numpy.int64)
+            for g in group:
+                counts += masks[g]
+            choices = (self._rng.random(self.n) * counts).astype(numpy.int64)
+
+            for g in group:
+                g_mask = mask & masks[g] & (choices == 0)
+                choices -= masks[g]
+                if g_mask.any():
+                    self.f_fns[g](self, g_mask)
+        
+        return ()
+
+    def watched(self) -> Tuple[Port, ...]:
+        return tuple([port for name in self.watched_ports for port in getattr(self, name)])
+
+    async def run(self):
+        step = self.step
+        watched = self.watched()
+        while True:
+            if step() is None:
+                await wait_change(watched)
+                continue
+            await asyncio.sleep(0)
+
+# The attributes read by `gather` for the fields of the ports, without the properties
+GATHERED_ATTRIBUTES = {"shared": "_value", "reqRead": "_reqRead", "reqWrite": "_reqWrite"}
+
+def gather(ports: Tuple[Port, ...], field: str, dtype: Any) -> Any:
+    '''
+    The column of the `field` ("shared", "reqRead" or "reqWrite") of the ports of a batch.
+    '''
+    return numpy.fromiter(map(attrgetter(GATHERED_ATTRIBUTES[field]), ports), dtype, len(ports))
+
+def scatter(ports: Tuple[Port, ...], field: str, mask: Any, values: Any):
+    '''
+    Write the entries of `values` (a column or a scalar) selected by `mask` to the `field` of the ports of a batch.
+    '''
+    indices = numpy.flatnonzero(mask).tolist()
+    values = numpy.broadcast_to(values, mask.shape)[mask].tolist()
+    for i, value in zip(indices, values):
+        setattr(ports[i], field, value)
+
+def check_bounded_column(values: Any, mask: Any, l: int, r: int) -> Any:
+    '''
+    The vectorized `check_bounded` of a batch, for the entries of `values` (a column or a scalar) selected by `mask`.
+    '''
+    selected = numpy.broadcast_to(values, mask.shape)[mask]
+    if selected.size and (selected.min() < l or selected.max() > r):
+        value = selected[(selected < l) | (selected > r)][0]
+        raise ValueError(f"Value {value} is not an integer between {l} and {r}")
+    
+    return values
+
+class Scheduler:
+    '''
+    Runs the components of a system translated with `state_classes`: the generated system function creates the components and `add`s them to a scheduler.
+
+    `seed` seeds the choices among the enabled statements of the transition groups.
+    '''
+    def __init__(self, seed: Any = None):
+        self.seed = seed
+        self._components: List[Any] = []
+        self._priorities: List[int] = []
+
+        # The ports each component is connected to
+        self._ports: List[Tuple[Port, ...]] = []
+    
+    def add(self, component: Any, priority: int = 0, ports: Tuple[Port, ...] = ()):
+        self._components.append(component)
+        self._priorities.append(priority)
+        self._ports.append(tuple(ports))
+    
+    def spawn(self, entity: Any, *ports: Port):
+        '''
+        Add an automaton (a class) connected to `ports`, or the components of a system (a function).
+        '''
+        if isinstance(entity, type):
+            self.add(entity(*ports), ports=ports)
+        else:
+            entity(self, *ports)
+
+class AsyncioScheduler(Scheduler):
+    '''
+    Runs every component as an asyncio task driving its `step()`, in the order they were added.
+    '''
+    async def run(self):
+        random.seed(self.seed)
+
+        async with asyncio.TaskGroup() as tg:
+            for component in self._components:
+                tg.create_task(component.run())
+
+class RoundScheduler(Scheduler):
+    '''
+    Runs the components in a plain loop, without the event loop. Each round steps every ready component once, in the order they were added, or by decreasing priority if they have different ones.
+
+    A component whose step reaches a synchronization is not ready until every party of the port has arrived. The parties released by the last one are ready in the next round, in their order of arrival. With the default priorities, this is the order in which the asyncio event loop runs the tasks of `AsyncioScheduler`, so both give the same runs for the same seed.
+
+    A component whose step fires no transition is parked on its `watched()` ports (see `watch`), and is ready in the round after one of them changes, like the `run()` of the generated automata waiting in `wait_change`. An idle system takes no step.
+    '''
+    def run(self, max_steps: int) -> int:
+        '''
+        Run until `max_steps` steps have been taken, no component is ready (all wait for a synchronization or are parked), or a round fires no transition (the system is idle). Return the number of steps taken.
+        '''
+        self.start()
+        n_steps, _ = self.run_rounds(max_steps)
+        
+        return n_steps
+
+    def start(self):
+        random.seed(self.seed)
+
+        n = len(self._components)
+        self._steps = [component.step for component in self._components]
+        self._by_priority = len(set(self._priorities)) > 1
+
+        # Ports still to synchronize by each component, and the index of the next one
+        self._pending: List[Tuple] = [()] * n
+        self._positions = [0] * n
+
+        # id(port) -> the components waiting for the current round of the port
+        self._waiting: Dict[int, List[int]] = {}
+
+        # The ports each component is parked on when it fires nothing (None if it does not tell, then it is stepped again in the next round), and the parked components woken since
+        self._watched = [tuple(component.watched()) if hasattr(component, "watched") else None for component in self._components]
+        self._woken: List[int] = []
+        self._wakers = [lambda i=i: self._woken.append(i) for i in range(n)]
+
+        self.ready = list(range(n))
+
+    def release(self, port: Port):
+        '''
+        Make the parties waiting for the round of `port` ready, once it is completed.
+        '''
+        self.ready += self._waiting.pop(id(port), ())
+
+    def run_rounds(self, max_steps: int, max_rounds: int = -1) -> Tuple[int, bool]:
+        '''
+        Run at most `max_rounds` rounds (no limit if negative), with the stopping conditions of `run`. Return the number of steps and whether the last round fired a transition.
+        '''
+        steps = self._steps
+        pending = self._pending
+        positions = self._positions
+        waiting = self._waiting
+        priorities = self._priorities
+        by_priority = self._by_priority
+        watched = self._watched
+        wakers = self._wakers
+        components = self._components
+        woken = self._woken
+
+        # The components woken between the calls (by `PartitionedScheduler`)
+        self.ready += woken
+        woken.clear()
+
+        ready = self.ready
+        n_steps = 0
+        fired = False
+        while ready and max_rounds != 0:
+            max_rounds -= 1
+            if by_priority:
+                ready.sort(key=lambda i: -priorities[i])
+            
+            next_ready = []
+            fired = False
+            for i in ready:
+                ports = pending[i]
+                if not ports:
+                    if n_steps == max_steps:
+                        # The components not stepped in this round (each is ready at most once)
+                        self.ready = next_ready + ready[ready.index(i):]
+                        return n_steps, fired
+                    
+                    n_steps += 1
+                    ports = steps[i]()
+                    if woken:
+                        next_ready += woken
+                        woken.clear()
+                    
+                    if ports is None:
+                        if watched[i] is None:
+                            next_ready.append(i)
+                        else:
+                            watch(watched[i], id(components[i]), wakers[i])
+                        continue
+                    
+                    fired = True
+                    if not ports:
+                        next_ready.append(i)
+                        continue
+                    
+                    pending[i] = ports
+                    positions[i] = 0
+                
+                fired = True
+                k = positions[i]
+                while k < len(ports):
+                    port = ports[k]
+                    k += 1
+                    if port.arrive():
+                        next_ready += waiting.pop(id(port), ())
+                    else:
+                        waiting.setdefault(id(port), []).append(i)
+                        break
+                else:
+                    pending[i] = ()
+                    next_ready.append(i)
+                
+                positions[i] = k
+            
+            ready = next_ready
+            if not fired:
+                break
+        
+        self.ready = ready
+        return n_steps, fired
+
+class MInt(int):
+    '''
+    Boxed integer, only used by the code generated in checked mode.
+    '''
+    pass
+
+class MReal(float):
+    '''
+    Boxed real, only used by the code generated in checked mode.
+    '''
+    pass
+
+def MBool(value: Any) -> bool:
+    # bool cannot be subclassed
+    return bool(value)
+
+class MChar(str):
+    '''
+    Boxed character, only used by the code generated in checked mode.
+    '''
+    def __new__(cls, value: str):
+        if len(value) != 1:
+            raise ValueError(f"'{value}' is not a single character")
+        
+        return super().__new__(cls, value)
+
+class MRecord:
+    '''
+    Base class of the struct values. The generated code defines a subclass per layout, whose `__slots__` are the fields.
+    '''
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The last class defined for a layout (the generated one, rather than one made by `record_class` before) builds the unpacked records
+        RECORD_CLASSES[tuple(cls.__slots__)] = cls
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def __eq__(self, other):
+        # Records of the same layout are equal whatever their class, which depends on where they were created
+        if not isinstance(other, MRecord) or tuple(self.__slots__) != tuple(other.__slots__):
+            return NotImplemented
+        
+        return all([getattr(self, field) == getattr(other, field) for field in self.__slots__])
+    
+    __hash__ = None
+
+    def __repr__(self):
+        return "struct {" + ", ".join([f"{field} = {getattr(self, field)!r}" for field in self.__slots__]) + "}"
+
+# Layout (tuple of the field names) -> record class
+RECORD_CLASSES: Dict[Tuple[str, ...], type] = {}
+
+def record_class(fields: Tuple[str, ...]) -> type:
+    '''
+    Get the record class of a layout, creating it if the generated code does not define one.
+    '''
+    if fields not in RECORD_CLASSES:
+        type("struct", (MRecord,), {"__slots__": fields})
+    
+    return RECORD_CLASSES[fields]
 
 class MUnion:
     def __init__(self, label: int, value: Any):
         self.label = label
         self.value = value
 
-def pack(data: Any, s11n_code: Tuple) -> Any:
-    mode = s11n_code[0]
+def pack(data: Any, s11n_code: Tuple | str) -> Any:
+    # ("direct") is just the string "direct"
+    mode = s11n_code if isinstance(s11n_code, str) else s11n_code[0]
 
     if mode == "direct":
         return ("direct", data)
@@ -67,6 +741,10 @@ def pack(data: Any, s11n_code: Tuple) -> Any:
     if mode == "array":
         assert len(data) <= s11n_code[1]
         
+        if isinstance(data, array) and is_buffer_code(s11n_code[2]):
+            # Padded with zeros, like the entries of a new buffer
+            return ("buffer", copy_buffer(check_buffer(data, s11n_code[2]), data.typecode, s11n_code[1]))
+        
         result = []
         for i in range(len(data)):
             result.append(pack(data[i], s11n_code[2]))
@@ -78,6 +756,9 @@ def pack(data: Any, s11n_code: Tuple) -> Any:
         return tuple(["list"] + result)
     
     if mode == "list":
+        if isinstance(data, array) and is_buffer_code(s11n_code[1]):
+            return ("buffer", check_buffer(data, s11n_code[1])[:])
+        
         result = []
         for i in range(len(data)):
             result.append(pack(data[i], s11n_code[1]))
@@ -98,8 +779,8 @@ def pack(data: Any, s11n_code: Tuple) -> Any:
     if mode == "struct":
         result = []
         for i in range(1, len(s11n_code)):
-            field, field_s11n_code = mode
-            result.append((field, pack(data[field], field_s11n_code)))
+            field, field_s11n_code = s11n_code[i]
+            result.append((field, pack(getattr(data, field), field_s11n_code)))
         
         return tuple(["struct"] + result)
     
@@ -124,10 +805,15 @@ def unpack(s11n: Tuple) -> Any:
     if mode == "union":
         return MUnion(s11n[1], unpack(s11n[2]))
     
+    if mode == "buffer":
+        # Already a private copy made by `pack`
+        return s11n[1]
+    
     if mode == "list":
         result = []
         for i in range(1, len(s11n)):
-            result.append(unpack(s11n[i]))
+            # The padding of an array stays empty
+            result.append(None if s11n[i] is None else unpack(s11n[i]))
         
         return result
     
@@ -143,14 +829,93 @@ def unpack(s11n: Tuple) -> Any:
         return result
     
     if mode == "struct":
-        result = {}
+        fields = []
+        values = []
         for i in range(1, len(s11n)):
-            key, value = s11n[i][0], unpack(s11n[i][1])
-            result.update({key: value})
+            fields.append(s11n[i][0])
+            values.append(unpack(s11n[i][1]))
         
-        return result
+        return record_class(tuple(fields))(*values)
     
     raise ValueError("Invalid serialization data!")
 
-def convert(data: Any, s11n_code: str) -> Any:
+def convert(data: Any, s11n_code: Tuple | str) -> Any:
     return unpack(pack(data, s11n_code))
+
+def check_bounded(data: int, l: int, r: int) -> int:
+    '''
+    The only runtime check kept by the unboxed code for a ("bounded", l, r) coercion.
+    '''
+    if not (l <= data and data <= r):
+        raise ValueError(f"Value {data} is not an integer between {l} and {r}")
+    
+    return data
+
+# Below this length, the builtin min/max are cheaper than going through numpy
+NUMPY_MIN_LENGTH = 256
+
+def is_buffer_code(s11n_code: Tuple | str) -> bool:
+    '''
+    Whether the entries of an array can stay in its buffer when serialized with `s11n_code`.
+    '''
+    return s11n_code == "direct" or s11n_code[0] == "bounded"
+
+def get_bounds(data: Any) -> Tuple[Any, Any]:
+    '''
+    The smallest and the largest entry of a non-empty array.
+    '''
+    if numpy is not None and type(data) is array and len(data) >= NUMPY_MIN_LENGTH:
+        view = numpy.frombuffer(data, dtype=data.typecode)
+        return view.min(), view.max()
+    
+    return min(data), max(data)
+
+def check_buffer(data: Any, s11n_code: Tuple | str) -> Any:
+    '''
+    Check the ("bounded", l, r) code of every entry of `data` with a single min/max pass.
+    '''
+    if s11n_code != "direct" and len(data) > 0:
+        _, l, r = s11n_code
+        lowest, highest = get_bounds(data)
+        if lowest < l or r < highest:
+            raise ValueError(f"Value {lowest if lowest < l else highest} is not an integer between {l} and {r}")
+    
+    return data
+
+def copy_buffer(data: Any, typecode: str, length: int | None = None) -> array:
+    '''
+    Copy an array into a new buffer. A buffer of the same typecode is copied at once, anything else is converted entry by entry.
+
+    length: the length of the array type converted to, whose buffers are padded with zeros like the entries without initial value
+    '''
+    if length is not None and len(data) > length:
+        raise ValueError(f"Array of length {len(data)} does not fit in an array of length {length}")
+    
+    if type(data) is array and data.typecode == typecode:
+        buffer = data[:]
+    else:
+        buffer = array(typecode, data)
+    
+    if length is not None and len(buffer) < length:
+        buffer.extend(array(typecode, [0]) * (length - len(buffer)))
+    
+    return buffer
+
+def check_bounded_buffer(data: Any, typecode: str, l: int, r: int, length: int | None = None) -> array:
+    '''
+    The vectorized `check_bounded` of the unboxed code, for the numeric arrays.
+    '''
+    # Checked before the copy, which could not hold the out of range entries
+    return copy_buffer(check_buffer(data, ("bounded", l, r)), typecode, length)
+
+def copy_value(data: Any) -> Any:
+    '''
+    Copy a copy-on-write value (a buffer, list, map or record whose entries are immutable) before it is updated in place.
+    '''
+    if isinstance(data, MRecord):
+        return type(data)(*[getattr(data, field) for field in data.__slots__])
+    
+    if isinstance(data, dict):
+        return data.copy()
+    
+    return data[:]
@@ -0,0 +1,848 @@
+'''
+Partitioned execution of the systems translated with `state_classes`: the components are split across worker processes, and the ports connecting components of different partitions are carried over shared memory. Or they are run by a pool of threads sharing the ports (see `ThreadScheduler`), which run in parallel on the free-threaded builds of CPython.
+
+Also the channels of the asynchronous connections shared between processes (see `SharedChannel`).
+'''
+from typing import Any, Callable, Dict, List, Tuple
+from collections import deque
+from multiprocessing import shared_memory
+from array import array
+import multiprocessing
+import threading
+import asyncio
+import random
+import pickle
+import struct
+import os
+import sys
+from m_lib import Port, Scheduler, RoundScheduler, check_bounded, check_buffer, record_class
+
+def partition(components_ports: List[Tuple[int, ...]], n_parts: int, imbalance: float = 0.03, n_passes: int = 8) -> List[int]:
+    '''
+    Split the components into `n_parts` partitions of balanced sizes, with few ports connecting several partitions. `components_ports[i]` lists the ports (numbered from 0) of the i-th component. Return the partition of each component.
+
+    The ports are the hyperedges of the graph, and the cut is their connectivity (see `get_cut`). The partitions are first grown by a breadth-first search, then refined by passes moving single components to the partition of their neighbours while the cut decreases, keeping every partition under `imbalance` above the average size.
+    '''
+    n = len(components_ports)
+    components_ports = [tuple(set(ports)) for ports in components_ports]
+    if n_parts <= 1 or n == 0:
+        return [0] * n
+
+    port_members: Dict[int, List[int]] = {}
+    for i in range(n):
+        for port in components_ports[i]:
+            port_members.setdefault(port, []).append(i)
+
+    # Breadth-first order, so that the consecutive components are close in the graph. Every port is expanded once.
+    order = []
+    seen = [False] * n
+    expanded = set()
+    for root in range(n):
+        if seen[root]:
+            continue
+
+        seen[root] = True
+        queue = deque([root])
+        while queue:
+            i = queue.popleft()
+            order.append(i)
+            for port in components_ports[i]:
+                if port in expanded:
+                    continue
+
+                expanded.add(port)
+                for j in port_members[port]:
+                    if not seen[j]:
+                        seen[j] = True
+                        queue.append(j)
+
+    capacity = -(-n // n_parts)
+    parts = [0] * n
+    for position in range(n):
+        parts[order[position]] = position // capacity
+
+    max_size = max(capacity, int(n / n_parts * (1 + imbalance)))
+    sizes = [0] * n_parts
+    for part in parts:
+        sizes[part] += 1
+
+    # Port -> number of its components in each partition
+    counts = {port: [0] * n_parts for port in port_members}
+    for i in range(n):
+        for port in components_ports[i]:
+            counts[port][parts[i]] += 1
+
+    for _ in range(n_passes):
+        n_moved = 0
+        for i in range(n):
+            a = parts[i]
+            ports = components_ports[i]
+
+            # Moving i from a to b leaves the ports where i is alone in a, and enters the ports without component in b
+            leaving = 0
+            connections = [0] * n_parts
+            for port in ports:
+                count = counts[port]
+                if count[a] == 1:
+                    leaving += 1
+                for b in range(n_parts):
+                    if count[b] > 0:
+                        connections[b] += 1
+
+            best_part, best_gain = a, 0
+            for b in range(n_parts):
+                if b == a or connections[b] == 0 or sizes[b] >= max_size:
+                    continue
+
+                gain = leaving - (len(ports) - connections[b])
+                if gain > best_gain or (gain == best_gain and best_part != a and sizes[b] < sizes[best_part]):
+                    best_part, best_gain = b, gain
+
+            if best_part == a:
+                continue
+
+            for port in ports:
+                counts[port][a] -= 1
+                counts[port][best_part] += 1
+            sizes[a] -= 1
+            sizes[best_part] += 1
+            parts[i] = best_part
+            n_moved += 1
+
+        if n_moved == 0:
+            break
+
+    return parts
+
+def get_cut(components_ports: List[Tuple[int, ...]], parts: List[int]) -> int:
+    '''
+    The sum, over the ports, of the number of partitions they connect minus one.
+    '''
+    port_parts: Dict[int, set] = {}
+    for i in range(len(components_ports)):
+        for port in components_ports[i]:
+            port_parts.setdefault(port, set()).add(parts[i])
+
+    return sum([len(port_parts_set) - 1 for port_parts_set in port_parts.values()])
+
+class ChannelPort(Port):
+    '''
+    A port connecting components of different partitions (see `PartitionedScheduler`). Its updates reach the other partitions at the end of the round, and its rendezvous are completed by the exchange between the rounds.
+
+    `written` holds the fields (`_value`, `_reqRead`, `_reqWrite`) set in the current round, which are the only ones sent to the other partitions: a partition does not overwrite with its stale copy a field updated by another one.
+    '''
+    def arrive(self) -> bool:
+        self.arrivals += 1
+        return False
+
+    def _set_value(self, val):
+        self._value = val
+        self.version += 1
+        self.written.add("_value")
+        if self._waiters:
+            self._wake()
+
+    def _set_reqRead(self, val: bool):
+        if val != self._reqRead:
+            self._reqRead = val
+            self.version += 1
+            self.written.add("_reqRead")
+            if self._waiters:
+                self._wake()
+
+    def _set_reqWrite(self, val: bool):
+        if val != self._reqWrite:
+            self._reqWrite = val
+            self.version += 1
+            self.written.add("_reqWrite")
+            if self._waiters:
+                self._wake()
+
+    value = property(Port.value.fget, _set_value)
+    shared = property(Port.shared.fget, _set_value)
+    reqRead = property(Port.reqRead.fget, _set_reqRead)
+    reqWrite = property(Port.reqWrite.fget, _set_reqWrite)
+
+def get_port_updates(channel_ports: List[ChannelPort]) -> List[Tuple[int, Dict[str, Any] | None, int]]:
+    '''
+    The updates of the channel ports in the current round, as (index of the port, new values of the fields written, number of parties arrived), and reset them.
+    '''
+    updates = []
+    for k in range(len(channel_ports)):
+        port = channel_ports[k]
+        if port.written or port.arrivals:
+            updates.append((k, {field: getattr(port, field) for field in port.written} if port.written else None, port.arrivals))
+            port.written = set()
+            port.arrivals = 0
+
+    return updates
+
+def apply_port_fields(port: ChannelPort, fields: Dict[str, Any]):
+    '''
+    Apply the fields written by another partition (see `get_port_updates`).
+    '''
+    for field, val in fields.items():
+        setattr(port, field, val)
+    port.version += 1
+    if port._waiters:
+        # The parked components of this partition are ready in the next round
+        port._wake()
+
+# The struct formats of the integers, from the smallest, with the range of their values
+INT_FORMATS: List[Tuple[str, int, int]] = []
+for _format in ("b", "B", "h", "H", "i", "I", "q", "Q"):
+    _n_bits = 8 * struct.calcsize("<" + _format)
+    if _format.islower():
+        INT_FORMATS.append((_format, -(1 << (_n_bits - 1)), (1 << (_n_bits - 1)) - 1))
+    else:
+        INT_FORMATS.append((_format, 0, (1 << _n_bits) - 1))
+
+def get_slot_format(s11n_code: Tuple | str) -> str | None:
+    '''
+    The `struct` format of the values serialized with `s11n_code`, if they have a fixed layout: the bounded ints, and the tuples, structs and arrays of them. Otherwise, return None.
+
+    An array is stored as all its entries, padded with zeros like the buffers of `m_lib.pack`.
+    '''
+    if s11n_code == "direct":
+        return None
+
+    mode = s11n_code[0]
+    if mode == "bounded":
+        _, l, r = s11n_code
+        for format_, format_l, format_r in INT_FORMATS:
+            if format_l <= l and r <= format_r:
+                return format_
+
+        return None
+
+    if mode in ("tuple", "struct"):
+        formats = []
+        for component in s11n_code[1:]:
+            formats.append(get_slot_format(component if mode == "tuple" else component[1]))
+        if None in formats:
+            return None
+
+        return "".join(formats)
+
+    if mode == "array":
+        entry_format = get_slot_format(s11n_code[2])
+        if entry_format is None or len(entry_format) != 1:
+            return None
+
+        return entry_format * s11n_code[1]
+
+    return None
+
+def _flatten(value: Any, s11n_code: Tuple | str, fields: List[Any]):
+    mode = s11n_code[0]
+    if mode == "bounded":
+        fields.append(check_bounded(value, s11n_code[1], s11n_code[2]))
+    elif mode == "tuple":
+        assert len(value) + 1 == len(s11n_code)
+        for i in range(1, len(s11n_code)):
+            _flatten(value[i - 1], s11n_code[i], fields)
+    elif mode == "struct":
+        for field, field_s11n_code in s11n_code[1:]:
+            _flatten(getattr(value, field), field_s11n_code, fields)
+    else:
+        _, length, entry_s11n_code = s11n_code
+        if len(value) > length:
+            raise ValueError(f"Array of length {len(value)} does not fit in an array of length {length}")
+        fields.extend(check_buffer(value, entry_s11n_code))
+        fields.extend([0] * (length - len(value)))
+
+def _build(fields: Tuple, position: int, s11n_code: Tuple | str) -> Tuple[Any, int]:
+    '''
+    The value starting at `fields[position]`, and the position following it. The values are those `m_lib.unpack` gives.
+    '''
+    mode = s11n_code[0]
+    if mode == "bounded":
+        return fields[position], position + 1
+
+    if mode == "tuple":
+        result = []
+        for i in range(1, len(s11n_code)):
+            component, position = _build(fields, position, s11n_code[i])
+            result.append(component)
+
+        return result, position
+
+    if mode == "struct":
+        names = []
+        values = []
+        for field, field_s11n_code in s11n_code[1:]:
+            value, position = _build(fields, position, field_s11n_code)
+            names.append(field)
+            values.append(value)
+
+        return record_class(tuple(names))(*values), position
+
+    _, length, entry_s11n_code = s11n_code
+    entries = array(get_slot_format(entry_s11n_code), fields[position:position + length])
+
+    return entries, position + length
+
+# The head and the tail counters of a `SharedChannel`, each in its own cache line
+CHANNEL_HEADER_SIZE = 128
+HEAD_INDEX = 0
+TAIL_INDEX = 8
+
+class SharedChannel:
+    '''
+    A `m_lib.Channel` between two processes, in a shared memory block: one process pushes the values and the other pops them. The slots have the layout given by the s11n code (see `get_slot_format`), or else hold the pickled values of at most `slot_size` bytes.
+
+    Only the producer writes the tail counter and only the consumer writes the head counter, so no lock is needed: a slot is written before the tail covering it (this relies on the stores being seen in order, as on x86). `put` and `get` poll the counters, yielding to the event loop between two tries.
+
+    `name` attaches to the block of an existing channel, which is how the channels are sent to other processes. Only the process creating the block unlinks it in `close`.
+    '''
+    def __init__(self, s11n_code: Tuple | str = ("direct"), capacity: int = 1, slot_size: int = 256, name: str | None = None):
+        if capacity < 1:
+            raise ValueError(f"The capacity of a channel must be positive, not {capacity}")
+
+        self.s11n_code = s11n_code
+        self.capacity = capacity
+        self.slot_size = slot_size
+
+        slot_format = get_slot_format(s11n_code)
+        self._pickled = slot_format is None
+        self._scalar = s11n_code != "direct" and s11n_code[0] == "bounded"
+        self._slot = struct.Struct("<" + (f"I{slot_size}s" if self._pickled else slot_format))
+
+        # The process creating the block (the processes forked from it inherit the channel too)
+        self._owner = os.getpid() if name is None else None
+        if name is None:
+            self._memory = shared_memory.SharedMemory(create=True, size=CHANNEL_HEADER_SIZE + capacity * self._slot.size)
+            self._memory.buf[:CHANNEL_HEADER_SIZE] = bytes(CHANNEL_HEADER_SIZE)
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+        self._counters = self._memory.buf[:CHANNEL_HEADER_SIZE].cast("Q")
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def __reduce__(self):
+        return (SharedChannel, (self.s11n_code, self.capacity, self.slot_size, self.name))
+
+    def __len__(self) -> int:
+        counters = self._counters
+        return counters[TAIL_INDEX] - counters[HEAD_INDEX]
+
+    def _write(self, index: int, value: Any):
+        offset = CHANNEL_HEADER_SIZE + (index % self.capacity) * self._slot.size
+        if self._pickled:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            if len(data) > self.slot_size:
+                raise ValueError(f"The value takes {len(data)} bytes, more than the slot size {self.slot_size}")
+
+            self._slot.pack_into(self._memory.buf, offset, len(data), data)
+        elif self._scalar:
+            self._slot.pack_into(self._memory.buf, offset, check_bounded(value, self.s11n_code[1], self.s11n_code[2]))
+        else:
+            fields = []
+            _flatten(value, self.s11n_code, fields)
+            self._slot.pack_into(self._memory.buf, offset, *fields)
+
+    def _read(self, index: int) -> Any:
+        offset = CHANNEL_HEADER_SIZE + (index % self.capacity) * self._slot.size
+        fields = self._slot.unpack_from(self._memory.buf, offset)
+        if self._pickled:
+            return pickle.loads(fields[1][:fields[0]])
+        if self._scalar:
+            return fields[0]
+
+        value, _ = _build(fields, 0, self.s11n_code)
+        return value
+
+    def push(self, value: Any) -> bool:
+        '''
+        Append a value, unless the buffer is full. Return whether it was appended.
+        '''
+        counters = self._counters
+        tail = counters[TAIL_INDEX]
+        if tail - counters[HEAD_INDEX] == self.capacity:
+            return False
+
+        self._write(tail, value)
+        counters[TAIL_INDEX] = tail + 1
+        return True
+
+    def pop(self) -> Any:
+        counters = self._counters
+        head = counters[HEAD_INDEX]
+        if head == counters[TAIL_INDEX]:
+            raise IndexError("pop from an empty channel")
+
+        value = self._read(head)
+        counters[HEAD_INDEX] = head + 1
+        return value
+
+    def push_many(self, values: List[Any]) -> int:
+        '''
+        Append the first values of `values` fitting in the buffer, publishing them at once. Return how many were appended.
+        '''
+        counters = self._counters
+        tail = counters[TAIL_INDEX]
+        n = min(len(values), self.capacity - (tail - counters[HEAD_INDEX]))
+        for i in range(n):
+            self._write(tail + i, values[i])
+
+        counters[TAIL_INDEX] = tail + n
+        return n
+
+    def pop_many(self, max_count: int = -1) -> List[Any]:
+        '''
+        Remove and return the oldest values, at most `max_count` of them (all of them if negative).
+        '''
+        counters = self._counters
+        head = counters[HEAD_INDEX]
+        n = counters[TAIL_INDEX] - head
+        if 0 <= max_count < n:
+            n = max_count
+
+        values = [self._read(head + i) for i in range(n)]
+        counters[HEAD_INDEX] = head + n
+        return values
+
+    async def put(self, value: Any):
+        while not self.push(value):
+            await asyncio.sleep(0)
+
+    async def get(self) -> Any:
+        while len(self) == 0:
+            await asyncio.sleep(0)
+
+        return self.pop()
+
+    def close(self):
+        self._counters.release()
+        self._memory.close()
+        if self._owner == os.getpid():
+            self._memory.unlink()
+
+class Mailbox:
+    '''
+    The messages sent by a worker at the end of each round, in a shared memory block. The rounds alternate between the two halves of the block, so that a message is not overwritten before the slowest worker has read it.
+    '''
+    def __init__(self, size: int):
+        self._memory = shared_memory.SharedMemory(create=True, size=2 * size)
+        self._size = size
+
+    def write(self, round_index: int, message: Any):
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        if len(data) + 8 > self._size:
+            raise ValueError(f"The message of a round takes {len(data)} bytes, more than the channel size {self._size - 8}")
+
+        offset = (round_index % 2) * self._size
+        buffer = self._memory.buf
+        buffer[offset:offset + 8] = len(data).to_bytes(8, "little")
+        buffer[offset + 8:offset + 8 + len(data)] = data
+
+    def read(self, round_index: int) -> Any:
+        offset = (round_index % 2) * self._size
+        buffer = self._memory.buf
+        length = int.from_bytes(buffer[offset:offset + 8], "little")
+
+        return pickle.loads(buffer[offset + 8:offset + 8 + length])
+
+    def close(self):
+        self._memory.close()
+        self._memory.unlink()
+
+class PartitionedScheduler(Scheduler):
+    '''
+    Runs the components on `n_workers` processes, each stepping its partition like a `RoundScheduler`. The system is built once in the parent and inherited by the workers (this needs the "fork" start method).
+
+    The workers run the rounds in lockstep. At the end of each round, every worker sends the new state of the channel ports (see `ChannelPort`) written by its components and the parties arrived at their rendezvous. Only the fields of the ports written in the round are sent. They are applied in the order of the workers (the last writer of a field wins), and a rendezvous is completed when all its parties have arrived, whatever their partitions. Within a partition, the runs are those of `RoundScheduler`. Across partitions, a component sees the updates of the other partitions one round late.
+    '''
+    def __init__(self, n_workers: int, seed: Any = None, channel_size: int = 1 << 20):
+        super().__init__(seed)
+        self.n_workers = n_workers
+        self.channel_size = channel_size
+
+    def get_partition(self) -> List[int]:
+        port_indices: Dict[int, int] = {}
+        components_ports = []
+        for ports in self._ports:
+            components_ports.append(tuple([port_indices.setdefault(id(port), len(port_indices)) for port in ports]))
+
+        return partition(components_ports, self.n_workers)
+
+    def run(self, max_rounds: int, collect: Callable[[List[Any]], Any] | None = None, parts: List[int] | None = None) -> List[Tuple[int, Any]]:
+        '''
+        Run at most `max_rounds` rounds, or until a round fires no transition in any partition and sends nothing. Return, for each worker, its number of steps and the result of `collect` called on its components.
+
+        `parts` overrides the partition of the components (see `get_partition`).
+        '''
+        if parts is None:
+            parts = self.get_partition()
+
+        # The ports connecting several partitions, in a fixed order
+        port_parts: Dict[int, set] = {}
+        ports_by_id: Dict[int, Port] = {}
+        for i in range(len(self._components)):
+            for port in self._ports[i]:
+                port_parts.setdefault(id(port), set()).add(parts[i])
+                ports_by_id[id(port)] = port
+        channel_ports = [ports_by_id[port_id] for port_id in port_parts if len(port_parts[port_id]) > 1]
+
+        context = multiprocessing.get_context("fork")
+        barrier = context.Barrier(self.n_workers)
+        results = context.Queue()
+        mailboxes = [Mailbox(self.channel_size) for _ in range(self.n_workers)]
+
+        workers = []
+        worker_results: List[Tuple[int, Any]] = [None] * self.n_workers
+        failed = True
+        try:
+            for index in range(self.n_workers):
+                worker = context.Process(target=self._run_worker, args=(index, parts, channel_ports, mailboxes, barrier, max_rounds, collect, results))
+                worker.start()
+                workers.append(worker)
+
+            for _ in range(self.n_workers):
+                index, n_steps, result, error = results.get()
+                if error is not None:
+                    raise RuntimeError(f"Worker {index} failed: {error}")
+
+                worker_results[index] = (n_steps, result)
+            failed = False
+        finally:
+            for worker in workers:
+                if failed:
+                    worker.terminate()
+                worker.join()
+
+            for mailbox in mailboxes:
+                mailbox.close()
+
+        return worker_results
+
+    def _run_worker(self, index: int, parts: List[int], channel_ports: List[Port], mailboxes: List[Mailbox], barrier: Any, max_rounds: int, collect: Callable[[List[Any]], Any] | None, results: Any):
+        try:
+            scheduler = RoundScheduler(None if self.seed is None else f"{self.seed}:{index}")
+            components = []
+            for i in range(len(self._components)):
+                if parts[i] == index:
+                    components.append(self._components[i])
+                    scheduler.add(self._components[i], self._priorities[i], self._ports[i])
+
+            for port in channel_ports:
+                port.__class__ = ChannelPort
+                port.arrivals = 0
+                port.written = set()
+
+            scheduler.start()
+
+            n_steps = 0
+            for round_index in range(max_rounds):
+                round_steps, fired = scheduler.run_rounds(sys.maxsize, 1)
+                n_steps += round_steps
+
+                mailboxes[index].write(round_index, (fired, get_port_updates(channel_ports)))
+                barrier.wait()
+
+                active = False
+                arrivals = {}
+                for worker_index in range(len(mailboxes)):
+                    worker_fired, worker_message = mailboxes[worker_index].read(round_index)
+                    active = active or worker_fired or bool(worker_message)
+
+                    for k, fields, n_arrived in worker_message:
+                        if fields is not None:
+                            apply_port_fields(channel_ports[k], fields)
+                        if n_arrived:
+                            arrivals[k] = arrivals.get(k, 0) + n_arrived
+
+                for k in arrivals:
+                    port = channel_ports[k]
+                    port._arrived += arrivals[k]
+                    if port._arrived >= port._parties:
+                        port._arrived -= port._parties
+                        port.generation += 1
+                        scheduler.release(port)
+
+                if not active:
+                    break
+
+            results.put((index, n_steps, None if collect is None else collect(components), None))
+        except BaseException as error:
+            barrier.abort()
+            results.put((index, 0, None, repr(error)))
+
+class LockedPort(Port):
+    '''
+    A port shared by the worker threads of a `ThreadScheduler`. Its updates, the registration of its watchers and its rendezvous are serialized by a lock of its own, and the watchers are called outside of it.
+    '''
+    def arrive(self) -> bool:
+        with self._lock:
+            return Port.arrive(self)
+
+    def join(self, component: int) -> List[int] | None:
+        '''
+        Register `component` at the rendezvous. Return None if it has to wait for the other parties, and the components waiting for the round if it completes it.
+        '''
+        with self._lock:
+            if not Port.arrive(self):
+                self._blocked.append(component)
+                return None
+
+            blocked = self._blocked
+            self._blocked = []
+
+        return blocked
+
+    def add_waiter(self, key: int, waiter: Callable[[], Any]):
+        with self._lock:
+            self._waiters[key] = waiter
+
+    def _changed(self) -> Dict[int, Callable[[], Any]]:
+        # Called with the lock held: the watchers to call after releasing it
+        self.version += 1
+        waiters = self._waiters
+        if waiters:
+            self._waiters = {}
+
+        return waiters
+
+    def _set_value(self, val):
+        with self._lock:
+            self._value = val
+            waiters = self._changed()
+
+        for waiter in waiters.values():
+            waiter()
+
+    def _set_reqRead(self, val: bool):
+        with self._lock:
+            if val == self._reqRead:
+                return
+
+            self._reqRead = val
+            waiters = self._changed()
+
+        for waiter in waiters.values():
+            waiter()
+
+    def _set_reqWrite(self, val: bool):
+        with self._lock:
+            if val == self._reqWrite:
+                return
+
+            self._reqWrite = val
+            waiters = self._changed()
+
+        for waiter in waiters.values():
+            waiter()
+
+    value = property(Port.value.fget, _set_value)
+    shared = property(Port.shared.fget, _set_value)
+    reqRead = property(Port.reqRead.fget, _set_reqRead)
+    reqWrite = property(Port.reqWrite.fget, _set_reqWrite)
+
+def is_gil_enabled() -> bool:
+    is_enabled = getattr(sys, "_is_gil_enabled", None)
+
+    return True if is_enabled is None else is_enabled()
+
+# The number of steps a worker of a `ThreadScheduler` takes between two checks of the step limit
+STEP_CHECK_INTERVAL = 64
+
+class ThreadScheduler(Scheduler):
+    '''
+    Runs the components on `n_workers` threads. Each worker has a deque of ready components, initially a partition of the system (see `partition`): it steps them in FIFO order, like the rounds of `RoundScheduler`, and when it runs out of them it steals the most recently readied components of the other workers.
+
+    The ports are turned into `LockedPort`s, so there is no global lock: a rendezvous is completed by the last party to arrive, which readies the waiting ones, and a component whose step fires nothing is parked on its `watched()` ports until one of them changes. Its guards may read a port written by another thread meanwhile, so the versions of the ports are compared once it is parked, and it is readied again if one has changed. A component without `watched()` is readied again at once.
+
+    By default, there is one worker per CPU on the free-threaded builds of CPython, and a single one (the calling thread) when the GIL is enabled, as more threads would only take turns. With several workers, the runs depend on the interleaving of the threads, and `seed` only seeds the choices.
+    '''
+    def __init__(self, n_workers: int | None = None, seed: Any = None):
+        super().__init__(seed)
+        if n_workers is None:
+            n_workers = 1 if is_gil_enabled() else os.cpu_count() or 1
+
+        self.n_workers = n_workers
+
+    def run(self, max_steps: int) -> int:
+        '''
+        Run until about `max_steps` steps have been taken (the workers check the limit every `STEP_CHECK_INTERVAL` steps), or no component is ready and none is being stepped. Return the number of steps taken.
+        '''
+        random.seed(self.seed)
+
+        n = len(self._components)
+        n_workers = self.n_workers
+        self._max_steps = max_steps
+        self._steps = [component.step for component in self._components]
+        self._watched = [tuple(component.watched()) if hasattr(component, "watched") else None for component in self._components]
+
+        # Ports still to synchronize by each component, and the index of the next one. Only the thread stepping a component updates them.
+        self._pending: List[Tuple] = [()] * n
+        self._positions = [0] * n
+
+        for ports in self._ports:
+            for port in ports:
+                if type(port) is not LockedPort:
+                    port.__class__ = LockedPort
+                    port._lock = threading.Lock()
+                    port._blocked = []
+
+        # The worker of each component, which gets it back when it is woken, and the parked components (popping one readies it, so a component woken by several ports is readied once)
+        port_indices: Dict[int, int] = {}
+        components_ports = [tuple([port_indices.setdefault(id(port), len(port_indices)) for port in ports]) for ports in self._ports]
+        self._homes = partition(components_ports, n_workers)
+        self._parked: Dict[int, bool] = {}
+        self._wakers = [lambda i=i: self._wake(i) for i in range(n)]
+
+        self._queues = [deque() for _ in range(n_workers)]
+        for i in range(n):
+            self._queues[self._homes[i]].append(i)
+
+        self._idle = threading.Condition()
+        self._n_idle = 0
+        self._done = False
+        self._n_steps = [0] * n_workers
+        self._errors: List[BaseException] = []
+
+        if n_workers == 1:
+            self._work(0)
+        else:
+            threads = [threading.Thread(target=self._work, args=(w,)) for w in range(n_workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        return sum(self._n_steps)
+
+    def _ready(self, worker: int, components: List[int]):
+        self._queues[worker].extend(components)
+        if self._n_idle:
+            with self._idle:
+                self._idle.notify()
+
+    def _wake(self, i: int):
+        if self._parked.pop(i, None) is not None:
+            self._ready(self._homes[i], [i])
+
+    def _park(self, i: int, versions: List[int]):
+        ports = self._watched[i]
+        self._parked[i] = True
+        for port in ports:
+            port.add_waiter(i, self._wakers[i])
+
+        # A port may have changed after the guards read it and before the waiter was added
+        for k in range(len(ports)):
+            if ports[k].version != versions[k]:
+                self._wake(i)
+                return
+
+    def _steal(self, worker: int) -> int | None:
+        queues = self._queues
+        for k in range(1, len(queues)):
+            try:
+                return queues[(worker + k) % len(queues)].pop()
+            except IndexError:
+                pass
+
+        return None
+
+    def _wait_for_work(self) -> bool:
+        '''
+        Wait until a component is ready, and return whether the run is over: no component is ready and every worker is waiting (or the run was stopped).
+        '''
+        idle = self._idle
+        with idle:
+            self._n_idle += 1
+            try:
+                while not self._done:
+                    if any(self._queues):
+                        return False
+
+                    if self._n_idle == self.n_workers:
+                        self._done = True
+                        idle.notify_all()
+                        break
+
+                    # The timeout covers a component readied between the check of the queues and the wait
+                    idle.wait(0.01)
+            finally:
+                self._n_idle -= 1
+
+        return True
+
+    def _work(self, worker: int):
+        try:
+            self._step_components(worker)
+        except BaseException as error:
+            self._errors.append(error)
+            with self._idle:
+                self._done = True
+                self._idle.notify_all()
+
+    def _step_components(self, worker: int):
+        queue = self._queues[worker]
+        steps = self._steps
+        watched = self._watched
+        pending = self._pending
+        positions = self._positions
+        n_steps = self._n_steps
+        count = 0
+
+        while not self._done:
+            try:
+                i = queue.popleft()
+            except IndexError:
+                i = self._steal(worker)
+                if i is None:
+                    if self._wait_for_work():
+                        break
+                    continue
+
+            ports = pending[i]
+            if not ports:
+                if watched[i]:
+                    versions = [port.version for port in watched[i]]
+
+                count += 1
+                if count % STEP_CHECK_INTERVAL == 0:
+                    n_steps[worker] = count
+                    if sum(n_steps) >= self._max_steps:
+                        with self._idle:
+                            self._done = True
+                            self._idle.notify_all()
+
+                ports = steps[i]()
+                if ports is None:
+                    if watched[i] is None:
+                        queue.append(i)
+                    elif watched[i]:
+                        self._park(i, versions)
+                    continue
+
+                if not ports:
+                    queue.append(i)
+                    continue
+
+                pending[i] = ports
+                positions[i] = 0
+
+            # Once the component waits at a rendezvous, the thread completing it may step it at once
+            k = positions[i]
+            while k < len(ports):
+                port = ports[k]
+                k += 1
+                positions[i] = k
+                released = port.join(i)
+                if released is None:
+                    break
+
+                if released:
+                    self._ready(worker, released)
+            else:
+                pending[i] = ()
+                queue.append(i)
+
+        n_steps[worker] = count
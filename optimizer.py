@@ -0,0 +1,809 @@
+from utils import AttributedTree, DFSManager
+from typing import List, Tuple, Set, Dict, Callable, Any
+
+OPERATOR_TERMS = ("term_b", "term_c", "term_d", "term_e", "term_f", "term_g", "term_h")
+
+class ConstantFolder:
+    '''
+    Evaluate the constant sub-terms of a term tree at translation time.
+
+    Template value arguments are substituted into the tree, so that terms depending only on literals and template arguments are reduced to a single "VALUE" node. Logical terms are simplified even if only some of their operands are constant.
+    '''
+    def __init__(self, type_context: "TypeContext"):
+        self._type_context = type_context
+
+    def fold(self, term_tree: AttributedTree) -> AttributedTree:
+        '''
+        Return a folded copy of `term_tree`. The original tree is left untouched.
+        '''
+        dfs_manager = DFSManager(term_tree, self._fold)
+        return dfs_manager.run()
+
+    @staticmethod
+    def is_constant(term_tree: AttributedTree) -> bool:
+        return term_tree.name == "VALUE"
+
+    @staticmethod
+    def is_constant_true(term_tree: AttributedTree) -> bool:
+        return term_tree.name == "VALUE" and term_tree.get_attribute("value") is True
+
+    @staticmethod
+    def is_constant_false(term_tree: AttributedTree) -> bool:
+        return term_tree.name == "VALUE" and term_tree.get_attribute("value") is False
+
+    @staticmethod
+    def _build_value(value: Any) -> AttributedTree:
+        return AttributedTree("VALUE", {"value": value}, [])
+
+    def _fold(self, current_tree: AttributedTree, children_folded: List[AttributedTree]) -> AttributedTree:
+        result = AttributedTree(current_tree.name, current_tree.attributes.copy(), children_folded)
+
+        # Template value argument
+        if current_tree.name == "IDENTIFIER":
+            identifier = current_tree.get_attribute("value")
+            if self._type_context.is_template_arg(identifier):
+                template_arg = self._type_context.get_template_arg(identifier)
+                if template_arg.name == "VALUE":
+                    return self._build_value(template_arg.get_attribute("value"))
+
+            return result
+
+        if current_tree.name == "term_b":
+            operator, operand = children_folded
+            if not self.is_constant(operand):
+                return result
+
+            value = operand.get_attribute("value")
+            if operator.name == "PLUS":
+                return self._build_value(value)
+            if operator.name == "MIN":
+                return self._build_value(-value)
+            if operator.name == "NOT":
+                return self._build_value(not value)
+
+            raise Exception(f"Unknown unary operator '{operator.name}'")
+
+        if current_tree.name in ("term_c", "term_d"):
+            return self._fold_arithmetic(result)
+
+        if current_tree.name in ("term_e", "term_f"):
+            return self._fold_comparison(result)
+
+        if current_tree.name == "term_g":
+            return self._fold_logical(result, absorbing=False)
+
+        if current_tree.name == "term_h":
+            return self._fold_logical(result, absorbing=True)
+
+        return result
+
+    def _fold_arithmetic(self, term_tree: AttributedTree) -> AttributedTree:
+        '''
+        Fold the longest constant prefix of a left-associative chain of arithmetic operations.
+        '''
+        operands = term_tree.children[0::2]
+        operators = term_tree.children[1::2]
+
+        if not self.is_constant(operands[0]):
+            return term_tree
+
+        value = operands[0].get_attribute("value")
+        n_folded = 0
+        for i in range(len(operators)):
+            if not self.is_constant(operands[i + 1]):
+                break
+
+            try:
+                value = apply_binary_operator(operators[i].name, value, operands[i + 1].get_attribute("value"))
+            except ZeroDivisionError:
+                # Leave the error to the runtime
+                break
+
+            n_folded += 1
+
+        if n_folded == len(operators):
+            return self._build_value(value)
+
+        if n_folded == 0:
+            return term_tree
+
+        term_tree.children = [self._build_value(value)] + term_tree.children[2 * n_folded + 1:]
+        return term_tree
+
+    def _fold_comparison(self, term_tree: AttributedTree) -> AttributedTree:
+        operands = term_tree.children[0::2]
+        operators = term_tree.children[1::2]
+
+        if not all([self.is_constant(operand) for operand in operands]):
+            return term_tree
+
+        for i in range(len(operators)):
+            lhs = operands[i].get_attribute("value")
+            rhs = operands[i + 1].get_attribute("value")
+            if not apply_binary_operator(operators[i].name, lhs, rhs):
+                return self._build_value(False)
+
+        return self._build_value(True)
+
+    def _fold_logical(self, term_tree: AttributedTree, absorbing: bool) -> AttributedTree:
+        '''
+        Simplify a conjunction (`absorbing` is False) or a disjunction (`absorbing` is True).
+
+        Terms have no side-effect, so operands equal to the neutral element are dropped and an operand equal to the absorbing element decides the whole term.
+        '''
+        remaining = []
+        for operand in term_tree.children:
+            if operand.name in ("AND", "OR"):
+                continue
+
+            if self.is_constant(operand):
+                if bool(operand.get_attribute("value")) == absorbing:
+                    return self._build_value(absorbing)
+                continue
+
+            remaining.append(operand)
+
+        if not remaining:
+            return self._build_value(not absorbing)
+
+        if len(remaining) == 1:
+            return remaining[0]
+
+        term_tree.children = remaining
+        return term_tree
+
+def apply_binary_operator(operator: str, lhs: Any, rhs: Any) -> Any:
+    '''
+    Evaluate a binary operator of Mediator on python values. The semantics is the same as the one of the generated code.
+    '''
+    if operator == "PLUS":
+        return lhs + rhs
+    if operator == "MIN":
+        return lhs - rhs
+    if operator == "MUL":
+        return lhs * rhs
+    if operator == "DIV":
+        if isinstance(lhs, int) and isinstance(rhs, int):
+            return lhs // rhs
+        return lhs / rhs
+    if operator == "MOD":
+        return lhs % rhs
+    if operator == "GEQ":
+        return lhs >= rhs
+    if operator == "GT":
+        return lhs > rhs
+    if operator == "LEQ":
+        return lhs <= rhs
+    if operator == "LT":
+        return lhs < rhs
+    if operator == "EQ":
+        return lhs == rhs
+    if operator == "NEQ":
+        return lhs != rhs
+
+    raise Exception(f"Unknown binary operator '{operator}'")
+
+INFINITY = float("inf")
+
+class IntervalAnalyzer:
+    '''
+    Interval analysis of the integer variables of an automaton or a function.
+
+    An environment maps variable names to their bounds `(l, r)`. Variables missing from the environment are bounded by their declared type. All the terms given to the analyzer are expected to be folded by `ConstantFolder`.
+    '''
+    def __init__(self, type_context: "TypeContext"):
+        self._type_context = type_context
+
+    def declared_interval(self, var_name: str) -> Tuple[float, float] | None:
+        '''
+        The bounds given by the declared type of a variable, or None if it is not an integer variable.
+        '''
+        if not self._type_context.is_var(var_name):
+            return None
+
+        return self.type_interval(self._type_context.type_of_var(var_name))
+
+    @staticmethod
+    def type_interval(type_tree: "TypeTree") -> Tuple[float, float] | None:
+        type_tree = type_tree.de_init()
+
+        if type_tree.name == "bounded_int":
+            return (type_tree.get_attribute("l"), type_tree.get_attribute("r"))
+
+        if type_tree.name == "int":
+            return (-INFINITY, INFINITY)
+
+        return None
+
+    def lookup(self, var_name: str, env: Dict[str, Tuple[float, float]]) -> Tuple[float, float] | None:
+        if var_name in env:
+            return env[var_name]
+
+        return self.declared_interval(var_name)
+
+    def evaluate(self, term_tree: AttributedTree, env: Dict[str, Tuple[float, float]]) -> Tuple[float, float] | None:
+        '''
+        Bounds of the value of an integer term, or None if the term is not an integer term or cannot be analyzed.
+        '''
+        if term_tree.name == "VALUE":
+            value = term_tree.get_attribute("value")
+            if type(value) == int:
+                return (value, value)
+            return None
+
+        if term_tree.name == "IDENTIFIER":
+            return self.lookup(term_tree.get_attribute("value"), env)
+
+        if term_tree.name == "dot_term":
+            port, field = term_tree.children
+            if port.name == "IDENTIFIER" and field.get_attribute("value") == "value" and self._type_context.is_port(port.get_attribute("value")):
+                return self.type_interval(self._type_context.get_param_type(port.get_attribute("value")))
+            return None
+
+        if term_tree.name == "term_b":
+            operator, operand = term_tree.children
+            interval = self.evaluate(operand, env)
+            if interval is None or operator.name == "NOT":
+                return None
+            if operator.name == "MIN":
+                return (-interval[1], -interval[0])
+            return interval
+
+        if term_tree.name in ("term_c", "term_d"):
+            result = self.evaluate(term_tree.children[0], env)
+            for i in range(1, term_tree.n_children, 2):
+                operand = self.evaluate(term_tree.children[i + 1], env)
+                if result is None or operand is None:
+                    return None
+                result = apply_interval_operator(term_tree.children[i].name, result, operand)
+            return result
+
+        return None
+
+    def refine(self, guard: AttributedTree, env: Dict[str, Tuple[float, float]]) -> Dict[str, Tuple[float, float]]:
+        '''
+        Narrow the bounds of the variables under the assumption that `guard` holds. A new environment is returned.
+        '''
+        env = env.copy()
+
+        if guard.name == "term_g":
+            for conjunct in guard.children:
+                if conjunct.name != "AND":
+                    env = self.refine(conjunct, env)
+            return env
+
+        if guard.name not in ("term_e", "term_f"):
+            return env
+
+        for i in range(1, guard.n_children, 2):
+            lhs = guard.children[i - 1]
+            operator = guard.children[i].name
+            rhs = guard.children[i + 1]
+
+            self._refine_comparison(lhs, operator, rhs, env)
+            self._refine_comparison(rhs, FLIPPED_COMPARISONS[operator], lhs, env)
+
+        return env
+
+    def _refine_comparison(self, lhs: AttributedTree, operator: str, rhs: AttributedTree, env: Dict[str, Tuple[float, float]]):
+        if lhs.name != "IDENTIFIER":
+            return
+
+        var_name = lhs.get_attribute("value")
+        var_interval = self.lookup(var_name, env)
+        rhs_interval = self.evaluate(rhs, env)
+        if var_interval is None or rhs_interval is None:
+            return
+
+        l, r = var_interval
+        if operator == "LT":
+            r = min(r, rhs_interval[1] - 1)
+        elif operator == "LEQ":
+            r = min(r, rhs_interval[1])
+        elif operator == "GT":
+            l = max(l, rhs_interval[0] + 1)
+        elif operator == "GEQ":
+            l = max(l, rhs_interval[0])
+        elif operator == "EQ":
+            l, r = max(l, rhs_interval[0]), min(r, rhs_interval[1])
+        
+        env[var_name] = (l, r)
+
+FLIPPED_COMPARISONS = {"LT": "GT", "LEQ": "GEQ", "GT": "LT", "GEQ": "LEQ", "EQ": "EQ", "NEQ": "NEQ"}
+
+def _mul_bound(a: float, b: float) -> float:
+    # Avoid inf * 0 = nan
+    if a == 0 or b == 0:
+        return 0
+    return a * b
+
+def apply_interval_operator(operator: str, lhs: Tuple[float, float], rhs: Tuple[float, float]) -> Tuple[float, float] | None:
+    if operator == "PLUS":
+        return (lhs[0] + rhs[0], lhs[1] + rhs[1])
+    
+    if operator == "MIN":
+        return (lhs[0] - rhs[1], lhs[1] - rhs[0])
+    
+    if operator == "MUL":
+        products = [_mul_bound(a, b) for a in lhs for b in rhs]
+        return (min(products), max(products))
+    
+    if operator == "MOD":
+        # Python's modulo takes the sign of the divisor
+        if rhs[0] > 0:
+            if lhs[0] >= 0 and lhs[1] < rhs[0]:
+                return lhs
+            return (0, rhs[1] - 1)
+        if rhs[1] < 0:
+            return (rhs[0] + 1, 0)
+        return None
+    
+    if operator == "DIV":
+        if lhs[0] >= 0 and rhs[0] > 0:
+            return (lhs[0] // rhs[1] if rhs[1] != INFINITY else 0, lhs[1] // rhs[0] if lhs[1] != INFINITY else INFINITY)
+        return None
+    
+    return None
+
+def get_read_set(term_tree: AttributedTree) -> Set[str]:
+    '''
+    Names of the variables and ports read by a term. Field names of dot terms are not included.
+    '''
+    def node_operation(current_tree: AttributedTree, children_returns: List[Set[str]]) -> Set[str]:
+        if current_tree.name == "IDENTIFIER":
+            return {current_tree.get_attribute("value")}
+        
+        if current_tree.name == "dot_term":
+            return children_returns[0]
+        
+        result = set()
+        for child_return in children_returns:
+            result |= child_return
+        return result
+    
+    dfs_manager = DFSManager(term_tree, node_operation)
+    return dfs_manager.run()
+
+def get_assigned_name(term_tree: AttributedTree) -> str | None:
+    '''
+    The variable or port modified by assigning to `term_tree`, e.g. "x" for "x[i].f".
+    '''
+    while term_tree.name in ("brack_term", "dot_term"):
+        term_tree = term_tree.children[0]
+    
+    if term_tree.name == "IDENTIFIER":
+        return term_tree.get_attribute("value")
+    
+    return None
+
+def get_write_set(stmts: List[AttributedTree]) -> Set[str]:
+    '''
+    Names of the variables and ports modified by a list of statements. A synchronization modifies the status of its ports.
+    '''
+    result = set()
+    for stmt in stmts:
+        if stmt.name == "assign_stmt":
+            for term_tree in stmt.get_child_by_name("lhs").children:
+                name = get_assigned_name(term_tree)
+                if name is not None:
+                    result.add(name)
+        elif stmt.name == "sync_stmt":
+            for child in stmt.children:
+                result.add(child.get_attribute("value"))
+    
+    return result
+
+def get_updated_names(tree: AttributedTree) -> Set[str]:
+    '''
+    Names of the variables and ports updated in place (an entry or a field assigned, e.g. "x" for "x[i] = 1") by the statements in `tree`.
+    '''
+    result = set()
+    stack = [tree]
+    while stack:
+        current_tree = stack.pop()
+        if current_tree.name == "assign_stmt":
+            for term_tree in current_tree.get_child_by_name("lhs").children:
+                if term_tree.name in ("brack_term", "dot_term"):
+                    name = get_assigned_name(term_tree)
+                    if name is not None:
+                        result.add(name)
+        else:
+            stack += current_tree.children
+    
+    return result
+
+def get_escaping_names(term_tree: AttributedTree) -> Set[str]:
+    '''
+    Names of the variables whose whole value is used by a term, i.e. not only indexed or dotted. The value of such a variable may be stored elsewhere once the term is evaluated.
+    '''
+    if term_tree.name == "IDENTIFIER":
+        return {term_tree.get_attribute("value")}
+    
+    children = term_tree.children
+    if term_tree.name == "dot_term":
+        children = children[:1]
+    
+    result = set()
+    for i in range(len(children)):
+        child = children[i]
+        if i == 0 and term_tree.name in ("brack_term", "dot_term") and child.name == "IDENTIFIER":
+            continue
+        
+        result |= get_escaping_names(child)
+    
+    return result
+
+def is_short_circuited(term_tree: AttributedTree, i: int) -> bool:
+    '''
+    Whether the generated code may skip the evaluation of the i-th child of `term_tree`: the operands of `&&` and `||` after the first one, and the operands of a comparison chain after the second one.
+    '''
+    if term_tree.name in ("term_g", "term_h"):
+        return i > 0
+    
+    if term_tree.name in ("term_e", "term_f"):
+        return i > 2
+    
+    return False
+
+def get_fingerprints(term_tree: AttributedTree) -> Dict[int, Tuple]:
+    '''
+    Hash-cons a term tree. Map the id of every node to its fingerprint, a hashable key such that two sub-terms have the same fingerprint iff they are structurally equal.
+    '''
+    fingerprints = {}
+
+    def node_operation(current_tree: AttributedTree, children_returns: List[Tuple]) -> Tuple:
+        value = current_tree.get_attribute("value", raise_exception=False)
+        fingerprint = (current_tree.name, type(value).__name__, value, tuple(children_returns))
+        fingerprints.update({id(current_tree): fingerprint})
+        return fingerprint
+
+    dfs_manager = DFSManager(term_tree, node_operation)
+    dfs_manager.run()
+    return fingerprints
+
+def get_size(term_tree: AttributedTree) -> int:
+    dfs_manager = DFSManager(term_tree, lambda current_tree, children_returns: 1 + sum(children_returns))
+    return dfs_manager.run()
+
+class CommonSubtermEliminator:
+    '''
+    Find the sub-terms shared by several terms, which are worth computing once and storing in a local.
+
+    Terms are pure, so any repeated compound sub-term can be shared. Occurrences inside a larger shared sub-term are not counted, since they are computed only once with it. Sub-terms occurring in a short-circuited operand (see `is_short_circuited`) are never shared, since they may only be defined when the first operand allows it (e.g. `i < n && buf[i] > 0`).
+    '''
+    def __init__(self, excluded_names: Set[str] = set()):
+        # Sub-terms reading these names are never shared
+        self._excluded_names = excluded_names
+
+    def _is_candidate(self, term_tree: AttributedTree) -> bool:
+        if term_tree.n_children == 0:
+            return False
+        
+        return not (get_read_set(term_tree) & self._excluded_names)
+
+    def _get_conditional(self, term_tree: AttributedTree, fingerprints: Dict[int, Tuple]) -> Set[Tuple]:
+        '''
+        Get the fingerprints of the sub-terms which are not always evaluated.
+        '''
+        conditional = set()
+        
+        stack = [(term_tree, False)]
+        while stack:
+            current_tree, is_conditional = stack.pop()
+            if is_conditional:
+                conditional.add(fingerprints[id(current_tree)])
+            
+            for i in range(current_tree.n_children):
+                stack.append((current_tree.children[i], is_conditional or is_short_circuited(current_tree, i)))
+        
+        return conditional
+
+    def _count(self, term_trees: List[AttributedTree], fingerprints: Dict[int, Tuple], shared: Set[Tuple]) -> Set[Tuple]:
+        '''
+        Get the fingerprints of the candidates occurring at least twice, without descending into shared sub-terms.
+        '''
+        counts = {}
+        for term_tree in term_trees:
+            stack = [term_tree]
+            while stack:
+                current_tree = stack.pop()
+                fingerprint = fingerprints[id(current_tree)]
+
+                if self._is_candidate(current_tree):
+                    counts.update({fingerprint: counts.get(fingerprint, 0) + 1})
+                
+                if fingerprint in shared:
+                    continue
+                
+                stack += current_tree.children
+        
+        return set([fingerprint for fingerprint in counts if counts[fingerprint] >= 2])
+
+    def find(self, term_trees: List[AttributedTree]) -> List[Tuple[Tuple, AttributedTree, Set[int]]]:
+        '''
+        Return the shared sub-terms as (fingerprint, sub-term, indices of the terms containing it), smallest first, so that every shared sub-term only depends on the ones before it.
+        '''
+        fingerprints = {}
+        representatives = {}
+        contained = []
+        conditional = set()
+        for term_tree in term_trees:
+            tree_fingerprints = get_fingerprints(term_tree)
+            fingerprints.update(tree_fingerprints)
+            contained.append(set(tree_fingerprints.values()))
+            conditional |= self._get_conditional(term_tree, tree_fingerprints)
+
+            stack = [term_tree]
+            while stack:
+                current_tree = stack.pop()
+                representatives.setdefault(tree_fingerprints[id(current_tree)], current_tree)
+                stack += current_tree.children
+        
+        # Largest sub-terms first: once a sub-term is shared, its own sub-terms are only counted once.
+        candidates = self._count(term_trees, fingerprints, set()) - conditional
+        sizes = {fingerprint: get_size(representatives[fingerprint]) for fingerprint in candidates}
+        
+        shared = set()
+        for fingerprint in sorted(candidates, key=lambda x: -sizes[x]):
+            if fingerprint in self._count(term_trees, fingerprints, shared):
+                shared.add(fingerprint)
+        
+        result = []
+        for fingerprint in sorted(shared, key=lambda x: sizes[x]):
+            users = set([i for i in range(len(term_trees)) if fingerprint in contained[i]])
+            result.append((fingerprint, representatives[fingerprint], users))
+        
+        return result
+
+def get_called_functions(term_tree: AttributedTree) -> Set[str]:
+    '''
+    Names of the functions called in a tree.
+    '''
+    result = set()
+
+    stack = [term_tree]
+    while stack:
+        current_tree = stack.pop()
+        if current_tree.name == "func_term":
+            result.add(current_tree.children[0].get_attribute("value"))
+        stack += current_tree.children
+    
+    return result
+
+def is_recursive(function_name: str, get_function_body: Callable[[str], AttributedTree | None]) -> bool:
+    '''
+    Whether a function may call itself, directly or through other functions.
+    '''
+    visited = set()
+    
+    stack = list(get_called_functions(get_function_body(function_name)))
+    while stack:
+        name = stack.pop()
+        if name == function_name:
+            return True
+        
+        if name in visited:
+            continue
+        visited.add(name)
+
+        body = get_function_body(name)
+        if body is not None:
+            stack += list(get_called_functions(body))
+    
+    return False
+
+class FunctionInliner:
+    '''
+    Turn the body of a function into a single term, which can replace its calls.
+
+    The statements are substituted forward into the returned term: every read of a local variable becomes a "let_term" node holding the term last assigned to it, or an "init_term" leaf if it was not assigned yet. A let is named by its "binding" attribute, since a variable may be assigned several times. The generated code computes every let (and every parameter) once, in a fresh local bound where it is first evaluated (see `plan`).
+    '''
+    def __init__(self):
+        self._n_bindings = 0
+
+    def _substitute(self, term_tree: AttributedTree, lets: Dict[str, AttributedTree]) -> AttributedTree:
+        if term_tree.name == "IDENTIFIER":
+            identifier = term_tree.get_attribute("value")
+            if identifier in lets:
+                return lets[identifier].deepcopy()
+            
+            return term_tree.deepcopy()
+        
+        children = []
+        for i in range(term_tree.n_children):
+            # Field and function names are not variables
+            if (term_tree.name == "dot_term" and i == 1) or (term_tree.name == "func_term" and i == 0):
+                children.append(term_tree.children[i].deepcopy())
+            else:
+                children.append(self._substitute(term_tree.children[i], lets))
+        
+        return AttributedTree(term_tree.name, term_tree.attributes.copy(), children)
+
+    def expand(self, function_body: AttributedTree) -> AttributedTree | None:
+        '''
+        Return the term computed by a function body, or None if the body cannot be expressed as a term (e.g. it assigns to a field).
+        '''
+        lets = {}
+        for child in function_body.children:
+            if child.name == "var_decl":
+                for identifier_tree in child.children[:-1]:
+                    identifier = identifier_tree.get_attribute("value")
+                    lets.update({identifier: AttributedTree("init_term", {"value": identifier, "type": child.children[-1]}, [])})
+            elif child.name == "assign_stmt":
+                lhs_tree = child.get_child_by_name("lhs")
+                rhs_tree = child.get_child_by_name("rhs")
+
+                if lhs_tree.n_children != rhs_tree.n_children or any([term_tree.name != "IDENTIFIER" for term_tree in lhs_tree.children]):
+                    return None
+                
+                # The assignment is simultaneous
+                new_lets = {}
+                for i in range(lhs_tree.n_children):
+                    identifier = lhs_tree.children[i].get_attribute("value")
+                    let_term = AttributedTree("let_term", {"value": identifier, "binding": self._n_bindings}, [self._substitute(rhs_tree.children[i], lets)])
+                    self._n_bindings += 1
+                    new_lets.update({identifier: let_term})
+                lets.update(new_lets)
+            elif child.name == "return_stmt":
+                if child is not function_body.children[-1]:
+                    return None
+                
+                return self._substitute(child.children[0], lets)
+            else:
+                return None
+        
+        return None
+
+    @staticmethod
+    def plan(term_tree: AttributedTree, params: Set[str]) -> Dict[int, Tuple[Any, str]]:
+        '''
+        Decide how the code of every let and parameter read in `term_tree` is emitted. Map the id of the node reading it to (binding, decision), where the binding is the "binding" attribute of a let or the name of a parameter, and the decision is one of
+            "bind": compute the value and store it in the local of the binding, as it is always evaluated before the other reads;
+            "ref": read the local of the binding;
+            "inline": compute the value without storing it, as it may be skipped.
+        '''
+        decisions = {}
+        bound = set()
+
+        def visit(current_tree: AttributedTree, is_conditional: bool):
+            binding = None
+            if current_tree.name == "let_term":
+                binding = current_tree.get_attribute("binding")
+            elif current_tree.name == "IDENTIFIER" and current_tree.get_attribute("value") in params:
+                binding = current_tree.get_attribute("value")
+            
+            if binding is not None and binding in bound:
+                decisions.update({id(current_tree): (binding, "ref")})
+                return
+            
+            for i in range(current_tree.n_children):
+                if (current_tree.name == "dot_term" and i == 1) or (current_tree.name == "func_term" and i == 0):
+                    continue
+                visit(current_tree.children[i], is_conditional or is_short_circuited(current_tree, i))
+            
+            if binding is None:
+                return
+            
+            if is_conditional:
+                decisions.update({id(current_tree): (binding, "inline")})
+            else:
+                bound.add(binding)
+                decisions.update({id(current_tree): (binding, "bind")})
+        
+        visit(term_tree, False)
+        return decisions
+
+def rename_identifiers(tree: AttributedTree, names: Dict[str, str]) -> AttributedTree:
+    '''
+    A copy of `tree` where the variables and ports are renamed by `names`. Field and function names, and the types of the declarations, are kept.
+    '''
+    if tree.name == "IDENTIFIER":
+        identifier = tree.get_attribute("value")
+        if identifier in names:
+            return AttributedTree("IDENTIFIER", {"value": names[identifier]}, [])
+        
+        return tree.deepcopy()
+    
+    children = []
+    for i in range(tree.n_children):
+        if (tree.name == "dot_term" and i == 1) or (tree.name == "func_term" and i == 0) or (tree.name == "var_decl" and i == tree.n_children - 1):
+            children.append(tree.children[i].deepcopy())
+        else:
+            children.append(rename_identifiers(tree.children[i], names))
+    
+    return AttributedTree(tree.name, tree.attributes.copy(), children)
+
+class ProductBuilder:
+    '''
+    Build the synchronous product of automata whose internal ports (the ports connecting only them) are synchronized by single-port `sync` statements.
+
+    The transitions not synchronizing on an internal port are kept as they are, interleaved. The transitions synchronizing on an internal port are replaced by the joint transitions of all the parties of the port: one per choice of a transition of every party, guarded by the conjunction of their guards, running the statements of every party before the synchronization, then the statements after it. The internal ports keep their values and status, and are no longer synchronized.
+    '''
+    def __init__(self, limit: int):
+        '''
+        limit: the largest number of transitions of the product
+        '''
+        self._limit = limit
+
+    def build(self, members: List[AttributedTree], parties: Dict[str, List[int]]) -> AttributedTree | None:
+        '''
+        Return the body of the product of the automata `members`, whose variables and ports are already renamed apart (see `rename_identifiers`). `parties` maps every internal port to the indices of the members connected to it.
+
+        Return None if the automata cannot be fused: a transition synchronizes on an internal port within a group, or together with another port, or the product has more than `limit` transitions.
+        '''
+        var_decls = []
+        transitions = []
+        
+        # Internal port -> member -> the guarded statements synchronizing on the port
+        sync_stmts: Dict[str, Dict[int, List[AttributedTree]]] = {port: {} for port in parties}
+
+        for k in range(len(members)):
+            automaton_vars = members[k].get_child_by_name("automaton_vars", raise_exception=False)
+            if automaton_vars is not None:
+                var_decls += [var_decl.deepcopy() for var_decl in automaton_vars.children]
+            
+            automaton_trans = members[k].get_child_by_name("automaton_trans", raise_exception=False)
+            if automaton_trans is None:
+                continue
+
+            for transition in automaton_trans.children:
+                guarded_stmts = [transition.children[0]] if transition.name == "transition" else transition.children
+                synced_ports = [self._get_internal_port(guarded_stmt, parties) for guarded_stmt in guarded_stmts]
+                if all([port == "" for port in synced_ports]):
+                    transitions.append(transition.deepcopy())
+                    continue
+                
+                if transition.name != "transition" or synced_ports[0] is None:
+                    return None
+                
+                sync_stmts[synced_ports[0]].setdefault(k, []).append(guarded_stmts[0])
+        
+        for port in sync_stmts:
+            port_parties = parties[port]
+            if any([k not in sync_stmts[port] for k in port_parties]):
+                # Never enabled
+                continue
+
+            combinations = [[]]
+            for k in port_parties:
+                combinations = [combination + [guarded_stmt] for combination in combinations for guarded_stmt in sync_stmts[port][k]]
+                if len(transitions) + len(combinations) > self._limit:
+                    return None
+            
+            for combination in combinations:
+                transitions.append(self._join(combination))
+        
+        if len(transitions) > self._limit:
+            return None
+        
+        return AttributedTree("automaton", {}, [AttributedTree("automaton_vars", {}, var_decls), AttributedTree("automaton_trans", {}, transitions)])
+
+    @staticmethod
+    def _get_internal_port(guarded_stmt: AttributedTree, parties: Dict[str, List[int]]) -> str | None:
+        '''
+        The internal port a guarded statement synchronizes on, "" if it synchronizes on none, and None if it cannot be joined: its only synchronization must be on the internal port alone.
+        '''
+        sync_stmts = [stmt for stmt in guarded_stmt.children[1:] if stmt.name == "sync_stmt"]
+        ports = [child.get_attribute("value") for stmt in sync_stmts for child in stmt.children]
+        if not any([port in parties for port in ports]):
+            return ""
+        
+        if len(sync_stmts) != 1 or len(ports) != 1:
+            return None
+        
+        return ports[0]
+
+    @staticmethod
+    def _join(guarded_stmts: List[AttributedTree]) -> AttributedTree:
+        guards = [guarded_stmt.children[0].deepcopy() for guarded_stmt in guarded_stmts]
+        guard = guards[0] if len(guards) == 1 else AttributedTree("term_g", {}, guards)
+
+        before = []
+        after = []
+        for guarded_stmt in guarded_stmts:
+            stmts = guarded_stmt.children[1:]
+            i = [stmt.name for stmt in stmts].index("sync_stmt")
+            before += [stmt.deepcopy() for stmt in stmts[:i]]
+            after += [stmt.deepcopy() for stmt in stmts[i + 1:]]
+        
+        return AttributedTree("transition", {}, [AttributedTree("guarded_stmt", {}, [guard] + before + after)])
@@ -1,9 +1,8 @@
 import lark
-from utils import AttributedTree, DFSManager, DirectedGraph
+from utils import AttributedTree, DFSManager, DirectedGraph, CodeEmitter
 from typing import List, Set, Dict, Tuple, Any, Callable
 from queue import Queue
 from type_tree import TypeTree, get_term_type, is_type
-from translator import ResolvedTerm
 
 class TypeContext:
     def __init__(self):
@@ -79,9 +78,9 @@ class TypeContext:
             raise NameError(f"Parameter '{param_name}' not found.", name=param_name)
         
         if with_IO:
-            return self._signature["param_name"]
+            return self._signature[param_name]
         else:
-            return self._signature["param_name"][0]
+            return self._signature[param_name][0]
 
     def set_param_type(self, param_name: str, type_tree: AttributedTree, IO: str | None = None):
         if param_name in self._identifiers:
@@ -183,12 +182,22 @@ class TypeContext:
         return True
 
     def copy(self):
-        #TODO
-        return self
+        type_context = TypeContext()
+        type_context._identifiers = self._identifiers.copy()
+        type_context._type_aliases = self._type_aliases.copy()
+        type_context._template_args = self._template_args.copy()
+        type_context._signature = self._signature.copy()
+        type_context._local_vars = self._local_vars.copy()
+        type_context._internal_nodes = self._internal_nodes.copy()
+
+        return type_context
 
     def is_enum_type(self, name: str) -> bool:
         return name in self._identifiers and self._identifiers[name] == "enum"
     
+    def is_template_arg(self, name: str) -> bool:
+        return name in self._identifiers and self._identifiers[name] == "template"
+    
     def is_port(self, name: str, IO: str = "") -> bool:
         if IO == "":
             return name in self._signature
@@ -213,6 +222,8 @@ class TemplateManager:
         #TODO
         self._type_context = type_context
         self._data: Dict[str, TemplateDatum]
+        self._function_bodies: Dict[str, AttributedTree] = {}
+        self._record_table = RecordTable()
     
     def query(self, expansion_request: "ExpansionRequest", raise_exception: bool = True) -> "ExpansionDatum":
         name = expansion_request.name
@@ -238,6 +249,18 @@ class TemplateManager:
         
         return self._data[name].query_or_create(template_args)
     
+    def set_function_body(self, name: str, body: AttributedTree):
+        self._function_bodies.update({name: body})
+    
+    def get_function_body(self, name: str) -> AttributedTree | None:
+        return self._function_bodies.get(name)
+
+    def get_record_class_name(self, fields: Tuple[str, ...]) -> str:
+        return self._record_table.get_class_name(fields)
+    
+    def translate_records(self) -> str:
+        return self._record_table.translate()
+
     def get_signature_string(self, name: str) -> str:
         if name not in self._data:
             raise NameError(f"'{name}' is not a valid object name")
@@ -253,17 +276,17 @@ class TemplateDatum:
         self._signature_form = signature_form
         self._expansion_data: List[ExpansionDatum] = []
 
-    def query(self, template_args: List[AttributedTree], raise_exception: bool = True) -> "ExpansionDatum" | None:
+    def query(self, template_args: List[AttributedTree], raise_exception: bool = True) -> "ExpansionDatum | None":
         for expansion_datum in self._expansion_data:
             if expansion_datum.template_args == template_args:
-                return ExpansionDatum
+                return expansion_datum
         
         if raise_exception:
             raise Exception #TODO
         else:
             return None
     
-    def create(self, template_args: List[AttributedTree]) -> "ExpansionDatum" | None:
+    def create(self, template_args: List[AttributedTree]) -> "ExpansionDatum | None":
         if self.query(template_args, raise_exception=False) != None:
             raise Exception
         
@@ -312,7 +335,7 @@ class ExpansionDatum:
 
     @property
     def actual_name(self) -> str:
-        return self.actual_name
+        return self._actual_name
     
     def new_connection_table(self) -> "ConnectionTable":
         return self._expanded_signature.new_connection_table(self._actual_name)
@@ -366,7 +389,7 @@ class SignatureForm:
         self._data = data
     
     def is_function(self) -> bool:
-        return self._data[-1][0] == "!"
+        return len(self._data) > 0 and self._data[-1][0] == "!"
 
     def transform(self, type_context: TypeContext):
         type_context.set_signature(dict({x[0]: (x[1], x[2]) for x in self._data}))
@@ -391,14 +414,29 @@ class SignatureForm:
         
         return SignatureForm(new_data)
     
+    def get_param_names(self) -> List[str]:
+        if self.is_function():
+            return [datum[0] for datum in self._data[:-1]]
+        
+        return [datum[0] for datum in self._data]
+
+    def get_port_IOs(self) -> List[str | None]:
+        '''
+        The direction ("In" or "Out") of every port of an entity, in the order of the signature.
+        '''
+        return [datum[2] for datum in self._data]
+
     def get_return_type(self) -> TypeTree:
         if not self.is_function():
             raise Exception #TODO
         
         return self._data[-1][1].copy()
     
-    def validate_and_convert(self, terms_resolved: List[ResolvedTerm]) -> ResolvedTerm:
-        expected_len = len(self._data - 1)
+    def validate_and_convert(self, terms_resolved: "List[ResolvedTerm]", checked: bool = False) -> "ResolvedTerm":
+        # translator imports this module
+        from translator import ResolvedTerm
+
+        expected_len = len(self._data) - 1
         actual_len = len(terms_resolved)
 
         if actual_len != expected_len:
@@ -413,8 +451,7 @@ class SignatureForm:
             type_tree = term_resolved.type_tree
             expansion_requests = term_resolved.expansion_requests
             
-            coercion = type_tree.get_coercion(self._data[i][1])
-            python_codes.append(coercion(python_code))
+            python_codes.append(type_tree.get_coercion_code(self._data[i][1], python_code, checked))
             all_expansion_requests += expansion_requests
         
         python_code = "(" + ", ".join(python_codes) + ")"
@@ -425,7 +462,7 @@ class SignatureForm:
         if self.is_function():
             expected_len = len(self._data) - 1
         else:
-            expected_len = len(self.data)
+            expected_len = len(self._data)
 
         python_code = []
         for i in range(expected_len):
@@ -456,22 +493,70 @@ class ConnectionTable:
         
         raise Exception("Port not found")
     
-    def translate(self) -> str:
+    def get_node(self, port_name: str) -> str | None:
+        for connection in self.connections:
+            if connection[0] == port_name:
+                return connection[1]
+        
+        raise Exception("Port not found")
+    
+    def get_arguments(self) -> List[str]:
+        '''
+        The nodes connected to the ports, which are named by the system translator.
+        '''
         python_code = []
         for port_name, port_arg in self.connections:
-            python_code.append("id_" + port_arg)
-        python_code = ", ".join(python_code)
+            if port_arg is None:
+                raise Exception(f"Port '{port_name}' of '{self.actual_name}' is not connected")
+            python_code.append(port_arg)
+        
+        return python_code
+
+    def translate(self) -> str:
+        python_code = ", ".join(self.get_arguments())
 
         python_code = self.actual_name + r"(" + python_code + r")"
 
         return python_code
     
-    def copy(self) -> str:
+    def copy(self) -> "ConnectionTable":
         new_connnections = []
         for connection in self.connections:
-            new_connection = (None, None)
-            new_connection[0] = connection[0]
-            new_connection[1] = connection[1]
-            new_connnections.append(new_connection)
+            new_connnections.append([connection[0], connection[1]])
         
-        return ConnectionTable(self.actual_name, new_connnections)
\ No newline at end of file
+        return ConnectionTable(self.actual_name, new_connnections)
+
+class RecordTable:
+    '''
+    The classes of the struct values, one per layout (the tuple of the field names, in order). Every class is a `__slots__` subclass of `m_lib.MRecord`.
+    '''
+    def __init__(self):
+        self._class_names: Dict[Tuple[str, ...], str] = {}
+    
+    def get_class_name(self, fields: Tuple[str, ...]) -> str:
+        fields = tuple(fields)
+        if fields not in self._class_names:
+            self._class_names.update({fields: "struct_" + str(len(self._class_names))})
+        
+        return self._class_names[fields]
+    
+    def translate(self) -> str:
+        emitter = CodeEmitter()
+
+        for fields, class_name in self._class_names.items():
+            emitter.line()
+            with emitter.block("class " + class_name + "(MRecord):"):
+                if fields:
+                    emitter.line("__slots__ = (" + ", ".join([repr(field) for field in fields]) + ",)")
+                else:
+                    emitter.line("__slots__ = ()")
+                
+                emitter.line()
+                with emitter.block("def __init__(" + ", ".join(("self",) + fields) + "):"):
+                    for field in fields:
+                        emitter.line("self." + field + " = " + field)
+                    
+                    if not fields:
+                        emitter.line("pass")
+        
+        return emitter.getvalue()
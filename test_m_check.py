@@ -0,0 +1,147 @@
+'''
+Tests of the model checker, on producers and consumers translated in state class mode.
+'''
+import unittest
+import os
+from typing import Any, Dict
+from m_lib import Node
+from m_check import ModelChecker, ParallelModelChecker, ExactStore, BitstateStore, DiskStore
+from translator import TranslationOptions
+from test_translator import value, identifier, plus, compare, dot, assign, transition, translate_automaton, index, array_of, translate_with_types
+from type_tree import get_bounded_int_type
+from utils import AttributedTree
+
+def equals(lhs: AttributedTree, rhs: AttributedTree) -> AttributedTree:
+    return AttributedTree("term_f", {}, [lhs, AttributedTree("EQ", {}, []), rhs])
+
+def both(lhs: AttributedTree, rhs: AttributedTree) -> AttributedTree:
+    return AttributedTree("term_g", {}, [lhs, rhs])
+
+def translate_pair() -> Dict[str, Any]:
+    '''
+    A producer writing 0, 1 and 2 to its port, and a consumer summing them.
+    '''
+    options = TranslationOptions(state_classes=True)
+    producer = transition(both(compare(identifier("x"), "LT", value(3)), equals(dot(identifier("p"), "reqWrite"), value(False))), assign(dot(identifier("p"), "value"), identifier("x")), assign(dot(identifier("p"), "reqWrite"), value(True)), assign(identifier("x"), plus(identifier("x"), value(1))))
+    consumer = transition(equals(dot(identifier("p"), "reqWrite"), value(True)), assign(identifier("y"), plus(identifier("y"), dot(identifier("p"), "value"))), assign(dot(identifier("p"), "reqWrite"), value(False)))
+
+    namespace = translate_automaton({"x": (0, 3)}, [producer], options, {"p": "out"}, "m_P")
+    namespace.update(translate_automaton({"y": None}, [consumer], options, {"p": "in"}, "m_C"))
+    return namespace
+
+PAIR = translate_pair()
+
+# Counts from 0 to 9
+WALKER = translate_automaton({"x": (0, 9)}, [transition(compare(identifier("x"), "LT", value(9)), assign(identifier("x"), plus(identifier("x"), value(1))))], TranslationOptions(state_classes=True), name="m_W")["m_W"]
+
+def add_pairs(checker: ModelChecker, n_pairs: int) -> ModelChecker:
+    for _ in range(n_pairs):
+        p = Node(parties=2)
+        producer = PAIR["m_P"](p)
+        producer.id_x = 0
+        consumer = PAIR["m_C"](p)
+        consumer.id_y = 0
+        checker.add(producer)
+        checker.add(consumer)
+
+    return checker
+
+def get_total(components: list) -> int:
+    return sum([component.id_y for component in components if hasattr(component, "id_y")])
+
+class TestParallelModelChecker(unittest.TestCase):
+    def test_same_counts(self):
+        expected = add_pairs(ModelChecker(deadlocks=False), 3).explore()
+        self.assertTrue(expected.complete)
+        self.assertEqual(expected.n_states, 7 ** 3)
+
+        for n_workers in (1, 2, 3):
+            result = add_pairs(ParallelModelChecker(n_workers, deadlocks=False), 3).explore()
+            self.assertEqual((result.n_states, result.n_transitions, result.complete), (expected.n_states, expected.n_transitions, True))
+
+    def test_violation_trace(self):
+        invariants = {"total": lambda components: get_total(components) < 6}
+        expected = add_pairs(ModelChecker(invariants, deadlocks=False), 3).explore()
+
+        result = add_pairs(ParallelModelChecker(2, invariants, deadlocks=False), 3).explore()
+        self.assertEqual(result.violation, "total")
+        self.assertFalse(result.complete)
+
+        # Both are breadth-first, so the traces are shortest
+        self.assertEqual(len(result.trace), len(expected.trace))
+        self.assertEqual(sum([automaton["y"] for name, automaton in result.trace[-1][1].items() if "y" in automaton]), 6)
+
+    def test_violation_at_state_limit(self):
+        # A single path of states, where x = 7 is found by its owner while receiving it, in the round stopped by the limit (the owners of x = 6 and x = 7 differ)
+        for n_workers in (2, 3, 4):
+            checker = ParallelModelChecker(n_workers, {"low": lambda components: components[0].id_x < 7}, deadlocks=False)
+            walker = WALKER()
+            walker.id_x = 0
+            checker.add(walker)
+
+            result = checker.explore(max_states=7)
+            self.assertEqual(result.violation, "low")
+            self.assertFalse(result.complete)
+            self.assertEqual([automaton["x"] for _, state in result.trace for automaton in state.values()], list(range(8)))
+
+def increment(i: int) -> AttributedTree:
+    '''
+    A transition incrementing x[i][i] up to 3.
+    '''
+    entry = lambda: index(index(identifier("x"), i), i)
+    return transition(compare(entry(), "LT", value(3)), assign(entry(), plus(entry(), value(1))))
+
+class TestMutableValues(unittest.TestCase):
+    def test_restored_values_not_shared(self):
+        # An array of arrays is updated in place without copy: each move must start from its own copy of the state
+        x_type = array_of(array_of(get_bounded_int_type(0, 3), 2), 2)
+        automaton_class = translate_with_types({"x": x_type}, {}, [increment(0), increment(1)], TranslationOptions(state_classes=True))["m_A"]
+
+        for checker in (ModelChecker(deadlocks=False), ParallelModelChecker(2, deadlocks=False)):
+            automaton = automaton_class()
+            automaton.id_x = [[0, 0], [0, 0]]
+            checker.add(automaton)
+
+            result = checker.explore()
+            self.assertEqual((result.n_states, result.n_transitions, result.complete), (16, 24, True))
+
+class TestStores(unittest.TestCase):
+    def test_same_counts(self):
+        for order in ("bfs", "dfs"):
+            expected = add_pairs(ModelChecker(deadlocks=False), 3).explore(order, store=ExactStore())
+
+            # A small disk store grows its table and its records file several times
+            for store in (DiskStore(n_slots=16, data_size=64), BitstateStore(1 << 16)):
+                result = add_pairs(ModelChecker(deadlocks=False), 3).explore(order, store=store)
+                self.assertEqual((result.n_states, result.n_transitions, result.complete), (expected.n_states, expected.n_transitions, True))
+                self.assertGreater(result.coverage, 0.99)
+
+    def test_same_counts_parallel(self):
+        expected = add_pairs(ModelChecker(deadlocks=False), 3).explore()
+        for store in (lambda: DiskStore(n_slots=16, data_size=64), lambda: BitstateStore(1 << 16)):
+            result = add_pairs(ParallelModelChecker(2, deadlocks=False), 3).explore(store=store)
+            self.assertEqual((result.n_states, result.n_transitions), (expected.n_states, expected.n_transitions))
+
+    def test_violation_trace(self):
+        invariants = {"total": lambda components: get_total(components) < 6}
+        expected = add_pairs(ModelChecker(invariants, deadlocks=False), 3).explore()
+
+        result = add_pairs(ModelChecker(invariants, deadlocks=False), 3).explore(store=DiskStore(n_slots=16))
+        self.assertEqual((result.violation, len(result.trace)), ("total", len(expected.trace)))
+
+    def test_lossy_bitstate(self):
+        # 256 bits for 343 states: many collide, and the coverage tells some were skipped (it cannot see the successors skipped with them, so it is higher than the fraction reached)
+        result = add_pairs(ModelChecker(deadlocks=False), 3).explore(store=BitstateStore(32))
+        self.assertLess(result.n_states, 7 ** 3)
+        self.assertLess(result.coverage, 0.9)
+
+    def test_disk_store_removed(self):
+        store = DiskStore()
+        directory = store._directory
+        store.add(b"state")
+        self.assertFalse(store.add(b"state"))
+        store.close()
+        self.assertFalse(os.path.exists(directory))
+
+if __name__ == "__main__":
+    unittest.main()
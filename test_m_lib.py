@@ -0,0 +1,156 @@
+'''
+Tests of the runtime values of `m_lib`, and of the code converting them between types.
+'''
+import unittest
+import asyncio
+from array import array
+import m_lib
+from m_lib import Channel, MRecord, Port, pack, unpack, copy_buffer, check_bounded_buffer, record_class, gather, scatter, check_bounded_column
+from type_tree import TypeTree, get_bounded_int_type, get_int_type
+
+def array_type(entry_type: TypeTree, length: int) -> TypeTree:
+    return TypeTree("array", {"length": length}, [entry_type])
+
+def convert_code(source_type: TypeTree, target_type: TypeTree, data):
+    '''
+    Run the unboxed code converting `data` from `source_type` to `target_type`.
+    '''
+    return eval(source_type.get_coercion_code(target_type, "data"), vars(m_lib), {"data": data})
+
+class TestArrayBuffers(unittest.TestCase):
+    def test_pack_pads_to_length(self):
+        s11n = pack(array("b", [1, 2]), ("array", 4, ("bounded", 0, 9)))
+        self.assertEqual(unpack(s11n), array("b", [1, 2, 0, 0]))
+
+        with self.assertRaises(ValueError):
+            pack(array("b", [1, 20]), ("array", 4, ("bounded", 0, 9)))
+
+    def test_copy_pads_to_length(self):
+        data = array("b", [1, 2, 3])
+        self.assertEqual(copy_buffer(data, "h", 5), array("h", [1, 2, 3, 0, 0]))
+        self.assertEqual(check_bounded_buffer(array("q", [4, 5]), "b", 0, 9, 3), array("b", [4, 5, 0]))
+        self.assertEqual(len(copy_buffer(data, "b")), 3)
+
+        with self.assertRaises(ValueError):
+            copy_buffer(data, "b", 2)
+
+    def test_coercion_to_longer_array(self):
+        short = array_type(get_bounded_int_type(0, 9), 2)
+        data = array("b", [7, 8])
+
+        self.assertEqual(convert_code(short, array_type(get_bounded_int_type(0, 9), 4), data), array("b", [7, 8, 0, 0]))
+        self.assertEqual(convert_code(short, array_type(get_int_type(), 3), data), array("q", [7, 8, 0]))
+        self.assertEqual(convert_code(array_type(get_int_type(), 2), array_type(get_bounded_int_type(0, 9), 3), array("q", [7, 8])), array("b", [7, 8, 0]))
+
+        # The same type shares its buffer
+        self.assertIs(convert_code(short, array_type(get_bounded_int_type(0, 9), 2), data), data)
+
+class TestChannel(unittest.TestCase):
+    def test_wraparound(self):
+        channel = Channel(capacity=3)
+        expected = []
+        popped = []
+        for i in range(10):
+            # Two in, one out: the slots wrap around the ring several times
+            for value in (2 * i, 2 * i + 1):
+                if channel.push(value):
+                    expected.append(value)
+            popped.append(channel.pop())
+        
+        self.assertEqual(len(channel), 2)
+        self.assertTrue(channel.push(100))
+        self.assertFalse(channel.push(101))
+        expected.append(100)
+        popped += channel.pop_many()
+        self.assertEqual(popped, expected)
+
+        with self.assertRaises(IndexError):
+            channel.pop()
+
+    def test_batches_across_the_end(self):
+        channel = Channel(capacity=5)
+        self.assertEqual(channel.push_many([0, 1, 2, 3]), 4)
+        self.assertEqual(channel.pop_many(3), [0, 1, 2])
+
+        # From slot 4 to slot 2
+        self.assertEqual(channel.push_many([4, 5, 6, 7, 8, 9]), 4)
+        self.assertEqual(channel.pop_many(2), [3, 4])
+        self.assertEqual(channel.push_many([9, 10]), 2)
+        self.assertEqual(channel.pop_many(), [5, 6, 7, 9, 10])
+        self.assertEqual(channel._slots, [None] * 5)
+
+    def test_copied_with_s11n_code(self):
+        channel = Channel(("bounded", 0, 9), capacity=2)
+        self.assertTrue(channel.push(3))
+        with self.assertRaises(ValueError):
+            channel.push(10)
+        with self.assertRaises(ValueError):
+            channel.push_many([12])
+        
+        # A refused value takes no slot
+        self.assertEqual(channel.push_many([4, 12]), 1)
+        self.assertEqual(channel.pop_many(), [3, 4])
+
+    def test_backpressure(self):
+        channel = Channel(capacity=2)
+        received = []
+
+        async def produce():
+            for i in range(20):
+                await channel.put(i)
+        
+        async def consume():
+            for _ in range(20):
+                received.append(await channel.get())
+                self.assertLessEqual(len(channel), 2)
+        
+        async def main():
+            await asyncio.gather(produce(), consume())
+        
+        asyncio.run(main())
+        self.assertEqual(received, list(range(20)))
+
+class TestBatchColumns(unittest.TestCase):
+    def test_gather_and_scatter(self):
+        ports = tuple([Port(value=i) for i in range(4)])
+        self.assertEqual(gather(ports, "shared", m_lib.numpy.int64).tolist(), [0, 1, 2, 3])
+
+        mask = m_lib.numpy.array([True, False, True, False])
+        scatter(ports, "shared", mask, m_lib.numpy.array([10, 11, 12, 13]))
+        scatter(ports, "reqWrite", mask, True)
+        self.assertEqual([port._value for port in ports], [10, 1, 12, 3])
+        self.assertEqual(gather(ports, "reqWrite", m_lib.numpy.bool_).tolist(), [True, False, True, False])
+
+        # Written through the properties, which bump the versions
+        self.assertEqual([port.version for port in ports], [2, 0, 2, 0])
+
+    def test_check_bounded_column(self):
+        values = m_lib.numpy.array([1, 20, 3])
+        self.assertIs(check_bounded_column(values, m_lib.numpy.array([True, False, True]), 0, 9), values)
+
+        with self.assertRaises(ValueError):
+            check_bounded_column(values, m_lib.numpy.array([False, True, False]), 0, 9)
+        with self.assertRaises(ValueError):
+            check_bounded_column(-1, m_lib.numpy.array([False, True]), 0, 9)
+
+class TestRecords(unittest.TestCase):
+    def test_equal_by_layout(self):
+        # Unpacked before the generated class of its layout is defined
+        s11n = pack(record_class(("u", "v"))(1, 2), ("struct", ("u", "direct"), ("v", "direct")))
+        fallback = unpack(s11n)
+
+        class struct_0(MRecord):
+            __slots__ = ("u", "v",)
+
+            def __init__(self, u, v):
+                self.u = u
+                self.v = v
+        
+        self.assertIs(type(unpack(s11n)), struct_0)
+        self.assertEqual(fallback, struct_0(1, 2))
+        self.assertEqual(struct_0(1, 2), fallback)
+        self.assertNotEqual(fallback, struct_0(1, 3))
+        self.assertNotEqual(fallback, record_class(("v", "u"))(1, 2))
+
+if __name__ == "__main__":
+    unittest.main()
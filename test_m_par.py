@@ -0,0 +1,187 @@
+'''
+Tests of the partitioned and threaded execution of systems, on components written like the state classes generated by `AutomatonTranslator`.
+'''
+import unittest
+import multiprocessing
+from array import array
+from typing import Any, List, Tuple
+from m_lib import Port, RoundScheduler, convert, record_class
+from m_par import ChannelPort, SharedChannel, PartitionedScheduler, ThreadScheduler, get_port_updates, apply_port_fields
+
+class Writer:
+    '''
+    Writes 0, ..., n - 1 to its port, each once the previous one is read.
+    '''
+    def __init__(self, p: Port, n: int):
+        self.p = p
+        self.n = n
+        self.x = 0
+
+    def step(self) -> Tuple | None:
+        p = self.p
+        if self.x < self.n and not p.reqWrite:
+            p.value = self.x
+            p.reqWrite = True
+            self.x += 1
+            return ()
+
+        return None
+
+    def watched(self) -> Tuple[Port, ...]:
+        return (self.p,)
+
+class Reader:
+    '''
+    Announces it is ready to read, then sums the values written to its port.
+    '''
+    def __init__(self, p: Port):
+        self.p = p
+        self.y = 0
+
+    def step(self) -> Tuple | None:
+        p = self.p
+        if not p.reqRead:
+            p.reqRead = True
+            return ()
+
+        if p.reqWrite:
+            self.y += p.value
+            p.reqWrite = False
+            p.reqRead = False
+            return ()
+
+        return None
+
+    def watched(self) -> Tuple[Port, ...]:
+        return (self.p,)
+
+def new_channel_port() -> ChannelPort:
+    port = Port()
+    port.__class__ = ChannelPort
+    port.arrivals = 0
+    port.written = set()
+    return port
+
+class TestChannelPort(unittest.TestCase):
+    def test_merge_written_fields(self):
+        # The copies of a port in two partitions, updated in the same round
+        writer_copy = new_channel_port()
+        reader_copy = new_channel_port()
+        writer_copy.value = 7
+        writer_copy.reqWrite = True
+        reader_copy.reqRead = True
+
+        writer_updates = get_port_updates([writer_copy])
+        reader_updates = get_port_updates([reader_copy])
+        for port in (writer_copy, reader_copy):
+            for updates in (writer_updates, reader_updates):
+                for _, fields, _ in updates:
+                    apply_port_fields(port, fields)
+
+            self.assertEqual((port._value, port._reqRead, port._reqWrite), (7, True, True))
+
+        self.assertEqual(get_port_updates([writer_copy, reader_copy]), [])
+
+def produce(channel: SharedChannel, n: int):
+    # Pushed in batches of at most 3, waiting for the consumer when the channel is full
+    i = 0
+    while i < n:
+        i += channel.push_many([(i + k) % 100 for k in range(min(3, n - i))])
+
+class TestSharedChannel(unittest.TestCase):
+    def test_wraparound(self):
+        for s11n_code in (("bounded", 0, 99), "direct"):
+            channel = SharedChannel(s11n_code, capacity=3)
+            self.addCleanup(channel.close)
+
+            expected = []
+            popped = []
+            for i in range(10):
+                for value in (2 * i, 2 * i + 1):
+                    if channel.push(value):
+                        expected.append(value)
+                popped.append(channel.pop())
+            
+            self.assertEqual(len(channel), 2)
+            self.assertEqual(channel.push_many([50, 51]), 1)
+            expected.append(50)
+            popped += channel.pop_many()
+            self.assertEqual(popped, expected)
+
+            with self.assertRaises(IndexError):
+                channel.pop()
+
+    def test_across_processes(self):
+        n = 500
+        channel = SharedChannel(("bounded", 0, 99), capacity=4)
+        self.addCleanup(channel.close)
+
+        # The producer attaches to the block by its name
+        producer = multiprocessing.get_context("spawn").Process(target=produce, args=(channel, n))
+        producer.start()
+
+        received = []
+        while len(received) < n:
+            received += channel.pop_many(2)
+        producer.join()
+
+        self.assertEqual(received, [i % 100 for i in range(n)])
+        self.assertEqual(producer.exitcode, 0)
+
+    def test_values_like_unpack(self):
+        s11n_code = ("struct", ("u", ("bounded", 0, 9)), ("v", ("array", 3, ("bounded", 0, 200))))
+        channel = SharedChannel(s11n_code, capacity=2)
+        self.addCleanup(channel.close)
+
+        value = record_class(("u", "v"))(4, array("B", [1, 2]))
+        self.assertTrue(channel.push(value))
+        self.assertEqual(channel.pop(), convert(value, s11n_code))
+
+        with self.assertRaises(ValueError):
+            channel.push(record_class(("u", "v"))(4, array("B", [1, 2, 3, 4])))
+
+class TestPartitionedScheduler(unittest.TestCase):
+    def test_handshake_across_partitions(self):
+        n = 50
+        scheduler = PartitionedScheduler(2)
+        for _ in range(3):
+            p = Port()
+            scheduler.add(Writer(p, n), ports=(p,))
+            scheduler.add(Reader(p), ports=(p,))
+
+        # Every writer in the first partition, every reader in the second
+        results = scheduler.run(10 * n, lambda components: [component.y for component in components if isinstance(component, Reader)], [0, 1] * 3)
+
+        self.assertEqual(results[1][1], [sum(range(n))] * 3)
+
+def add_handshakes(scheduler: Any, n_pairs: int, n: int) -> List[Reader]:
+    readers = []
+    for _ in range(n_pairs):
+        p = Port()
+        readers.append(Reader(p))
+        scheduler.add(Writer(p, n), ports=(p,))
+        scheduler.add(readers[-1], ports=(p,))
+    
+    return readers
+
+class TestThreadScheduler(unittest.TestCase):
+    def test_same_totals_as_rounds(self):
+        n = 40
+        round_scheduler = RoundScheduler()
+        expected = add_handshakes(round_scheduler, 5, n)
+        round_steps = round_scheduler.run(10 ** 6)
+        self.assertEqual([reader.y for reader in expected], [sum(range(n))] * 5)
+
+        for n_workers in (1, 2, 4):
+            scheduler = ThreadScheduler(n_workers, seed=0)
+            readers = add_handshakes(scheduler, 5, n)
+
+            # The idle components are parked, so the run ends before the limit
+            n_steps = scheduler.run(10 ** 6)
+            self.assertLess(n_steps, 10 ** 6)
+            self.assertEqual([reader.y for reader in readers], [sum(range(n))] * 5)
+            if n_workers == 1:
+                self.assertEqual(n_steps, round_steps)
+
+if __name__ == "__main__":
+    unittest.main()
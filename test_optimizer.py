@@ -0,0 +1,131 @@
+'''
+Tests of the translation-time analyses of `optimizer`, on term trees built like the ones of the parser.
+'''
+import unittest
+from template import TypeContext
+from type_tree import get_bounded_int_type, get_int_type
+from optimizer import ConstantFolder, IntervalAnalyzer, ProductBuilder, INFINITY
+from translator import AutomatonTranslator, TranslationOptions, format_range_check_report
+from utils import AttributedTree, CodeEmitter
+from test_translator import value, identifier, plus, compare, times, assign, transition, SignatureManager
+
+def minus(operand: AttributedTree) -> AttributedTree:
+    return AttributedTree("term_b", {}, [AttributedTree("MIN", {}, []), operand])
+
+def logical(name: str, operator: str, *operands: AttributedTree) -> AttributedTree:
+    children = [operands[0]]
+    for operand in operands[1:]:
+        children += [AttributedTree(operator, {}, []), operand]
+
+    return AttributedTree(name, {}, children)
+
+def chain(*parts) -> AttributedTree:
+    '''
+    A left-associative sum, e.g. chain(2, "PLUS", 3, "PLUS", identifier("x")).
+    '''
+    children = [value(part) if type(part) is int else AttributedTree(part, {}, []) if type(part) is str else part for part in parts]
+    return AttributedTree("term_d", {}, children)
+
+def shape(tree: AttributedTree) -> tuple:
+    '''
+    The name, attributes and children of a tree, compared by value.
+    '''
+    return (tree.name, {key: tree.attributes[key] for key in tree.attributes}, [shape(child) for child in tree.children])
+
+def get_context() -> TypeContext:
+    type_context = TypeContext()
+    type_context.set_template_arg("N", value(4))
+    type_context.set_local_var_type("x", get_bounded_int_type(0, 9))
+    type_context.set_local_var_type("n", get_int_type())
+    return type_context
+
+class TestConstantFolder(unittest.TestCase):
+    def setUp(self):
+        self.folder = ConstantFolder(get_context())
+
+    def assertFolded(self, term_tree: AttributedTree, expected: AttributedTree):
+        self.assertEqual(shape(self.folder.fold(term_tree)), shape(expected))
+
+    def test_arithmetic(self):
+        self.assertFolded(times(plus(value(2), value(3)), "MUL", minus(value(4))), value(-20))
+        self.assertFolded(times(identifier("N"), "DIV", value(3)), value(1))
+
+        # Only the constant prefix of a chain is folded
+        self.assertFolded(chain(2, "PLUS", 3, "PLUS", identifier("x"), "PLUS", 1), chain(5, "PLUS", identifier("x"), "PLUS", 1))
+
+    def test_division_by_zero_left_to_runtime(self):
+        term_tree = times(value(1), "DIV", value(0))
+        self.assertFolded(term_tree, term_tree)
+
+    def test_comparisons_and_logic(self):
+        self.assertFolded(compare(identifier("N"), "GT", value(3)), value(True))
+
+        x_small = compare(identifier("x"), "LT", value(3))
+        self.assertFolded(logical("term_g", "AND", x_small, compare(identifier("N"), "EQ", value(4))), x_small)
+        self.assertFolded(logical("term_g", "AND", x_small, value(False)), value(False))
+        self.assertFolded(logical("term_h", "OR", x_small, value(True)), value(True))
+        self.assertFolded(logical("term_h", "OR", value(False), value(False)), value(False))
+
+    def test_original_untouched(self):
+        term_tree = plus(identifier("N"), value(1))
+        self.assertFolded(term_tree, value(5))
+        self.assertEqual(shape(term_tree), shape(plus(identifier("N"), value(1))))
+
+class TestIntervalAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = IntervalAnalyzer(get_context())
+
+    def test_evaluate(self):
+        self.assertEqual(self.analyzer.evaluate(plus(identifier("x"), value(1)), {}), (1, 10))
+        self.assertEqual(self.analyzer.evaluate(times(identifier("x"), "MUL", minus(value(2))), {}), (-18, 0))
+        self.assertEqual(self.analyzer.evaluate(times(identifier("n"), "MOD", value(7)), {}), (0, 6))
+        self.assertEqual(self.analyzer.evaluate(plus(identifier("n"), value(1)), {}), (-INFINITY, INFINITY))
+        self.assertIsNone(self.analyzer.evaluate(value(True), {}))
+
+    def test_refine(self):
+        self.assertEqual(self.analyzer.refine(compare(identifier("x"), "LT", value(5)), {})["x"], (0, 4))
+
+        # The comparison is flipped when the variable is on the right
+        self.assertEqual(self.analyzer.refine(compare(value(3), "LT", identifier("x")), {})["x"], (4, 9))
+        self.assertEqual(self.analyzer.refine(logical("term_g", "AND", compare(identifier("n"), "GEQ", value(0)), compare(identifier("n"), "LEQ", identifier("x"))), {})["n"], (0, 9))
+
+        # A disjunction tells nothing
+        self.assertEqual(self.analyzer.refine(logical("term_h", "OR", compare(identifier("x"), "LT", value(5)), compare(identifier("x"), "GT", value(7))), {}), {})
+
+    def test_range_checks_elided(self):
+        # x + 1 fits in 0..9 under the guard x < 9, but not under x < 10
+        type_context = TypeContext()
+        type_context.set_local_var_type("x", get_bounded_int_type(0, 9))
+        var_decls = AttributedTree("automaton_vars", {}, [AttributedTree("var_decl", {}, [identifier("x"), get_bounded_int_type(0, 9)])])
+        transitions = [transition(compare(identifier("x"), "LT", value(bound)), assign(identifier("x"), plus(identifier("x"), value(1)))) for bound in (9, 10)]
+        body = AttributedTree("automaton", {}, [var_decls, AttributedTree("automaton_trans", {}, transitions)])
+
+        translator = AutomatonTranslator(type_context, "m_A", SignatureManager("()"), body, CodeEmitter(), TranslationOptions(state_classes=True))
+        translator.translate()
+
+        self.assertEqual([checked for _, _, checked in translator.range_check_report], [False, True])
+        self.assertEqual(format_range_check_report(translator.range_check_report).split("\n"), [
+            "elided m_A: self.id_x = (self.id_x + 1)",
+            "kept   m_A: self.id_x = (self.id_x + 1)",
+            "1 kept, 1 elided",
+        ])
+
+class TestProductBuilder(unittest.TestCase):
+    def test_joint_transitions(self):
+        # Two parties with two transitions each synchronizing on p, and a transition without synchronization
+        sync_p = lambda: AttributedTree("sync_stmt", {}, [identifier("p")])
+        members = [AttributedTree("automaton", {}, [AttributedTree("automaton_trans", {}, [transition(compare(identifier(name), "LT", value(k)), assign(identifier(name), value(k)), sync_p()) for k in (1, 2)])]) for name in ("x", "y")]
+        members[1].children[0].children.append(transition(value(True), assign(identifier("y"), value(0))))
+
+        self.assertIsNone(ProductBuilder(4).build(members, {"p": [0, 1]}))
+
+        product = ProductBuilder(5).build(members, {"p": [0, 1]})
+        transitions = product.get_child_by_name("automaton_trans").children
+        self.assertEqual(len(transitions), 5)
+
+        # The guards are joined, and the statements before the synchronizations kept in order
+        joint = transitions[-1].children[0]
+        self.assertEqual(shape(joint), shape(AttributedTree("guarded_stmt", {}, [AttributedTree("term_g", {}, [compare(identifier("x"), "LT", value(2)), compare(identifier("y"), "LT", value(2))]), assign(identifier("x"), value(2)), assign(identifier("y"), value(2))])))
+
+if __name__ == "__main__":
+    unittest.main()
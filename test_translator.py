@@ -0,0 +1,720 @@
+'''
+Behavioural tests of the code generated by the automaton translator. The automata are built as AttributedTrees, translated, then run.
+'''
+import unittest
+import asyncio
+import re
+from typing import Any, Callable, Dict, List
+from m_lib import Port, Batch, AsyncioScheduler, RoundScheduler
+from utils import AttributedTree, CodeEmitter
+from template import TypeContext, ExpansionRequest, ExpansionDatum, SignatureForm
+from type_tree import TypeTree, get_bool_type, get_bounded_int_type, get_int_type, get_transfer_class
+from translator import AutomatonTranslator, FunctionTranslator, SystemTranslator, TranslationOptions
+
+def value(val: Any) -> AttributedTree:
+    return AttributedTree("VALUE", {"value": val}, [])
+
+def identifier(name: str) -> AttributedTree:
+    return AttributedTree("IDENTIFIER", {"value": name}, [])
+
+def binary(name: str, lhs: AttributedTree, operator: str, rhs: AttributedTree) -> AttributedTree:
+    return AttributedTree(name, {}, [lhs, AttributedTree(operator, {}, []), rhs])
+
+def plus(lhs: AttributedTree, rhs: AttributedTree) -> AttributedTree:
+    return binary("term_d", lhs, "PLUS", rhs)
+
+def compare(lhs: AttributedTree, operator: str, rhs: AttributedTree) -> AttributedTree:
+    return binary("term_e", lhs, operator, rhs)
+
+def times(lhs: AttributedTree, operator: str, rhs: AttributedTree) -> AttributedTree:
+    return binary("term_c", lhs, operator, rhs)
+
+def dot(term: AttributedTree, field: str) -> AttributedTree:
+    return AttributedTree("dot_term", {}, [term, identifier(field)])
+
+def assign(lhs: AttributedTree, rhs: AttributedTree) -> AttributedTree:
+    return AttributedTree("assign_stmt", {}, [AttributedTree("lhs", {}, [lhs]), AttributedTree("rhs", {}, [rhs])])
+
+def transition(guard: AttributedTree, *stmts: AttributedTree) -> AttributedTree:
+    return AttributedTree("transition", {}, [AttributedTree("guarded_stmt", {}, [guard, *stmts])])
+
+class SignatureManager:
+    '''
+    The part of `TemplateManager` used by the automaton translator.
+    '''
+    def __init__(self, signature_string: str):
+        self._signature_string = signature_string
+
+    def get_signature_string(self, name: str) -> str:
+        return self._signature_string
+
+def translate_source(var_bounds: Dict[str, tuple | None], transitions: list, options: TranslationOptions, ports: Dict[str, str] = {}, name: str = "m_A") -> str:
+    '''
+    Translate an automaton with integer variables (bounded, unless their bounds are None) and integer ports (`ports` gives their direction, "in" or "out").
+    '''
+    type_context = TypeContext()
+    for port_name, IO in ports.items():
+        type_context.set_param_type(port_name, get_int_type(), IO)
+
+    var_decls = []
+    for var_name, bounds in var_bounds.items():
+        type_tree = get_int_type() if bounds is None else get_bounded_int_type(*bounds)
+        type_context.set_local_var_type(var_name, type_tree)
+        var_decls.append(AttributedTree("var_decl", {}, [identifier(var_name), type_tree]))
+
+    body = AttributedTree("automaton", {}, [AttributedTree("automaton_vars", {}, var_decls), AttributedTree("automaton_trans", {}, transitions)])
+
+    emitter = CodeEmitter()
+    signature_string = "(" + ", ".join(["id_" + port_name for port_name in ports]) + ")"
+    AutomatonTranslator(type_context, name, SignatureManager(signature_string), body, emitter, options).translate()
+
+    return emitter.getvalue()
+
+def translate_automaton(var_bounds: Dict[str, tuple | None], transitions: list, options: TranslationOptions, ports: Dict[str, str] = {}, name: str = "m_A") -> Dict[str, Any]:
+    '''
+    Translate an automaton (see `translate_source`) and return the namespace of the generated code.
+    '''
+    namespace = {}
+    exec("from m_lib import *\n" + translate_source(var_bounds, transitions, options, ports, name), namespace)
+    return namespace
+
+class TestSharedTerms(unittest.TestCase):
+    def _get_transitions(self) -> list:
+        # Both guards share `x + 1`, which the first transition writes before reading it again
+        x_plus_one = lambda: plus(identifier("x"), value(1))
+        return [
+            transition(compare(x_plus_one(), "LT", value(50)), assign(identifier("x"), x_plus_one()), assign(identifier("y"), x_plus_one())),
+            transition(compare(x_plus_one(), "GT", value(60)), assign(identifier("x"), value(0))),
+        ]
+
+    def test_guard_terms_after_write_state_class(self):
+        automaton = translate_automaton({"x": (0, 100), "y": (0, 100)}, self._get_transitions(), TranslationOptions(state_classes=True))["m_A"]()
+        automaton.id_x = 3
+        automaton.id_y = 0
+        automaton.step()
+
+        self.assertEqual(automaton.id_x, 4)
+        self.assertEqual(automaton.id_y, 5)
+
+    def test_guard_terms_after_write_coroutine(self):
+        source = translate_source({"x": (0, 100), "y": (0, 100)}, self._get_transitions(), TranslationOptions())
+        self.assertIn("id_y, = check_bounded((id_x + 1), 0, 100),", source)
+
+class TestUnboxed(unittest.TestCase):
+    def _get_transitions(self, modulus: int) -> list:
+        # x counts up to 99 while accumulating, then y counts modulo `modulus`
+        return [
+            transition(compare(identifier("x"), "LT", value(99)), assign(identifier("x"), plus(identifier("x"), value(1))), assign(identifier("acc"), times(plus(times(identifier("acc"), "MUL", value(3)), identifier("x")), "MOD", value(1000)))),
+            transition(compare(identifier("x"), "GEQ", value(99)), assign(identifier("x"), value(0)), assign(identifier("y"), times(plus(identifier("y"), value(1)), "MOD", value(modulus)))),
+        ]
+
+    def _run(self, checked: bool, modulus: int, n_steps: int) -> tuple:
+        namespace = translate_automaton({"x": (0, 99), "y": (0, 6), "acc": (0, 999)}, self._get_transitions(modulus), TranslationOptions(checked=checked, state_classes=True))
+        automaton = namespace["m_A"]()
+        automaton.id_x = automaton.id_y = automaton.id_acc = namespace["MInt"](0) if checked else 0
+        for _ in range(n_steps):
+            automaton.step()
+        
+        return automaton.id_x, automaton.id_y, automaton.id_acc
+
+    def test_same_as_checked(self):
+        self.assertEqual(self._run(False, 7, 1000), self._run(True, 7, 1000))
+
+    def test_native_values(self):
+        self.assertEqual(set([type(value) for value in self._run(False, 7, 1000)]), set([int]))
+
+    def test_narrowing_checked(self):
+        # y + 1 modulo 8 does not fit in 0..6
+        self.assertEqual(self._run(False, 8, 650)[1], 6)
+        with self.assertRaises(ValueError):
+            self._run(False, 8, 750)
+
+def index(term: AttributedTree, i: int) -> AttributedTree:
+    return AttributedTree("brack_term", {}, [term, value(i)])
+
+def array_of(entry_type: TypeTree, length: int) -> TypeTree:
+    return TypeTree("array", {"length": length}, [entry_type])
+
+class FunctionManager(SignatureManager):
+    '''
+    The part of `TemplateManager` used to translate the calls to functions without template arguments. `functions` maps their names to their parameters (name -> type), their return type and their bodies.
+    '''
+    def __init__(self, signature_string: str, functions: Dict[str, tuple]):
+        super().__init__(signature_string)
+        self._functions = functions
+        self._data: Dict[str, ExpansionDatum] = {}
+    
+    def query(self, expansion_request: ExpansionRequest, raise_exception: bool = True) -> ExpansionDatum | None:
+        return self._data.get(expansion_request.name)
+    
+    def create(self, expansion_request: ExpansionRequest) -> ExpansionDatum:
+        name = expansion_request.name
+        params, return_type, body = self._functions[name]
+        signature = SignatureForm([(param_name, type_tree, None) for param_name, type_tree in params.items()] + [("!", return_type, None)])
+
+        type_context = TypeContext()
+        signature.transform(type_context)
+        for var_decl in body.children:
+            if var_decl.name == "var_decl":
+                type_context.set_local_var_type(var_decl.children[0].get_attribute("value"), var_decl.children[-1])
+        
+        self._data[name] = ExpansionDatum([], signature, type_context, "m_0_" + name)
+        return self._data[name]
+    
+    def get_function_body(self, name: str) -> AttributedTree | None:
+        return self._functions[name][2] if name in self._functions else None
+    
+    def get_signature_string(self, name: str) -> str:
+        if name in self._functions:
+            return "(" + ", ".join(["id_" + param_name for param_name in self._functions[name][0]]) + ")"
+        
+        return super().get_signature_string(name)
+
+def call(name: str, *arguments: AttributedTree) -> AttributedTree:
+    return AttributedTree("func_term", {}, [identifier(name), *arguments])
+
+def function(*stmts: AttributedTree) -> AttributedTree:
+    '''
+    The body of a function: its variable declarations, assignments and return statement.
+    '''
+    return AttributedTree("function", {}, list(stmts))
+
+def translate_with_types(var_types: Dict[str, TypeTree], port_types: Dict[str, TypeTree], transitions: list, options: TranslationOptions, functions: Dict[str, tuple] = {}) -> Dict[str, Any]:
+    '''
+    Translate an automaton whose variables and ports (all "out") have the given types, with the functions it calls (see `FunctionManager`). Return the namespace of the generated code, where "source" is the code of the automaton.
+    '''
+    type_context = TypeContext()
+    for port_name, type_tree in port_types.items():
+        type_context.set_param_type(port_name, type_tree, "out")
+    for var_name, type_tree in var_types.items():
+        type_context.set_local_var_type(var_name, type_tree)
+    
+    var_decls = [AttributedTree("var_decl", {}, [identifier(var_name), type_tree]) for var_name, type_tree in var_types.items()]
+    body = AttributedTree("automaton", {}, [AttributedTree("automaton_vars", {}, var_decls), AttributedTree("automaton_trans", {}, transitions)])
+
+    emitter = CodeEmitter()
+    signature_string = "(" + ", ".join(["id_" + port_name for port_name in port_types]) + ")"
+    manager = FunctionManager(signature_string, functions)
+    AutomatonTranslator(type_context, "m_A", manager, body, emitter, options).translate()
+    namespace = {"source": emitter.getvalue()}
+
+    # The functions called, directly or not, whether they are inlined or not
+    translated = set()
+    while len(translated) < len(manager._data):
+        for name, expansion_datum in list(manager._data.items()):
+            if name not in translated:
+                translated.add(name)
+                emitter.line()
+                FunctionTranslator(expansion_datum.expanded_context, expansion_datum.actual_name, manager, functions[name][2], emitter, options).translate()
+    
+    exec("from m_lib import *\n" + emitter.getvalue(), namespace)
+    return namespace
+
+class TestTransfer(unittest.TestCase):
+    def test_transfer_classes(self):
+        self.assertEqual(get_transfer_class(get_bounded_int_type(0, 3)), "immutable")
+        self.assertEqual(get_transfer_class(TypeTree("tuple", {}, [get_int_type(), get_int_type()])), "immutable")
+        self.assertEqual(get_transfer_class(array_of(get_int_type(), 4)), "copy_on_write")
+        self.assertEqual(get_transfer_class(array_of(array_of(get_int_type(), 2), 2)), "mutable")
+
+    def test_port_updated_in_place(self):
+        # x = p.value; p.value[0] = 7;
+        stmts = [assign(identifier("x"), dot(identifier("p"), "value")), assign(index(dot(identifier("p"), "value"), 0), value(7))]
+        int_array = array_of(get_int_type(), 4)
+        for checked in (False, True):
+            namespace = translate_with_types({"x": int_array}, {"p": int_array}, [transition(value(True), *stmts)], TranslationOptions(checked=checked, state_classes=True))
+            p = Port(("array", 4, "direct"), [1, 2, 3, 4])
+            woken = []
+            namespace["watch"]((p,), 0, lambda: woken.append(True))
+            version = p.version
+
+            automaton = namespace["m_A"](p)
+            automaton.step()
+
+            # The value read before is not updated under the reader, and the watchers see the write
+            self.assertEqual(automaton.id_x, [1, 2, 3, 4])
+            self.assertEqual(p._value, [7, 2, 3, 4])
+            self.assertGreater(p.version, version)
+            self.assertEqual(woken, [True])
+
+    def test_owned_variable(self):
+        # y = x; x[0] = 7; x[1] = 8; p.value = x; x[2] = 9;
+        int_array = array_of(get_int_type(), 4)
+        stmts = [
+            assign(identifier("y"), identifier("x")),
+            assign(index(identifier("x"), 0), value(7)),
+            assign(index(identifier("x"), 1), value(8)),
+            assign(dot(identifier("p"), "value"), identifier("x")),
+            assign(index(identifier("x"), 2), value(9)),
+        ]
+        namespace = translate_with_types({"x": int_array, "y": int_array}, {"p": int_array}, [transition(value(True), *stmts)], TranslationOptions(state_classes=True))
+        p = Port(("array", 4, "direct"))
+        automaton = namespace["m_A"](p)
+        automaton.id_x = [1, 2, 3, 4]
+        automaton.ow_x = None
+        automaton.step()
+
+        self.assertEqual(automaton.id_y, [1, 2, 3, 4])
+        self.assertEqual(p._value, [7, 8, 3, 4])
+        self.assertEqual(automaton.id_x, [7, 8, 9, 4])
+
+        # x was copied before its first update, and again after it was sent, then owns its copy
+        self.assertIsNot(p._value, automaton.id_x)
+        self.assertIs(automaton.ow_x, automaton.id_x)
+
+def return_stmt(term: AttributedTree) -> AttributedTree:
+    return AttributedTree("return_stmt", {}, [term])
+
+def get_functions() -> Dict[str, tuple]:
+    '''
+    `sq(a, b)` is (a + b) * (a + b) through a local, `pos(n)` is true and recursive, and `low(a, b)` reads its bounded parameter `a` only if `b` holds.
+    '''
+    n = identifier("n")
+    return {
+        "sq": ({"a": get_int_type(), "b": get_int_type()}, get_int_type(), function(AttributedTree("var_decl", {}, [identifier("t"), get_int_type()]), assign(identifier("t"), plus(identifier("a"), identifier("b"))), return_stmt(times(identifier("t"), "MUL", identifier("t"))))),
+        "pos": ({"n": get_int_type()}, get_bool_type(), function(return_stmt(AttributedTree("term_h", {}, [compare(n, "LEQ", value(0)), call("pos", binary("term_d", n, "MIN", value(1)))])))),
+        "low": ({"a": get_bounded_int_type(0, 9), "b": get_bool_type()}, get_bool_type(), function(return_stmt(AttributedTree("term_g", {}, [identifier("b"), compare(identifier("a"), "LT", value(5))])))),
+    }
+
+class TestInlining(unittest.TestCase):
+    def _run(self, transitions: list, options: TranslationOptions, n_steps: int) -> tuple:
+        '''
+        Run an automaton calling the functions of `get_functions` from x = y = 0. Return the source of the automaton and its integer variables after each step.
+        '''
+        namespace = translate_with_types({"x": get_bounded_int_type(0, 20), "y": get_bounded_int_type(0, 1000), "z": get_bool_type()}, {}, transitions, options, get_functions())
+        automaton = namespace["m_A"]()
+        automaton.id_x = automaton.id_y = 0
+
+        trace = []
+        for _ in range(n_steps):
+            automaton.step()
+            trace.append((automaton.id_x, automaton.id_y))
+        
+        return namespace["source"], trace
+
+    def test_small_function_inlined(self):
+        x, y = identifier("x"), identifier("y")
+        transitions = [transition(compare(call("sq", x, value(1)), "LT", value(100)), assign(y, times(call("sq", x, y), "MOD", value(1000))), assign(x, plus(x, value(1))))]
+
+        inlined_source, inlined = self._run(transitions, TranslationOptions(state_classes=True), 12)
+        called_source, called = self._run(transitions, TranslationOptions(state_classes=True, inline_threshold=0), 12)
+
+        self.assertNotIn("m_0_sq(", inlined_source)
+        self.assertIn("m_0_sq(", called_source)
+        self.assertEqual(inlined, called)
+        self.assertEqual(inlined[-1][0], 9)
+
+    def test_recursive_function_kept(self):
+        x = identifier("x")
+        transitions = [transition(AttributedTree("term_g", {}, [call("pos", x), compare(x, "LT", value(5))]), assign(x, plus(x, value(1))))]
+
+        source, trace = self._run(transitions, TranslationOptions(state_classes=True), 8)
+        self.assertIn("m_0_pos(", source)
+        self.assertEqual(trace, self._run(transitions, TranslationOptions(state_classes=True, inline_threshold=0), 8)[1])
+        self.assertEqual(trace[-1], (5, 0))
+
+    def test_skipped_range_check_kept(self):
+        # low(x, false) never reads x, whose conversion to 0..9 is checked by the call
+        x = identifier("x")
+        transitions = [transition(value(True), assign(identifier("z"), call("low", x, value(False))), assign(x, plus(x, value(1))))]
+
+        for inline_threshold in (32, 0):
+            with self.assertRaises(ValueError):
+                self._run(transitions, TranslationOptions(checked=True, state_classes=True, inline_threshold=inline_threshold), 11)
+            
+            source, trace = self._run(transitions, TranslationOptions(checked=True, state_classes=True, inline_threshold=inline_threshold), 10)
+            self.assertIn("m_0_low(", source)
+            self.assertEqual(trace[-1], (10, 0))
+
+class LogPort(Port):
+    '''
+    A port recording the values written to it.
+    '''
+    def __init__(self, name: str, log: List[tuple], parties: int = 2):
+        super().__init__(parties=parties)
+        self.name = name
+        self.log = log
+
+    def _set_value(self, val: Any):
+        Port.value.fset(self, val)
+        self.log.append((self.name, val))
+
+    value = property(Port.value.fget, _set_value)
+    shared = property(Port.shared.fget, _set_value)
+
+def translate_interleaved(options: TranslationOptions) -> Dict[str, Any]:
+    '''
+    `m_A` alternates between two transitions, both enabled in turn. `m_C` writes to `out` around a synchronization on `r`, and `m_D` after it.
+    '''
+    p_value = lambda: dot(identifier("p"), "value")
+    p_req_write = lambda: dot(identifier("p"), "reqWrite")
+    equals = lambda lhs, rhs: binary("term_f", lhs, "EQ", rhs)
+    alternating = [
+        transition(equals(p_req_write(), value(False)), assign(p_value(), value(1)), assign(p_req_write(), value(True))),
+        transition(equals(p_req_write(), value(True)), assign(p_value(), value(2)), assign(p_req_write(), value(False))),
+    ]
+    sync_r = lambda: AttributedTree("sync_stmt", {}, [identifier("r")])
+    out_value = lambda: dot(identifier("out"), "value")
+
+    namespace = translate_automaton({}, alternating, options, {"p": "out"}, "m_A")
+    namespace.update(translate_automaton({}, [transition(value(True), assign(out_value(), value(5)), sync_r(), assign(out_value(), value(6)))], options, {"out": "out", "r": "out"}, "m_C"))
+    namespace.update(translate_automaton({}, [transition(value(True), sync_r(), assign(out_value(), value(7)))], options, {"out": "out", "r": "in"}, "m_D"))
+    return namespace
+
+def record(start: Callable[[List[tuple]], Any], n_events: int) -> List[tuple]:
+    '''
+    Run the automata started by the coroutine `start(log)` on the event loop, until `n_events` values are written.
+    '''
+    log = []
+
+    async def main():
+        task = asyncio.ensure_future(start(log))
+        while len(log) < n_events:
+            await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+    return log[:n_events]
+
+class TestInterleavings(unittest.TestCase):
+    def test_coroutine_like_state_class(self):
+        coroutines = translate_interleaved(TranslationOptions())
+        classes = translate_interleaved(TranslationOptions(state_classes=True))
+
+        async def start_coroutines(log: List[tuple]):
+            r = LogPort("r", log)
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(coroutines["m_A"]().run(LogPort("a", log)))
+                tg.create_task(coroutines["m_A"]().run(LogPort("b", log)))
+                tg.create_task(coroutines["m_C"]().run(LogPort("c", log), r))
+                tg.create_task(coroutines["m_D"]().run(LogPort("d", log), r))
+
+        async def start_classes(log: List[tuple]):
+            r = LogPort("r", log)
+            scheduler = AsyncioScheduler()
+            scheduler.spawn(classes["m_A"], LogPort("a", log))
+            scheduler.spawn(classes["m_A"], LogPort("b", log))
+            scheduler.spawn(classes["m_C"], LogPort("c", log), r)
+            scheduler.spawn(classes["m_D"], LogPort("d", log), r)
+            await scheduler.run()
+
+        expected = record(start_classes, 60)
+
+        # One transition of each automaton in turn
+        self.assertEqual(expected[:3], [("a", 1), ("b", 1), ("c", 5)])
+        self.assertEqual(record(start_coroutines, 60), expected)
+
+class EntityManager:
+    '''
+    The part of `TemplateManager` used by the system translator, for entities without template arguments and with integer ports.
+    '''
+    def __init__(self, port_names: Dict[str, List[str]]):
+        self._signatures = {name: SignatureForm([(port_name, get_int_type(), None) for port_name in port_names[name]]) for name in port_names}
+        self._data: Dict[str, ExpansionDatum] = {}
+    
+    def query(self, expansion_request: ExpansionRequest, raise_exception: bool = True) -> ExpansionDatum | None:
+        return self._data.get(expansion_request.name)
+    
+    def create(self, expansion_request: ExpansionRequest) -> ExpansionDatum:
+        name = expansion_request.name
+        self._data[name] = ExpansionDatum([], self._signatures[name], TypeContext(), "m_0_" + name)
+        return self._data[name]
+    
+    def get_signature_string(self, name: str) -> str:
+        return str(self._signatures[name])
+
+def connect(name: str, *port_names: str) -> AttributedTree:
+    '''
+    The connection of an entity, where "c.p" is the port p of the component c.
+    '''
+    port_trees = []
+    for port_name in port_names:
+        if "." in port_name:
+            port_trees.append(AttributedTree("comp_port_name", {}, [identifier(part) for part in port_name.split(".")]))
+        else:
+            port_trees.append(AttributedTree("sys_port_name", {}, [identifier(port_name)]))
+    
+    return AttributedTree("entity_connection", {}, [identifier(name), *port_trees])
+
+def system(connections: list, components: Dict[str, str] | None = None) -> AttributedTree:
+    children = []
+    if components is not None:
+        component_decls = [AttributedTree("component_decl", {}, [identifier(component_name), AttributedTree("system_type", {}, [identifier(name)])]) for component_name, name in components.items()]
+        children.append(AttributedTree("system_comp", {}, component_decls))
+    children.append(AttributedTree("system_conn", {}, connections))
+    return AttributedTree("system", {}, children)
+
+class AutomatonManager(EntityManager):
+    '''
+    An `EntityManager` whose entities are automata with bounded integer ports and variables. `automata` maps their names to their ports (name -> direction, "In" or "Out"), the bounds of their variables, and their transitions.
+    '''
+    def __init__(self, automata: Dict[str, tuple], port_bounds: tuple = (0, 100)):
+        super().__init__({"Top": []})
+        self.bodies: Dict[str, AttributedTree] = {}
+        self._contexts: Dict[str, TypeContext] = {}
+        for name, (ports, var_bounds, transitions) in automata.items():
+            type_context = TypeContext()
+            for port_name, IO in ports.items():
+                type_context.set_param_type(port_name, get_bounded_int_type(*port_bounds), IO)
+            for var_name, bounds in var_bounds.items():
+                type_context.set_local_var_type(var_name, get_bounded_int_type(*bounds))
+            
+            self._signatures[name] = SignatureForm([(port_name, get_bounded_int_type(*port_bounds), IO) for port_name, IO in ports.items()])
+            self._contexts[name] = type_context
+            var_decls = [AttributedTree("var_decl", {}, [identifier(var_name), get_bounded_int_type(*bounds)]) for var_name, bounds in var_bounds.items()]
+            self.bodies[name] = AttributedTree("automaton", {}, [AttributedTree("automaton_vars", {}, var_decls), AttributedTree("automaton_trans", {}, transitions)])
+    
+    def create(self, expansion_request: ExpansionRequest) -> ExpansionDatum:
+        name = expansion_request.name
+        self._data[name] = ExpansionDatum([], self._signatures[name], self._contexts.get(name, TypeContext()), "m_0_" + name)
+        return self._data[name]
+
+def translate_system(automata: Dict[str, tuple], body: AttributedTree, options: TranslationOptions) -> Dict[str, Any]:
+    '''
+    Translate the system `m_0_Top` connecting the automata of an `AutomatonManager`, and the automata it requests. Return the namespace of the generated code.
+    '''
+    manager = AutomatonManager(automata)
+    emitter = CodeEmitter()
+    requests = SystemTranslator(TypeContext(), "m_0_Top", manager, body, emitter, options, automaton_bodies=manager.bodies).translate()
+    for request in requests:
+        expansion_datum = manager.query(request)
+        AutomatonTranslator(expansion_datum.expanded_context, expansion_datum.actual_name, manager, manager.bodies[request.name], emitter, options, manager.get_signature_string(request.name)).translate()
+        emitter.line()
+    
+    namespace = {"source": emitter.getvalue()}
+    exec("from m_lib import *\n" + namespace["source"], namespace)
+    return namespace
+
+def run_system(namespace: Dict[str, Any], seed: int, max_steps: int) -> RoundScheduler:
+    '''
+    Run the system of `translate_system` with a `RoundScheduler`, from variables set to 0.
+    '''
+    scheduler = RoundScheduler(seed)
+    namespace["m_0_Top"](scheduler)
+    for component in scheduler._components:
+        for stage in getattr(component, "stages", (component,)):
+            for slot in getattr(type(stage), "__slots__", ()):
+                if slot.startswith("id_") and getattr(stage, slot) is None:
+                    setattr(stage, slot, 0)
+    
+    scheduler.run(max_steps)
+    return scheduler
+
+def get_final_values(scheduler: RoundScheduler) -> List[tuple]:
+    '''
+    The variables of every instance of the automata run by a scheduler, and the fields of the ports they are connected to, as a sorted list.
+    '''
+    values = []
+    for component in scheduler._components:
+        for stage in getattr(component, "stages", (component,)):
+            if isinstance(stage, Batch):
+                for name, column in vars(stage).items():
+                    if name.startswith("id_") and not isinstance(column, tuple):
+                        values += [(name, int(entry)) for entry in column]
+                continue
+            
+            for slot in type(stage).__slots__:
+                if slot.startswith("id_") and not isinstance(getattr(stage, slot), Port):
+                    values.append((slot, getattr(stage, slot)))
+    
+    ports = {id(port): port for component_ports in scheduler._ports for port in component_ports}
+    values += [("port", port._value, port._reqRead, port._reqWrite) for port in ports.values()]
+    return sorted(values, key=repr)
+
+def sensor_and_consumers() -> Dict[str, tuple]:
+    '''
+    `S` writes 0 to 8 to its port, and `C` sums them. `D` sums 12 / (k + 1) for the previous value k it received, a division whose divisor the interval analysis cannot prove positive (k starts at 0 but may be -1).
+    '''
+    p_value = lambda: dot(identifier("p"), "value")
+    p_req_write = lambda: dot(identifier("p"), "reqWrite")
+    k_plus_one = plus(identifier("k"), value(1))
+    return {
+        "S": ({"p": "Out"}, {"x": (0, 9)}, [transition(AttributedTree("term_g", {}, [compare(identifier("x"), "LT", value(9)), binary("term_f", p_req_write(), "EQ", value(False))]), assign(p_value(), identifier("x")), assign(p_req_write(), value(True)), assign(identifier("x"), plus(identifier("x"), value(1))))]),
+        "C": ({"p": "In"}, {"y": (0, 100)}, [transition(binary("term_f", p_req_write(), "EQ", value(True)), assign(identifier("y"), plus(identifier("y"), p_value())), assign(p_req_write(), value(False)))]),
+        "D": ({"p": "In"}, {"y": (0, 100), "k": (-1, 9)}, [transition(binary("term_f", p_req_write(), "EQ", value(True)), assign(identifier("y"), plus(identifier("y"), times(value(12), "DIV", k_plus_one))), assign(identifier("k"), p_value()), assign(p_req_write(), value(False)))]),
+    }
+
+def ping_pong(ping_sync: list | None = None, grouped: bool = False) -> Dict[str, tuple]:
+    '''
+    `A` sends x to `B` on p, which adds it to y and answers y on q, then `A` adds the answer and 1 to x, until x reaches 5. Each exchange is a synchronization, after the value is written.
+
+    ping_sync: the synchronizations of the sending transition of `A` (only p by default)
+    grouped: whether the sending transition of `A` is a group
+    '''
+    sync = lambda *port_names: AttributedTree("sync_stmt", {}, [identifier(port_name) for port_name in port_names])
+    equals = lambda name, val: binary("term_f", identifier(name), "EQ", value(val))
+    ping = transition(AttributedTree("term_g", {}, [compare(identifier("x"), "LT", value(5)), equals("s", 0)]), assign(dot(identifier("p"), "value"), identifier("x")), *(ping_sync or [sync("p")]), assign(identifier("s"), value(1)))
+    if grouped:
+        ping = AttributedTree("guarded_stmt_grp", {}, [ping.children[0], transition(equals("s", 2), assign(identifier("s"), value(0))).children[0]])
+    
+    return {
+        "A": ({"p": "Out", "q": "In", "r": None}, {"x": (0, 20), "s": (0, 2)}, [ping, transition(equals("s", 1), sync("q"), assign(identifier("x"), plus(plus(identifier("x"), dot(identifier("q"), "value")), value(1))), assign(identifier("s"), value(0)))]),
+        "B": ({"p": "In", "q": "Out"}, {"y": (0, 100), "t": (0, 1)}, [
+            transition(equals("t", 0), sync("p"), assign(identifier("y"), plus(identifier("y"), dot(identifier("p"), "value"))), assign(identifier("t"), value(1))),
+            transition(equals("t", 1), assign(dot(identifier("q"), "value"), identifier("y")), sync("q"), assign(identifier("t"), value(0))),
+        ]),
+        "W": ({"r": None}, {}, [transition(value(True), sync("r"))]),
+    }
+
+def chain() -> Dict[str, tuple]:
+    '''
+    `S` writes 0 to 8 to its port, each plus 10 or not at random. `F` doubles them from n to m, then synchronizes on r with `C`, which sums them.
+    '''
+    sync = lambda *port_names: AttributedTree("sync_stmt", {}, [identifier(port_name) for port_name in port_names])
+    req_write = lambda port_name, val: binary("term_f", dot(identifier(port_name), "reqWrite"), "EQ", value(val))
+    x = identifier("x")
+    send = lambda term: AttributedTree("guarded_stmt", {}, [AttributedTree("term_g", {}, [compare(x, "LT", value(9)), req_write("n", False)]), assign(dot(identifier("n"), "value"), term), assign(dot(identifier("n"), "reqWrite"), value(True)), assign(x, plus(x, value(1)))])
+    return {
+        "S": ({"n": "Out"}, {"x": (0, 9)}, [AttributedTree("guarded_stmt_grp", {}, [send(x), send(plus(x, value(10)))])]),
+        "F": ({"n": "In", "m": "Out", "r": "Out"}, {}, [transition(AttributedTree("term_g", {}, [req_write("n", True), req_write("m", False)]), assign(dot(identifier("m"), "value"), times(dot(identifier("n"), "value"), "MUL", value(2))), assign(dot(identifier("m"), "reqWrite"), value(True)), assign(dot(identifier("n"), "reqWrite"), value(False)), sync("r"))]),
+        "C": ({"m": "In", "r": "In"}, {"y": (0, 1000)}, [transition(req_write("m", True), sync("r"), assign(identifier("y"), plus(identifier("y"), dot(identifier("m"), "value"))), assign(dot(identifier("m"), "reqWrite"), value(False)))]),
+    }
+
+class TestSystemTranslator(unittest.TestCase):
+    def _translate(self, body: AttributedTree, system_bodies: Dict[str, AttributedTree]) -> tuple:
+        manager = EntityManager({"Top": [], "Sub": ["x"], "F": ["a", "b"], "G": ["a"], "K": ["p"]})
+        emitter = CodeEmitter()
+        requests = SystemTranslator(TypeContext(), "m_0_Top", manager, body, emitter, TranslationOptions(state_classes=True), system_bodies=system_bodies).translate()
+        return [request.name for request in requests], emitter.getvalue()
+
+    def test_without_components(self):
+        names, source = self._translate(system([connect("F", "n", "m"), connect("G", "n")]), {})
+
+        self.assertEqual(names, ["F", "G"])
+        self.assertIn("n = Node(parties=2)", source)
+        self.assertIn("scheduler.spawn(m_0_G, n)", source)
+
+    def test_flattened_subsystem_not_requested(self):
+        names, source = self._translate(system([connect("F", "n", "m"), connect("Sub", "n")]), {"Sub": system([connect("G", "x")])})
+
+        self.assertEqual(names, ["F", "G"])
+        self.assertNotIn("m_0_Sub", source)
+        self.assertIn("scheduler.spawn(m_0_G, n)", source)
+
+    def test_component_ports(self):
+        # F and G share the port of the component c
+        names, source = self._translate(system([connect("F", "c.p", "m"), connect("G", "c.p")], {"c": "K"}), {})
+
+        self.assertEqual(sorted(names), ["F", "G", "K"])
+        self.assertIn("anon_c_p = Node(parties=3)", source)
+        self.assertIn("scheduler.spawn(m_0_F, anon_c_p, m)", source)
+        self.assertIn("scheduler.spawn(m_0_K, anon_c_p)", source)
+
+    def test_round_like_asyncio(self):
+        # `m_G` writes 1 or 2 at random, next to the automata synchronizing on `r`
+        group = AttributedTree("guarded_stmt_grp", {}, [transition(value(True), assign(dot(identifier("out"), "value"), value(k))).children[0] for k in (1, 2)])
+        classes = translate_interleaved(TranslationOptions(state_classes=True))
+        classes.update(translate_automaton({}, [group], TranslationOptions(state_classes=True), {"out": "out"}, "m_G"))
+
+        def spawn(scheduler: Any, log: List[tuple]):
+            r = LogPort("r", log)
+            scheduler.spawn(classes["m_G"], LogPort("g", log))
+            scheduler.spawn(classes["m_C"], LogPort("c", log), r)
+            scheduler.spawn(classes["m_A"], LogPort("a", log))
+            scheduler.spawn(classes["m_D"], LogPort("d", log), r)
+        
+        for seed in (1, 2, 3):
+            async def start_asyncio(log: List[tuple]):
+                scheduler = AsyncioScheduler(seed)
+                spawn(scheduler, log)
+                await scheduler.run()
+            
+            log = []
+            scheduler = RoundScheduler(seed)
+            spawn(scheduler, log)
+            scheduler.run(400)
+
+            self.assertEqual(record(start_asyncio, 200), log[:200])
+            self.assertEqual(set([val for name, val in log if name == "g"]), set([1, 2]))
+
+class TestFusion(unittest.TestCase):
+    def _translate(self, automata: Dict[str, tuple], fusion_limit: int) -> Dict[str, Any]:
+        return translate_system(automata, system([connect("A", "p", "q", "r"), connect("B", "p", "q"), connect("W", "r")]), TranslationOptions(state_classes=True, fusion_limit=fusion_limit))
+
+    def test_like_dynamic_pair(self):
+        dynamic, fused = [self._translate(ping_pong(), fusion_limit) for fusion_limit in (0, 8)]
+        self.assertNotIn("product", dynamic["source"])
+        self.assertIn("scheduler.spawn(m_0_Top_product_0, p, q, r)", fused["source"])
+
+        # One joint transition per exchange, without synchronization
+        self.assertEqual(len(fused["m_0_Top_product_0"].t_fns), 2)
+        self.assertFalse([name for name in dir(fused["m_0_Top_product_0"]) if name.startswith("_cont_")])
+        self.assertTrue([name for name in dir(dynamic["m_0_A"]) if name.startswith("_cont_")])
+
+        for seed in (1, 2):
+            expected, result = [get_final_values(run_system(namespace, seed, 1000)) for namespace in (dynamic, fused)]
+            # The variables of the members are renamed apart in the product
+            self.assertEqual(sorted([(re.sub("^id_f[0-9]+_", "id_", entry[0]),) + entry[1:] for entry in result], key=repr), expected)
+            self.assertIn(("id_x", 8), expected)
+            self.assertIn(("id_y", 4), expected)
+
+    def test_kept_dynamic(self):
+        # An internal synchronization in a group, or with another one, and a product larger than the limit
+        sync = lambda *port_names: AttributedTree("sync_stmt", {}, [identifier(port_name) for port_name in port_names])
+        for automata, fusion_limit in ((ping_pong(grouped=True), 8), (ping_pong([sync("p"), sync("r")]), 8), (ping_pong([sync("p", "r")]), 8), (ping_pong(), 1)):
+            source = self._translate(automata, fusion_limit)["source"]
+            self.assertNotIn("product", source)
+            self.assertIn("scheduler.spawn(m_0_A, p, q, r)", source)
+            self.assertIn("scheduler.spawn(m_0_B, p, q)", source)
+
+class TestPipeline(unittest.TestCase):
+    def test_like_dynamic_scheduling(self):
+        # The connections are not in the order of the data flow
+        namespace = translate_system(chain(), system([connect("C", "m", "r"), connect("S", "n"), connect("F", "n", "m", "r")]), TranslationOptions(state_classes=True))
+        self.assertIn("scheduler.add(Pipeline(m_0_S(n), m_0_F(n, m, r), m_0_C(m, r)), ports=(n, m, r,))", namespace["source"])
+
+        def get_traces(log: List[tuple]) -> Dict[str, list]:
+            traces = {}
+            for name, val in log:
+                traces.setdefault(name, []).append(val)
+            return traces
+        
+        node_names = re.findall(r"(\w+) = Node\(", namespace["source"])
+        for seed in (1, 2, 3):
+            # The nodes of the system record the values written to them
+            log = []
+            created = []
+            namespace["Node"] = lambda parties: created.append(LogPort(node_names[len(created)], log, parties)) or created[-1]
+            pipelined = run_system(namespace, seed, 1000)
+
+            dynamic_log = []
+            m, r, n = [LogPort(name, dynamic_log) for name in ("m", "r", "n")]
+            scheduler = RoundScheduler(seed)
+            scheduler.spawn(namespace["m_0_C"], m, r)
+            scheduler.spawn(namespace["m_0_S"], n)
+            scheduler.spawn(namespace["m_0_F"], n, m, r)
+            scheduler._components[0].id_y = scheduler._components[1].id_x = 0
+            scheduler.run(1000)
+
+            self.assertEqual(get_traces(log), get_traces(dynamic_log))
+            self.assertEqual(len(get_traces(log)["m"]), 9)
+            self.assertEqual(get_final_values(pipelined), get_final_values(scheduler))
+        
+        # Both choices of the group are taken (with the last seed)
+        self.assertTrue(any([val >= 20 for val in get_traces(log)["m"]]) and any([val < 20 for val in get_traces(log)["m"]]))
+
+class TestBatches(unittest.TestCase):
+    def test_like_instances(self):
+        # Six sensors, four with a consumer batched with them, two with a consumer which cannot be batched
+        connections = [connect("S", "n" + str(i)) for i in range(6)] + [connect("C" if i < 4 else "D", "n" + str(i)) for i in range(6)]
+        automata = sensor_and_consumers()
+        namespaces = [translate_system(automata, system(connections), TranslationOptions(state_classes=True, batch_threshold=threshold)) for threshold in (0, 2)]
+
+        self.assertNotIn("Batch", namespaces[0]["source"])
+        self.assertIn("scheduler.add(m_0_Top_batch_0(6, (n0, n1, n2, n3, n4, n5,)), ports=(n0, n1, n2, n3, n4, n5,))", namespaces[1]["source"])
+        self.assertIn("scheduler.add(m_0_Top_batch_1(4, (n0, n1, n2, n3,)), ports=(n0, n1, n2, n3,))", namespaces[1]["source"])
+        self.assertNotIn("m_0_Top_batch_2", namespaces[1]["source"])
+        self.assertIn("m_0_D(n5)", namespaces[1]["source"])
+
+        for seed in (1, 2):
+            expected, result = [get_final_values(run_system(namespace, seed, 1000)) for namespace in namespaces]
+            self.assertEqual(result, expected)
+            self.assertEqual(expected.count(("id_y", 36)), 4)
+            self.assertEqual(expected.count(("id_y", 12 + 12 + 6 + 4 + 3 + 2 + 2 + 1 + 1)), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+'''
+Tests of the helpers of `utils`.
+'''
+import unittest
+from utils import DirectedGraph
+
+class TestDirectedGraph(unittest.TestCase):
+    def test_strongly_connected_components(self):
+        # A cycle a -> b -> c -> a, followed by the cycle d <-> e, and f alone
+        edges = [("a", "b"), ("b", "c"), ("c", "a"), ("c", "d"), ("d", "e"), ("e", "d"), ("f", "a")]
+        graph = DirectedGraph(set("abcdef"), edges)
+        components = graph.strongly_connected_components()
+
+        self.assertEqual(sorted([sorted(component) for component in components]), [["a", "b", "c"], ["d", "e"], ["f"]])
+
+        # Every edge between two components goes from an earlier one to a later one
+        position = {node: i for i in range(len(components)) for node in components[i]}
+        for src, tar in edges:
+            self.assertLessEqual(position[src], position[tar])
+
+    def test_topo_sort(self):
+        graph = DirectedGraph(set(["1", "2", "10", "3"]), [("10", "2")])
+        self.assertEqual(graph.topo_sort(key=int), ["1", "3", "10", "2"])
+        self.assertEqual(graph.topo_sort(key=str), ["1", "10", "2", "3"])
+
+        order = graph.topo_sort()
+        self.assertLess(order.index("10"), order.index("2"))
+
+        # The graph itself is left untouched
+        self.assertEqual(len(graph.nodes), 4)
+
+        graph.add_edge(("2", "10"))
+        with self.assertRaises(ValueError):
+            graph.topo_sort(key=int)
+
+if __name__ == "__main__":
+    unittest.main()
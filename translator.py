@@ -1,19 +1,55 @@
-from utils import AttributedTree, parse_template_apply, DFSManager, infer_original_name, indent_code
+from utils import AttributedTree, parse_template_apply, DFSManager, DirectedGraph, infer_original_name, CodeEmitter
 from queue import Queue
-from template import TypeContext, TemplateManager, ExpansionRequest, ConnectionTable
-from typing import List, Tuple, Set, Dict, Callable, Any
+from template import TypeContext, TemplateManager, ExpansionRequest, ExpansionDatum, ConnectionTable
+from typing import List, Tuple, Set, Dict, Callable, Any, TextIO
 from enum import Enum
-from type_tree import TypeTree, get_bool_type, get_int_type, get_char_type, get_real_type
+from itertools import count
+from type_tree import TypeTree, get_bool_type, get_int_type, get_char_type, get_real_type, get_bounded_int_type, get_buffer_typecode, get_transfer_class
+from optimizer import ConstantFolder, IntervalAnalyzer, apply_interval_operator, CommonSubtermEliminator, FunctionInliner, ProductBuilder, rename_identifiers, OPERATOR_TERMS, INFINITY, get_read_set, get_write_set, get_fingerprints, get_size, is_recursive, get_updated_names, get_escaping_names, get_assigned_name
+
+OPERATORS = {"PLUS": "+", "MIN": "-", "MUL": "*", "DIV": "/", "MOD": "%", "GEQ": ">=", "GT": ">", "LEQ": "<=", "LT": "<", "EQ": "==", "NEQ": "!=", "NOT": "not "}
 
 class ObjectCategory(Enum):
     FUNCTION = 0
     AUTOMATON = 1
     SYSTEM = 2
 
+class TranslationOptions:
+    '''
+    Options shared by all the translators of a program.
+
+    checked: keep boxed literals and convert every value through `m_lib.convert`, instead of emitting native python values with range checks only where a coercion narrows and numeric arrays unboxed into `array` buffers.
+
+    inline_threshold: calls to non-recursive functions whose body has at most this many nodes are replaced by the body (0 disables inlining).
+
+    state_classes: emit every automaton as a class keeping its variables and ports in `__slots__`, with a synchronous `step()` firing at most one transition and an async `run()` driving it, instead of a single coroutine keeping its state in locals. Systems become functions adding their components to an `m_lib.Scheduler`, which runs them on the event loop (`AsyncioScheduler`) or in a plain loop (`RoundScheduler`). The automata of the acyclic part of a system are stepped together, in the order of the data flow (`Pipeline`).
+
+    fusion_limit: in state class mode, the automata of a cycle of a system synchronizing only among themselves are fused into their product automaton, whose joint transitions replace the synchronizations, if it has at most this many transitions (0 disables fusion).
+
+    batch_threshold: in state class mode, an automaton connected at least this many times in a system is run as a single `m_lib.Batch` of numpy columns, if it can be vectorized (see `BatchTranslator`; 0 disables batches).
+    '''
+    def __init__(self, checked: bool = False, inline_threshold: int = 32, state_classes: bool = False, fusion_limit: int = 0, batch_threshold: int = 0):
+        self.checked = checked
+        self.inline_threshold = inline_threshold
+        self.state_classes = state_classes
+        self.fusion_limit = fusion_limit
+        self.batch_threshold = batch_threshold
+
+def format_range_check_report(report: List[Tuple[str, str, bool]]) -> str:
+    '''
+    Render the range check report of a translator (`range_check_report`): a line per assignment to a bounded int, telling whether its runtime check is kept or elided, then the totals.
+    '''
+    lines = [("kept   " if kept else "elided ") + object_name + ": " + site for object_name, site, kept in report]
+    n_kept = len([kept for _, _, kept in report if kept])
+    lines.append(str(n_kept) + " kept, " + str(len(report) - n_kept) + " elided")
+    
+    return "\n".join(lines)
+
 class Translator:
-    def __init__(self):
+    def __init__(self, emitter: CodeEmitter | None = None, options: TranslationOptions | None = None):
         self._type_context: TypeContext = TypeContext()
-        self._buffer: List[str] = []
+        self._emitter: CodeEmitter = CodeEmitter() if emitter is None else emitter
+        self._options: TranslationOptions = TranslationOptions() if options is None else options
     
     def translate(self):
         pass
@@ -23,8 +59,8 @@ class Translator:
         pass
 
 class ProgramTranslator(Translator):
-    def __init__(self, program_tree: AttributedTree):
-        super().__init__()
+    def __init__(self, program_tree: AttributedTree, options: TranslationOptions | None = None):
+        super().__init__(options=options)
         
         self._tree: AttributedTree = program_tree
         self._identifiers: Set[str]
@@ -36,15 +72,27 @@ class ProgramTranslator(Translator):
 
         self._template_manager: TemplateManager
         self._expansion_requests: Queue[ExpansionRequest]
+
+        # (object name, assignment, whether the runtime range check is kept), rendered by `format_range_check_report`
+        self.range_check_report: List[Tuple[str, str, bool]] = []
         
         self._buffer_head: str
         self._buffer_tail: str
         #TODO
     
-    def translate(self) -> str: # Done
+    def translate(self, output: TextIO | None = None) -> str | None: # Done
         '''
         Generate the python code.
+
+        If `output` is given, the code of every expanded object is written to it as soon as the object is translated, and None is returned. Otherwise the whole program is returned as a string.
         '''
+        emitter = CodeEmitter(output)
+        emitter.lines(self._buffer_head)
+
+        for name in self._function_data:
+            self._template_manager.set_function_body(name, self._function_data[name])
+        emitter.flush()
+
         while True:
             if self._expansion_requests.empty():
                 break
@@ -60,8 +108,7 @@ class ProgramTranslator(Translator):
                 actual_name = expansion_datum.actual_name
                 body = self.get_function_body(request.name)
                 
-                # Generate the function code
-                python_code, new_requests = FunctionTranslator(type_context, actual_name, self._template_manager, body).translate()
+                translator = FunctionTranslator(type_context, actual_name, self._template_manager, body, emitter, self._options)
             elif category == ObjectCategory.AUTOMATON:
                 # Necessary data to generate the automaton code
                 expansion_datum = self._template_manager.query(request)
@@ -69,8 +116,7 @@ class ProgramTranslator(Translator):
                 actual_name = expansion_datum.actual_name
                 body = self.get_automaton_body(request.name)
 
-                # Generate the automaton code
-                python_code, new_requests = AutomatonTranslator(type_context, actual_name, self._template_manager, body).translate()
+                translator = AutomatonTranslator(type_context, actual_name, self._template_manager, body, emitter, self._options)
             elif category == ObjectCategory.SYSTEM:
                 # Necessary data to generate the system code
                 expansion_datum = self._template_manager.query(request)
@@ -78,19 +124,31 @@ class ProgramTranslator(Translator):
                 actual_name = expansion_datum.actual_name
                 body = self.get_system_body(request.name)
 
-                # Generate the system code
-                python_code, new_requests = SystemTranslator(type_context, actual_name, self._template_manager, body).translate()
+                translator = SystemTranslator(type_context, actual_name, self._template_manager, body, emitter, self._options, self._automaton_data, self._system_data)
             else:
                 raise Exception("Unknown exception. Maybe it is an upcoming feature.")
             
-            # Add the code to buffer
-            self._buffer.append(python_code)
+            # Generate the code and write it out
+            emitter.line()
+            new_requests = translator.translate()
+            emitter.flush()
+
+            if isinstance(translator, LowLevelTranslator):
+                self.range_check_report += translator.range_check_report
 
             # Put new requests to the queue
             for new_request in new_requests:
                 self._expansion_requests.put(new_request)
 
-        return self._buffer_head + '\n\n'.join(self._buffer) + self._buffer_tail
+        # The record classes are only known once every object is translated
+        emitter.lines(self._template_manager.translate_records())
+        emitter.lines(self._buffer_tail)
+        emitter.flush()
+
+        if output is None:
+            return emitter.getvalue()
+        
+        return None
 
     def get_object_category(self, name: str) -> ObjectCategory:
         if name in self._function_data:
@@ -123,140 +181,386 @@ class ProgramTranslator(Translator):
         raise NameError(f"'{name}' is not a valid system.")
 
 class ObjectTranslator(Translator):
-    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager, body: AttributedTree):
-        super().__init__()
+    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager, body: AttributedTree, emitter: CodeEmitter | None = None, options: TranslationOptions | None = None):
+        super().__init__(emitter, options)
         self._type_context = type_context
         self._actual_name = actual_name
         self._template_manager = template_manager
         self._body = body
     
-    def translate(self) -> Tuple[str, List[ExpansionRequest]]:
+    def translate(self) -> List[ExpansionRequest]:
+        '''
+        Write the code of the object to the emitter and return the new expansion requests.
+        '''
         #TODO
         pass
 
 class LowLevelTranslator(ObjectTranslator):
-    def __init__(self, type_context: TypeContext, actual_name: str,  template_manager: TemplateManager, body: AttributedTree):
-        super().__init__(type_context, actual_name, template_manager, body)
+    def __init__(self, type_context: TypeContext, actual_name: str,  template_manager: TemplateManager, body: AttributedTree, emitter: CodeEmitter | None = None, options: TranslationOptions | None = None):
+        super().__init__(type_context, actual_name, template_manager, body, emitter, options)
+        self._interval_analyzer = IntervalAnalyzer(type_context)
+        self.range_check_report: List[Tuple[str, str, bool]] = []
+
+        # Fingerprint -> the local holding a shared sub-term (see `CommonSubtermEliminator`)
+        self._shared_terms: Dict[Tuple, ResolvedTerm] = {}
+
+        # Fingerprint -> the names read by a shared sub-term
+        self._shared_term_reads: Dict[Tuple, Set[str]] = {}
+
+        # Prefix of the python names of the variables and ports
+        self._var_prefix = "id_"
+
+        # Variables updated in place. Those of a copy-on-write type keep the value they own in `ow_<name>`, see `_translate_ownership`.
+        self._updated_names = get_updated_names(body)
+        self._owned_vars: Set[str] = set()
+        self._owner_prefix = "ow_"
     
-    def _translate_var_decl(self, var_decl: AttributedTree) -> Tuple[str, List[ExpansionRequest]]:
+    def _is_owned_var(self, name: str, type_tree: TypeTree) -> bool:
+        return name in self._updated_names and get_transfer_class(type_tree) == "copy_on_write"
+
+    def _translate_var_decl(self, var_decl: AttributedTree) -> List[ExpansionRequest]:
         '''
         Warning: this method has side-effect (modifying type context)
         '''
         assert var_decl.name == "var_decl"
         
-        init_resolved_term = InitTermTranslator(self._type_context, self._template_manager, var_decl.children[-1]).translate()
+        init_resolved_term = InitTermTranslator(self._type_context, self._template_manager, var_decl.children[-1], self._options).translate()
         init_term = init_resolved_term.python_code
 
-        python_code = []
-
         #TODO
         for child in var_decl.children[:-1]:
             assert child.name == "IDENTIFIER"
 
             identifier = child.get_attribute("value")
             
-            python_code.append("id_" + identifier + " = " + init_term + "\n")
-        python_code = "".join(python_code)
+            if self._is_owned_var(identifier, var_decl.children[-1]):
+                self._owned_vars.add(identifier)
+                self._emitter.line(self._var_prefix + identifier + " = " + self._owner_prefix + identifier + " = " + init_term)
+            else:
+                self._emitter.line(self._var_prefix + identifier + " = " + init_term)
+        
+        return init_resolved_term.expansion_requests
+
+    def _refine_rhs_type(self, rhs_type: TypeTree, rhs_interval: Tuple[float, float] | None) -> TypeTree:
+        '''
+        Narrow the type of an integer term to the bounds proven by the interval analysis, so that the coercion to the LHS only checks what is not proven.
+        '''
+        if rhs_interval is None or rhs_type.de_init().name not in ("int", "bounded_int"):
+            return rhs_type
         
-        return python_code, init_resolved_term.expansion_requests
+        l, r = rhs_interval
+        if l == -INFINITY or r == INFINITY or l > r:
+            return rhs_type
+        
+        return get_bounded_int_type(int(l), int(r))
+
+    def _update_intervals(self, lhs_tree: AttributedTree, rhs_intervals: List[Tuple[float, float] | None], env: Dict[str, Tuple[float, float]]):
+        '''
+        Bind the assigned variables to the bounds of their new values.
+        '''
+        for i in range(lhs_tree.n_children):
+            term_tree = lhs_tree.children[i]
+            if term_tree.name != "IDENTIFIER":
+                continue
+            
+            var_name = term_tree.get_attribute("value")
+            declared_interval = self._interval_analyzer.declared_interval(var_name)
+            if declared_interval is None or rhs_intervals[i] is None:
+                env.pop(var_name, None)
+                continue
+            
+            env[var_name] = (max(declared_interval[0], rhs_intervals[i][0]), min(declared_interval[1], rhs_intervals[i][1]))
+
+    def _translate_owned_params(self):
+        '''
+        The parameters of a copy-on-write type updated in place do not own their values, and copy them before the first update.
+        '''
+        for name in sorted(self._updated_names):
+            if not self._type_context.is_port(name):
+                continue
+            
+            type_tree, IO = self._type_context.get_param_type(name, with_IO=True)
+            if IO is None and self._is_owned_var(name, type_tree):
+                self._owned_vars.add(name)
+                self._emitter.line(self._owner_prefix + name + " = None")
 
-    def _translate_assign(self, assignment: AttributedTree) -> Tuple[str, List[ExpansionRequest]]:
+    def _translate_ownership(self, lhs_tree: AttributedTree):
+        '''
+        Copy the copy-on-write values about to be updated in place, unless the variable holding them owns them.
+        
+        A variable owns its value from the copy until the value is shared again (see `_translate_escapes`). The values assigned as a whole are never owned, as they may be shared with other variables or ports.
+        '''
+        for term_tree in lhs_tree.children:
+            if term_tree.name not in ("brack_term", "dot_term"):
+                continue
+            
+            name = get_assigned_name(term_tree)
+            if name in self._owned_vars:
+                var_code, owner_code = self._var_prefix + name, self._owner_prefix + name
+                with self._emitter.block("if " + var_code + " is not " + owner_code + ":"):
+                    self._emitter.line(var_code + " = " + owner_code + " = copy_value(" + var_code + ")")
+
+    def _translate_port_copies(self, lhs_tree: AttributedTree, lhs_python_codes: List[str]) -> List[str]:
+        '''
+        Redirect the in-place updates of port values (e.g. "p.value[i] = 1") to a copy of the value, held by a local `port_<name>`. Return the lines writing the copies back to the ports, which bumps their versions and wakes their watchers.
+
+        The value of a port is shared with its readers (see `m_lib.Port.shared`), so it is never updated in place. `Port.value` already returns a copy.
+        '''
+        port_codes: Dict[str, str] = {}
+        for i in range(lhs_tree.n_children):
+            term_tree = lhs_tree.children[i]
+            if term_tree.name not in ("brack_term", "dot_term"):
+                continue
+            
+            base_tree = term_tree
+            while base_tree.name in ("brack_term", "dot_term") and not self._is_port_value(base_tree):
+                base_tree = base_tree.children[0]
+            if base_tree is term_tree or not self._is_port_value(base_tree):
+                continue
+            
+            port_name = base_tree.children[0].get_attribute("value")
+            port_code = self._translate_term(base_tree).python_code
+            if port_name not in port_codes:
+                port_codes[port_name] = port_code
+                self._emitter.line("port_" + port_name + " = " + ("copy_value(" + port_code + ")" if port_code.endswith(".shared") else port_code))
+            
+            lhs_python_codes[i] = lhs_python_codes[i].replace(port_code, "port_" + port_name, 1)
+        
+        return [port_code + " = port_" + port_name for port_name, port_code in port_codes.items()]
+
+    def _is_port_value(self, term_tree: AttributedTree) -> bool:
+        if term_tree.name != "dot_term":
+            return False
+        
+        port, field = term_tree.children
+        return port.name == "IDENTIFIER" and self._type_context.is_port(port.get_attribute("value")) and field.get_attribute("value") == "value"
+
+    def _translate_escapes(self, rhs_tree: AttributedTree):
+        '''
+        Give up the ownership of the values just shared by an assignment.
+        '''
+        escaping_names = set()
+        for term_tree in rhs_tree.children:
+            escaping_names |= get_escaping_names(term_tree)
+        
+        for name in sorted(escaping_names & self._owned_vars):
+            self._emitter.line(self._owner_prefix + name + " = None")
+
+    def _translate_term(self, term_tree: AttributedTree) -> "ResolvedTerm":
+        return TermTranslator(self._type_context, self._template_manager, term_tree, self._options, self._shared_terms, var_prefix=self._var_prefix).translate()
+
+    def _translate_shared_terms(self, term_trees: List[AttributedTree], prefix: str, excluded_names: Set[str] = set()) -> List[Tuple[str, str, Set[int], List[ExpansionRequest]]]:
+        '''
+        Find the sub-terms shared by `term_trees` and bind them to locals named `prefix` + index, so that the following translations of `term_trees` read the locals instead.
+
+        Return (local name, python code, indices of the terms containing it, requests) for each shared sub-term, in the order they must be computed.
+        '''
+        eliminator = CommonSubtermEliminator(excluded_names)
+
+        shared_terms = []
+        for fingerprint, term_tree, users in eliminator.find(term_trees):
+            local_name = prefix + str(len(shared_terms))
+
+            resolved_term = self._translate_term(term_tree)
+            self._shared_terms.update({fingerprint: ResolvedTerm(local_name, resolved_term.type_tree, [], resolved_term.additional_info)})
+            self._shared_term_reads.update({fingerprint: get_read_set(term_tree)})
+
+            shared_terms.append((local_name, resolved_term.python_code, users, resolved_term.expansion_requests))
+        
+        return shared_terms
+
+    def _translate_assign(self, assignment: AttributedTree, env: Dict[str, Tuple[float, float]] | None = None) -> List[ExpansionRequest]:
+        '''
+        `env` holds the bounds of the integer variables known to hold before the assignment (see `IntervalAnalyzer`). It is updated in-place.
+        '''
         assert assignment.name == "assign_stmt"
 
+        if env is None:
+            env = {}
+
         lhs_tree = assignment.get_child_by_name("lhs")
         rhs_tree = assignment.get_child_by_name("rhs")
         
         lhs_resolved_terms: List[ResolvedTerm] = []
         for term_tree in lhs_tree.children:
-            lhs_resolved_terms.append(TermTranslator(self._type_context, self._template_manager, term_tree).translate())
+            lhs_resolved_terms.append(self._translate_term(term_tree))
         lhs_python_codes, lhs_type_trees, lhs_requests = ResolvedTerm.reshape(lhs_resolved_terms)
 
         rhs_resolved_terms: List[ResolvedTerm] = []
         for term_tree in rhs_tree.children:
-            rhs_resolved_terms.append(TermTranslator(self._type_context, self._template_manager, term_tree).translate())
-        rhs_python_codes, rhs_type_trees, rhs_requests = ResolvedTerm.reshape(lhs_resolved_terms)
+            rhs_resolved_terms.append(self._translate_term(term_tree))
+        rhs_python_codes, rhs_type_trees, rhs_requests = ResolvedTerm.reshape(rhs_resolved_terms)
 
         if lhs_tree.n_children == rhs_tree.n_children:
+            folder = ConstantFolder(self._type_context)
+            rhs_intervals = [self._interval_analyzer.evaluate(folder.fold(term_tree), env) for term_tree in rhs_tree.children]
+
             for i in range(lhs_tree.n_children):
-                rhs_python_codes[i] = rhs_type_trees[i].get_coercion(lhs_type_trees[i])(rhs_python_codes[i])
+                rhs_type_tree = self._refine_rhs_type(rhs_type_trees[i], rhs_intervals[i])
+                coercion_code = rhs_type_tree.get_coercion_code(lhs_type_trees[i], rhs_python_codes[i], self._options.checked)
+
+                coercion = rhs_type_tree.get_coercion(lhs_type_trees[i])
+                if isinstance(coercion, tuple) and coercion[0] == "bounded":
+                    site = lhs_python_codes[i] + " = " + rhs_python_codes[i]
+                    self.range_check_report.append((self._actual_name, site, coercion_code != rhs_python_codes[i]))
 
-            python_code = ", ".join(lhs_python_codes) + ", = " + ", ".join(rhs_python_codes) + ",\n"
-            return python_code, lhs_requests + rhs_requests
+                rhs_python_codes[i] = coercion_code
+
+            self._update_intervals(lhs_tree, rhs_intervals, env)
+
+            self._translate_ownership(lhs_tree)
+            write_backs = self._translate_port_copies(lhs_tree, lhs_python_codes)
+            self._emitter.line(", ".join(lhs_python_codes) + ", = " + ", ".join(rhs_python_codes) + ",")
+            for line in write_backs:
+                self._emitter.line(line)
+            self._translate_escapes(rhs_tree)
+            return lhs_requests + rhs_requests
         
         if lhs_tree.n_children == 1:
             assert TypeTree.build_tuple_type(rhs_type_trees) <= lhs_type_trees[0]
 
-            python_code = lhs_python_codes[0] + " = " + ", ".join(rhs_python_codes) + "\n"
-            return python_code, lhs_requests + rhs_requests
+            self._translate_ownership(lhs_tree)
+            write_backs = self._translate_port_copies(lhs_tree, lhs_python_codes)
+            self._emitter.line(lhs_python_codes[0] + " = " + ", ".join(rhs_python_codes))
+            for line in write_backs:
+                self._emitter.line(line)
+            self._translate_escapes(rhs_tree)
+            return lhs_requests + rhs_requests
         
         if rhs_tree.n_children == 1:
             assert TypeTree.build_array_type(lhs_type_trees) <= rhs_type_trees[0]
 
-            python_code = ", ".join(lhs_python_codes) + " = " + rhs_python_codes[0]
-            return python_code, lhs_requests + rhs_requests
+            self._translate_ownership(lhs_tree)
+            write_backs = self._translate_port_copies(lhs_tree, lhs_python_codes)
+            self._emitter.line(", ".join(lhs_python_codes) + " = " + rhs_python_codes[0])
+            for line in write_backs:
+                self._emitter.line(line)
+            self._translate_escapes(rhs_tree)
+            return lhs_requests + rhs_requests
         
         raise Exception("The LHS and RHS do not match.")        
 
-    def translate(self) -> Tuple[str, List[ExpansionRequest]]:
+    def translate(self) -> List[ExpansionRequest]:
         pass
 
 class FunctionTranslator(LowLevelTranslator):
-    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager, body: AttributedTree):
-        super().__init__(type_context, actual_name, template_manager, body)
+    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager, body: AttributedTree, emitter: CodeEmitter | None = None, options: TranslationOptions | None = None):
+        super().__init__(type_context, actual_name, template_manager, body, emitter, options)
         #TODO
     
-    def _translate_return(self, return_stmt: AttributedTree) -> Tuple[str, List[ExpansionRequest]]:
+    def _translate_return(self, return_stmt: AttributedTree) -> List[ExpansionRequest]:
         assert return_stmt.name == "return_stmt"
 
         term = return_stmt.children[0]
 
-        resolved_term = TermTranslator(self._type_context, self._template_manager, term).translate()
+        resolved_term = self._translate_term(term)
 
-        python_code = "return" + resolved_term.type_tree.get_coercion(self._type_context.get_param_type("!"))(resolved_term.python_code) + "\n"
+        self._emitter.line("return " + resolved_term.type_tree.get_coercion_code(self._type_context.get_param_type("!"), resolved_term.python_code, self._options.checked))
 
-        return python_code, resolved_term.expansion_requests
+        return resolved_term.expansion_requests
 
-    def translate(self) -> Tuple[str, List[ExpansionRequest]]:
-        python_codes = []
+    def translate(self) -> List[ExpansionRequest]:
         all_requests = []
-        for child in self._body.children:
-            if child.name == "var_decl":
-                python_code, requests = self._translate_var_decl(child)
-            elif child.name == "assign_stmt":
-                python_code, requests = self._translate_assign(child)
-            elif child.name == "return_stmt":
-                python_code, requests = self._translate_return(child)
-            else:
-                raise Exception
-            
-            python_codes.append(python_code)
-            all_requests += requests
-        
-        function_body = indent_code("".join(python_codes), all_requests)
-        function_code = "def" + self._actual_name + self._template_manager.get_signature_string(infer_original_name(self._actual_name)) + ":" + function_body
 
-        return function_code, all_requests
+        signature_string = self._template_manager.get_signature_string(infer_original_name(self._actual_name))
+
+        env = {}
+
+        with self._emitter.block("def " + self._actual_name + signature_string + ":"):
+            self._translate_owned_params()
+
+            for child in self._body.children:
+                if child.name == "var_decl":
+                    requests = self._translate_var_decl(child)
+                elif child.name == "assign_stmt":
+                    requests = self._translate_assign(child, env)
+                elif child.name == "return_stmt":
+                    requests = self._translate_return(child)
+                else:
+                    raise Exception
+                
+                all_requests += requests
+
+        return all_requests
 
 class AutomatonTranslator(LowLevelTranslator):
-    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager, body: AttributedTree):
-        super().__init__(type_context, actual_name, template_manager, body)
-        #TODO
+    '''
+    The guards of an automaton are cached in `g_val` by the generated code. A guard is only re-evaluated when it is marked in `g_dirty`, i.e. when a fired statement wrote a variable or port it reads, or when the status of a port it reads has changed.
+
+    In state class mode (see `TranslationOptions`), the state lives in the attributes of the instance, `step()` fires the next enabled transition after the last fired one, and `run()` drives `step()`. `step()` returns None if no transition is enabled, the ports to synchronize if the fired transition reached a synchronization, and () otherwise.
+
+    An automaton with no enabled transition is parked until one of the ports read by its guards changes (see `m_lib.wait_change`): its variables are only written by its own transitions, so nothing else can enable it. In state class mode, these ports are returned by `watched()`, for the schedulers.
+    '''
+    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager, body: AttributedTree, emitter: CodeEmitter | None = None, options: TranslationOptions | None = None, signature_string: str | None = None):
+        '''
+        signature_string: the parameters of the automaton, for the automata without template (e.g. the products built by `SystemTranslator`)
+        '''
+        super().__init__(type_context, actual_name, template_manager, body, emitter, options)
+        self._signature_string = signature_string
+
+        # All guarded statements, in order. The index of a guarded statement is the index of its cached guard.
+        self._guarded_stmts: List[AttributedTree] = []
+        self._guard_indices: Dict[int, int] = {}
+
+        # Indices of the guards to re-evaluate after the statements of each guarded statement
+        self._affected_guards: List[Tuple[int, ...]] = []
+
+        # Port name -> indices of the guards reading the port
+        self._port_guards: Dict[str, Tuple[int, ...]] = {}
+
+        # (local name, python code, indices of the guards reading it) of the sub-terms shared by the guards
+        self._guard_shared_terms: List[Tuple[str, str, Tuple[int, ...]]] = []
+
+        # (method name, guarded statement, statements, bounds of the variables) of the statements following a synchronization in state class mode
+        self._continuations: List[Tuple[str, AttributedTree, List[AttributedTree], Dict[str, Tuple[float, float]]]] = []
+
+        # Prefix of the python names of the state: the variables, ports, guard cache and shared guard sub-terms
+        self._state_prefix = "self." if self._options.state_classes else ""
+        self._var_prefix = self._state_prefix + "id_"
+        self._owner_prefix = self._state_prefix + "ow_"
     
-    def _translate_sync_stmt(self, sync_stmt: AttributedTree) -> str:
+    def _translate_sync_stmt(self, sync_stmt: AttributedTree):
         assert sync_stmt.name == "sync_stmt"
 
-        python_code = []
         for child in sync_stmt.children:
             identifier = child.get_attribute("value")
-
-            _, IO = self._type_context.get_param_type(identifier, with_IO=True)
             
-            python_code.append("await id_" + identifier + ".set(a)\n")
-            python_code.append("await id_" + identifier + ".wait(a)\n")
-            
-        return "".join(python_code)
+            self._emitter.line("await " + self._var_prefix + identifier + ".sync()")
+        
+        # Let the other automata run before the following statements, as a suspended `step()` does in state class mode
+        self._emitter.line("await asyncio.sleep(0)")
+
+    def _translate_suspension(self, sync_stmt: AttributedTree, guarded_stmt: AttributedTree, stmts: List[AttributedTree], env: Dict[str, Tuple[float, float]]):
+        '''
+        In state class mode, end the step at a synchronization: return the ports to synchronize, and let the next step run the statements `stmts` following the synchronization.
+        '''
+        assert sync_stmt.name == "sync_stmt"
+
+        continuation_name = "_cont_" + str(len(self._continuations))
+        self._continuations.append((continuation_name, guarded_stmt, stmts, env.copy()))
+
+        ports = [self._var_prefix + child.get_attribute("value") for child in sync_stmt.children]
+
+        self._emitter.line("self.cont = self." + continuation_name)
+        self._emitter.line("return (" + ", ".join(ports) + ",)")
+
+    def _translate_stmts(self, stmts: List[AttributedTree], env: Dict[str, Tuple[float, float]]) -> List[ExpansionRequest]:
+        '''
+        `env` holds the bounds of the variables before the statements (see `IntervalAnalyzer`). It is updated in-place.
+        '''
+        all_requests = []
+
+        for stmt in stmts:
+            if stmt.name == "assign_stmt":
+                all_requests += self._translate_assign(stmt, env)
+            elif stmt.name == "sync_stmt":
+                self._translate_sync_stmt(stmt)
+            else:
+                raise Exception
+        
+        return all_requests
 
-    def _translate_transition(self, transition: AttributedTree) -> Tuple[str, List[ExpansionRequest]]:
+    def _translate_transition(self, transition: AttributedTree) -> List[ExpansionRequest]:
         if transition.name == "transition":
             return self._translate_single_guarded_stmt(transition.children[0])
         elif transition.name == "guarded_stmt_grp":
@@ -264,94 +568,900 @@ class AutomatonTranslator(LowLevelTranslator):
         else:
             raise Exception
 
-    def _decompose_guarded_stmt(self, guarded_stmt: AttributedTree) -> Tuple[str, str, List[ExpansionRequest]]:
+    def _decompose_guarded_stmt(self, guarded_stmt: AttributedTree) -> Tuple[str, List[AttributedTree], List[ExpansionRequest]]:
+        '''
+        Get the code reading the cached guard of a guarded statement. The statements are returned untranslated so that they can be emitted at their final indentation level.
+        '''
         assert guarded_stmt.name == "guarded_stmt"
         
+        guard_index = self._guard_indices[id(guarded_stmt)]
+
+        return "g_val[" + str(guard_index) + "]", guarded_stmt.children[1:], []
+
+    def _translate_guarded_body(self, guarded_stmt: AttributedTree) -> List[ExpansionRequest]:
+        '''
+        Translate the statements of a guarded statement, then mark the guards they may change.
+        '''
+        # Bounds of the variables when the guard holds
+        env = self._interval_analyzer.refine(guarded_stmt.children[0], {})
+
+        return self._translate_segment(guarded_stmt, guarded_stmt.children[1:], env)
+
+    def _translate_segment(self, guarded_stmt: AttributedTree, stmts: List[AttributedTree], env: Dict[str, Tuple[float, float]]) -> List[ExpansionRequest]:
+        '''
+        Translate the last statements `stmts` of a guarded statement, then mark the guards the guarded statement may change.
+
+        The sub-terms shared by the assignments, or with the guards, are computed once beforehand, unless they read something written by the guarded statement.
+
+        In state class mode, a synchronization suspends the step (see `_translate_suspension`), and the guards are marked by the continuation. In coroutine mode, the segment ends by breaking out of the loop trying the transitions.
+        '''
+        guard_index = self._guard_indices[id(guarded_stmt)]
+        all_stmts = guarded_stmt.children[1:]
+
+        excluded_names = get_write_set(all_stmts)
+        if any([stmt.name == "sync_stmt" for stmt in all_stmts]):
+            # Other automata may run while synchronizing
+            excluded_names |= set([name for name in get_read_set(guarded_stmt) if self._type_context.is_port(name)])
+        
+        sync_stmt = None
+        if self._options.state_classes:
+            for i in range(len(stmts)):
+                if stmts[i].name == "sync_stmt":
+                    sync_stmt = stmts[i]
+                    rest_stmts = stmts[i + 1:]
+                    stmts = stmts[:i]
+                    break
+
+        folder = ConstantFolder(self._type_context)
+        term_trees = []
+        for stmt in stmts:
+            if stmt.name != "assign_stmt":
+                continue
+            
+            # The assigned terms themselves are not values, only their sub-terms can be shared.
+            for term_tree in stmt.get_child_by_name("lhs").children:
+                term_trees += [folder.fold(child) for child in term_tree.children]
+            term_trees += [folder.fold(term_tree) for term_tree in stmt.get_child_by_name("rhs").children]
+        
+        # The shared guard sub-terms were computed before the guarded statement, so those reading what it writes or synchronizes are stale.
+        guard_shared_terms = self._shared_terms
+        self._shared_terms = {fingerprint: shared_term for fingerprint, shared_term in guard_shared_terms.items() if not (self._shared_term_reads[fingerprint] & excluded_names)}
+
+        requests = []
+        for local_name, python_code, _, shared_requests in self._translate_shared_terms(term_trees, "cse_" + str(guard_index) + "_", excluded_names):
+            self._emitter.line(local_name + " = " + python_code)
+            requests += shared_requests
+
+        requests += self._translate_stmts(stmts, env)
+
+        self._shared_terms = guard_shared_terms
+
+        if sync_stmt is not None:
+            self._translate_suspension(sync_stmt, guarded_stmt, rest_stmts, env)
+            return requests
+
+        affected_guards = self._affected_guards[guard_index]
+        if affected_guards:
+            self._emitter.line("g_dirty.update(" + repr(affected_guards) + ")")
+        
+        if self._options.state_classes:
+            self._emitter.line("return ()")
+        else:
+            self._emitter.line("break")
+        
+        return requests
+
+    def _analyze_guards(self, automaton_trans: AttributedTree):
+        '''
+        Index the guarded statements and compute which guards each of them may change.
+        '''
+        for transition in automaton_trans.children:
+            if transition.name == "transition":
+                self._guarded_stmts.append(transition.children[0])
+            else:
+                self._guarded_stmts += transition.children
+        
+        read_sets = []
+        port_guards = {}
+        for i in range(len(self._guarded_stmts)):
+            guarded_stmt = self._guarded_stmts[i]
+            self._guard_indices.update({id(guarded_stmt): i})
+
+            read_set = get_read_set(guarded_stmt.children[0])
+            read_sets.append(read_set)
+
+            for name in read_set:
+                if self._type_context.is_port(name):
+                    port_guards.setdefault(name, []).append(i)
+        
+        self._port_guards = {port: tuple(indices) for port, indices in port_guards.items()}
+
+        for guarded_stmt in self._guarded_stmts:
+            stmts = guarded_stmt.children[1:]
+            write_set = get_write_set(stmts)
+
+            # Other automata may run while synchronizing, so every port may have changed.
+            has_sync = any([stmt.name == "sync_stmt" for stmt in stmts])
+
+            affected_guards = []
+            for i in range(len(self._guarded_stmts)):
+                if read_sets[i] & write_set:
+                    affected_guards.append(i)
+                elif has_sync and any([i in indices for indices in self._port_guards.values()]):
+                    affected_guards.append(i)
+            self._affected_guards.append(tuple(affected_guards))
+
+    def _translate_guard_shared_terms(self) -> List[ExpansionRequest]:
+        '''
+        Find the sub-terms shared by several guards. They are read from locals (attributes in state class mode), which are computed by the guard refresh.
+        '''
+        all_requests = []
+
+        guards = [guarded_stmt.children[0] for guarded_stmt in self._guarded_stmts]
+        for local_name, python_code, users, requests in self._translate_shared_terms(guards, self._state_prefix + "cse_"):
+            self._guard_shared_terms.append((local_name, python_code, tuple(sorted(users))))
+            all_requests += requests
+        
+        return all_requests
+
+    def _translate_guards(self) -> List[ExpansionRequest]:
+        '''
+        Emit the guard functions. In state class mode, they take the instance as argument.
+        '''
         all_requests = []
 
+        header = "lambda self: " if self._options.state_classes else "lambda: "
+
+        with self._emitter.block("g_fns = ("):
+            for guarded_stmt in self._guarded_stmts:
+                guard_resolved = self._translate_term(guarded_stmt.children[0])
+                self._emitter.line(header + guard_resolved.python_code + ",")
+                all_requests += guard_resolved.expansion_requests
+        self._emitter.line(")")
+
+        return all_requests
+
+    def _translate_guard_cache(self):
+        '''
+        Emit the initialization of the guard cache.
+        '''
+        self._emitter.line(self._state_prefix + "g_val = [False] * " + str(len(self._guarded_stmts)))
+        self._emitter.line(self._state_prefix + "g_dirty = set(range(" + str(len(self._guarded_stmts)) + "))")
+
+        for port_name in self._port_guards:
+            self._emitter.line(self._state_prefix + "pv_" + port_name + " = -1")
+
+    def _translate_port_check(self):
+        '''
+        Mark the guards reading the ports whose status changed since the last step.
+        '''
+        for port_name, guard_indices in self._port_guards.items():
+            port_code = self._var_prefix + port_name
+            version_code = self._state_prefix + "pv_" + port_name
+
+            with self._emitter.block("if " + port_code + ".version != " + version_code + ":"):
+                self._emitter.line(version_code + " = " + port_code + ".version")
+                self._emitter.line("g_dirty.update(" + repr(guard_indices) + ")")
+
+    def _get_watched_code(self) -> str:
+        '''
+        The tuple of the ports read by the guards, which can enable a transition of the automaton when it has none.
+        '''
+        if not self._port_guards:
+            return "()"
+        
+        return "(" + ", ".join([self._var_prefix + port_name for port_name in self._port_guards]) + ",)"
+
+    def _translate_guard_refresh(self):
+        with self._emitter.block("if g_dirty:"):
+            for local_name, python_code, users in self._guard_shared_terms:
+                if len(users) == len(self._guarded_stmts):
+                    self._emitter.line(local_name + " = " + python_code)
+                    continue
+
+                with self._emitter.block("if not g_dirty.isdisjoint(" + repr(users) + "):"):
+                    self._emitter.line(local_name + " = " + python_code)
+            
+            with self._emitter.block("for i in g_dirty:"):
+                if self._options.state_classes:
+                    self._emitter.line("g_val[i] = g_fns[i](self)")
+                else:
+                    self._emitter.line("g_val[i] = g_fns[i]()")
+            self._emitter.line("g_dirty.clear()")
+
+    def _translate_single_guarded_stmt(self, guarded_stmt: AttributedTree) -> List[ExpansionRequest]:
         guard = guarded_stmt.children[0]
-        guard_resolved = TermTranslator(self._type_context, self._template_manager, guard).translate()
-        guard_python_code = guard_resolved.python_code
-        all_requests += guard_resolved.expansion_requests
 
-        stmt_code = []
-        for stmt in guarded_stmt.children[1:]:
-            if stmt.name == "assign_stmt":
-                python_code, requests = self._translate_assign(stmt)
-                stmt_code.append(python_code)
-                all_requests += requests
-            elif stmt.name == "sync_stmt":
-                python_code = self._translate_sync_stmt(stmt)
-                stmt_code.append(python_code)
+        if ConstantFolder.is_constant_true(guard):
+            return self._translate_guarded_body(guarded_stmt)
+
+        guard_code, stmts, requests = self._decompose_guarded_stmt(guarded_stmt)
+        
+        with self._emitter.block("if " + guard_code + ":"):
+            requests += self._translate_guarded_body(guarded_stmt)
+
+        return requests
+
+    def _translate_guarded_stmt_grp(self, guarded_stmt_grp: AttributedTree) -> List[ExpansionRequest]:
+        '''
+        Exactly one of the enabled guarded statements of the group is executed, chosen uniformly at random.
+
+        The generated code allocates nothing: the choice is made by reservoir sampling while the guards are evaluated, and the chosen statements are reached through a binary decision tree on their index.
+        '''
+        assert guarded_stmt_grp.name == "guarded_stmt_grp"
+
+        if guarded_stmt_grp.n_children == 1:
+            return self._translate_single_guarded_stmt(guarded_stmt_grp.children[0])
+        
+        all_requests = []
+        guards = []
+        stmts_lst = []
+
+        for guarded_stmt in guarded_stmt_grp.children:
+            guard_code, stmts, requests = self._decompose_guarded_stmt(guarded_stmt)
+            guards.append(guard_code)
+            stmts_lst.append(stmts)
+            all_requests += requests
+
+        self._emitter.line("n_enabled = 0")
+        self._emitter.line("choiced = -1")
+
+        for i in range(len(guards)):
+            with self._emitter.block("if " + guards[i] + ":"):
+                self._emitter.line("n_enabled += 1")
+                if i == 0:
+                    self._emitter.line("choiced = 0")
+                else:
+                    # Keep the i-th enabled guard with probability 1 / i
+                    with self._emitter.block("if random.random() * n_enabled < 1.0:"):
+                        self._emitter.line("choiced = " + str(i))
+
+        with self._emitter.block("if choiced >= 0:"):
+            all_requests += self._translate_dispatch_tree(guarded_stmt_grp, stmts_lst, 0, len(stmts_lst) - 1)
+        
+        return all_requests
+
+    def _translate_dispatch_tree(self, guarded_stmt_grp: AttributedTree, stmts_lst: List[List[AttributedTree]], lo: int, hi: int) -> List[ExpansionRequest]:
+        '''
+        Emit the statements of the guarded statements `lo`..`hi` (inclusive), selected by a binary search on `choiced`.
+        '''
+        if lo == hi:
+            return self._translate_guarded_body(guarded_stmt_grp.children[lo])
+        
+        all_requests = []
+        mid = (lo + hi + 1) // 2
+
+        with self._emitter.block("if choiced < " + str(mid) + ":"):
+            all_requests += self._translate_dispatch_tree(guarded_stmt_grp, stmts_lst, lo, mid - 1)
+        
+        with self._emitter.block("else:"):
+            all_requests += self._translate_dispatch_tree(guarded_stmt_grp, stmts_lst, mid, hi)
+        
+        return all_requests
+    
+    def _translate_transition_tree(self, automaton_trans: AttributedTree, lo: int, hi: int) -> List[ExpansionRequest]:
+        '''
+        In coroutine mode, reach the transition of index `t` among the transitions `lo`..`hi` through a binary decision tree. A transition which fires breaks out of the loop trying them.
+        '''
+        if lo == hi:
+            return self._translate_transition(automaton_trans.children[lo])
+        
+        all_requests = []
+        mid = (lo + hi + 1) // 2
+
+        with self._emitter.block("if t < " + str(mid) + ":"):
+            all_requests += self._translate_transition_tree(automaton_trans, lo, mid - 1)
+        
+        with self._emitter.block("else:"):
+            all_requests += self._translate_transition_tree(automaton_trans, mid, hi)
+        
+        return all_requests
+
+    def _simplify_guards(self, automaton_trans: AttributedTree):
+        '''
+        Fold the guards of all transitions and drop the guarded statements whose guard is trivially false.
+
+        Warning: This is in-place.
+        '''
+        folder = ConstantFolder(self._type_context)
+
+        transitions = []
+        for transition in automaton_trans.children:
+            if transition.name == "transition":
+                guarded_stmts = [transition.children[0]]
             else:
-                raise Exception
-        stmt_code = "".join(stmt_code)
+                guarded_stmts = transition.children
+
+            enabled_stmts = []
+            for guarded_stmt in guarded_stmts:
+                guarded_stmt.children[0] = folder.fold(guarded_stmt.children[0])
+                if not ConstantFolder.is_constant_false(guarded_stmt.children[0]):
+                    enabled_stmts.append(guarded_stmt)
+
+            if not enabled_stmts:
+                continue
+
+            if transition.name == "guarded_stmt_grp":
+                transition.children = enabled_stmts
+            transitions.append(transition)
+
+        automaton_trans.children = transitions
+
+    def translate(self) -> List[ExpansionRequest]:
+        all_requests = []
+
+        if self._signature_string is None:
+            signature_string = self._template_manager.get_signature_string(infer_original_name(self._actual_name))
+        else:
+            signature_string = self._signature_string
+
+        automaton_vars = self._body.get_child_by_name("automaton_vars", raise_exception=False)
+        automaton_trans = self._body.get_child_by_name("automaton_trans", raise_exception=False)
+
+        if automaton_trans is not None:
+            self._simplify_guards(automaton_trans)
+        
+        if self._options.state_classes:
+            return self._translate_state_class(signature_string, automaton_vars, automaton_trans)
+
+        with self._emitter.block("class " + self._actual_name + ":"):
+            with self._emitter.block("async def run(self, " + signature_string[1:] + ":"):
+                if automaton_vars is not None:
+                    for var_decl in automaton_vars.children:
+                        all_requests += self._translate_var_decl(var_decl)
+                
+                if automaton_trans is None or automaton_trans.n_children == 0:
+                    self._emitter.line("return")
+                    return all_requests
+                
+                self._analyze_guards(automaton_trans)
+                all_requests += self._translate_guard_shared_terms()
+                all_requests += self._translate_guards()
+                self._translate_guard_cache()
+
+                # Like `step()` in state class mode, each iteration fires at most one transition, trying them in order from the one after the last fired
+                n_transitions = str(automaton_trans.n_children)
+                self._emitter.line("pc = 0")
+                with self._emitter.block("while True:"):
+                    self._translate_port_check()
+
+                    with self._emitter.block("for k in range(pc, pc + " + n_transitions + "):"):
+                        self._emitter.line("t = k if k < " + n_transitions + " else k - " + n_transitions)
+                        self._translate_guard_refresh()
+                        all_requests += self._translate_transition_tree(automaton_trans, 0, automaton_trans.n_children - 1)
+                    
+                    # No transition is enabled
+                    with self._emitter.block("else:"):
+                        self._emitter.line("await wait_change(" + self._get_watched_code() + ")")
+                        self._emitter.line("continue")
+                    self._emitter.line("pc = t + 1 if t + 1 < " + n_transitions + " else 0")
+                    self._emitter.line("await asyncio.sleep(0)")
+
+        return all_requests
+
+    def _translate_continuations(self) -> List[ExpansionRequest]:
+        '''
+        Emit the methods running the statements after the synchronizations. A continuation may itself be suspended and add new continuations.
+        '''
+        all_requests = []
+
+        i = 0
+        while i < len(self._continuations):
+            continuation_name, guarded_stmt, stmts, env = self._continuations[i]
+
+            self._emitter.line()
+            with self._emitter.block("def " + continuation_name + "(self):"):
+                self._emitter.line("g_dirty = self.g_dirty")
+                all_requests += self._translate_segment(guarded_stmt, stmts, env)
+            
+            i += 1
+        
+        return all_requests
+
+    def _get_state_code(self, name: str) -> Tuple | str:
+        if not self._type_context.is_var(name):
+            return ("direct")
+        
+        return TypeTree(self._type_context.type_of_var(name)).get_s11n_code()
+
+    def _translate_state_class(self, signature_string: str, automaton_vars: AttributedTree | None, automaton_trans: AttributedTree | None) -> List[ExpansionRequest]:
+        '''
+        Emit the automaton as a class keeping its state in `__slots__`, with one method per transition.
+        '''
+        all_requests = []
+
+        port_names = [name for name in signature_string[1:-1].split(", ") if name]
+
+        var_names = []
+        if automaton_vars is not None:
+            for var_decl in automaton_vars.children:
+                for child in var_decl.children[:-1]:
+                    var_names.append("id_" + child.get_attribute("value"))
+                    if self._is_owned_var(child.get_attribute("value"), var_decl.children[-1]):
+                        var_names.append("ow_" + child.get_attribute("value"))
+
+        has_transitions = automaton_trans is not None and automaton_trans.n_children > 0
+        n_transitions = str(automaton_trans.n_children) if has_transitions else "0"
 
-        return guard_python_code, stmt_code, all_requests
+        slots = port_names + var_names
+        if has_transitions:
+            self._analyze_guards(automaton_trans)
+            all_requests += self._translate_guard_shared_terms()
 
-    def _translate_single_guarded_stmt(self, guarded_stmt: AttributedTree) -> Tuple[str, List[ExpansionRequest]]:
-        guard_code, stmt_code, requests = self._decompose_guarded_stmt(guarded_stmt)
+            slots += [local_name[len(self._state_prefix):] for local_name, _, _ in self._guard_shared_terms]
+            slots += ["pv_" + port_name for port_name in self._port_guards]
+            slots += ["g_val", "g_dirty", "pc", "cont"]
+
+        with self._emitter.block("class " + self._actual_name + ":"):
+            if slots:
+                self._emitter.line("__slots__ = (" + ", ".join([repr(slot) for slot in slots]) + ",)")
+            else:
+                self._emitter.line("__slots__ = ()")
+            
+            # The s11n codes of the ports and the variables, which make up the state of the automaton (see `m_check`)
+            state_names = port_names + [name for name in var_names if name.startswith("id_")]
+            self._emitter.line("state_codes = (" + "".join(["(" + repr(name) + ", " + repr(self._get_state_code(name[len("id_"):])) + "), " for name in state_names]).rstrip(" ") + ")")
+
+            if has_transitions:
+                all_requests += self._translate_guards()
+
+            self._emitter.line()
+            with self._emitter.block("def __init__(self, " + signature_string[1:] + ":"):
+                for port_name in port_names:
+                    self._emitter.line("self." + port_name + " = " + port_name)
+                
+                if automaton_vars is not None:
+                    for var_decl in automaton_vars.children:
+                        all_requests += self._translate_var_decl(var_decl)
+                
+                if has_transitions:
+                    self._translate_guard_cache()
+                    self._emitter.line("self.pc = 0")
+                    self._emitter.line("self.cont = None")
+                elif not port_names and not var_names:
+                    self._emitter.line("pass")
+            
+            self._emitter.line()
+            with self._emitter.block("def step(self):"):
+                if not has_transitions:
+                    self._emitter.line("return None")
+                else:
+                    with self._emitter.block("if self.cont is not None:"):
+                        self._emitter.line("cont = self.cont")
+                        self._emitter.line("self.cont = None")
+                        self._emitter.line("return cont()")
+                    
+                    self._emitter.line("g_val = self.g_val")
+                    self._emitter.line("g_dirty = self.g_dirty")
+                    self._emitter.line("g_fns = self.g_fns")
+                    self._emitter.line("t_fns = self.t_fns")
+                    self._translate_port_check()
+
+                    # Try the transitions in order, starting after the last fired one
+                    self._emitter.line("pc = self.pc")
+                    with self._emitter.block("for k in range(pc, pc + " + n_transitions + "):"):
+                        self._emitter.line("t = k if k < " + n_transitions + " else k - " + n_transitions)
+                        self._translate_guard_refresh()
+                        self._emitter.line("fired = t_fns[t](self)")
+                        with self._emitter.block("if fired is not None:"):
+                            self._emitter.line("self.pc = t + 1 if t + 1 < " + n_transitions + " else 0")
+                            self._emitter.line("return fired")
+                    self._emitter.line("return None")
+            
+            self._emitter.line()
+            with self._emitter.block("def watched(self):"):
+                if has_transitions:
+                    self._emitter.line("return " + self._get_watched_code())
+                else:
+                    self._emitter.line("return ()")
+
+            self._emitter.line()
+            with self._emitter.block("async def run(self):"):
+                if not has_transitions:
+                    self._emitter.line("return")
+                else:
+                    self._emitter.line("step = self.step")
+                    self._emitter.line("watched = self.watched()")
+                    with self._emitter.block("while True:"):
+                        self._emitter.line("ports = step()")
+                        with self._emitter.block("if ports is None:"):
+                            self._emitter.line("await wait_change(watched)")
+                            self._emitter.line("continue")
+                        with self._emitter.block("if ports:"):
+                            with self._emitter.block("for port in ports:"):
+                                self._emitter.line("await port.sync()")
+                        self._emitter.line("await asyncio.sleep(0)")
+            
+            if not has_transitions:
+                return all_requests
+            
+            for i in range(automaton_trans.n_children):
+                self._emitter.line()
+                with self._emitter.block("def _fire_" + str(i) + "(self):"):
+                    self._emitter.line("g_val = self.g_val")
+                    self._emitter.line("g_dirty = self.g_dirty")
+                    all_requests += self._translate_transition(automaton_trans.children[i])
+            
+            all_requests += self._translate_continuations()
+
+            self._emitter.line()
+            self._emitter.line("t_fns = (" + ", ".join(["_fire_" + str(i) for i in range(automaton_trans.n_children)]) + ",)")
+
+        return all_requests
+
+# The numpy types of the columns of a batch, by kind of value
+COLUMN_DTYPES = {"bool": "numpy.bool_", "int": "numpy.int64", "real": "numpy.float64"}
+INT64_MAX = (1 << 63) - 1
+
+class BatchTranslator(ObjectTranslator):
+    '''
+    Translate an automaton into a subclass of `m_lib.Batch`, running its instances in a system as a single component whose variables are numpy columns.
+
+    Only automata made of assignments are vectorized: their variables and ports hold bools, reals or bounded ints, their guarded statements assign variables and the `value`, `reqRead` and `reqWrite` of ports, and their terms are arithmetic, comparisons and logical operations. The integer terms must be proven to fit in 64 bits and their divisors to be positive (see `IntervalAnalyzer`), since the vectorized operations neither grow nor raise like python integers, and the divisors of reals must be non-zero constants. `translate` returns None for the other automata, without emitting anything: their instances keep a component each.
+    '''
+    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager, body: AttributedTree, emitter: CodeEmitter | None = None, options: TranslationOptions | None = None, signature_string: str = "()"):
+        '''
+        signature_string: the parameters of the automaton, each given to the batch as a tuple of ports
+        '''
+        super().__init__(type_context, actual_name, template_manager, body, emitter, options)
+        self._signature_string = signature_string
+        self._folder = ConstantFolder(type_context)
+        self._interval_analyzer = IntervalAnalyzer(type_context)
+
+        # The variables and the ports: name -> (kind of value, bounds if it is a bounded int)
+        self._kinds: Dict[str, Tuple[str, Tuple[int, int] | None]] = {}
+
+    def translate(self) -> List[ExpansionRequest] | None:
+        port_names = [port_name[len("id_"):] for port_name in self._signature_string[1:-1].split(", ") if port_name]
+        for port_name in port_names:
+            kind = self._get_kind(self._type_context.get_param_type(port_name))
+            if kind is None:
+                return None
+            self._kinds[port_name] = kind
+
+        # (name, kind, python code of the initial value) of the columns
+        columns: List[Tuple[str, str, str]] = []
+        automaton_vars = self._body.get_child_by_name("automaton_vars", raise_exception=False)
+        if automaton_vars is not None:
+            for var_decl in automaton_vars.children:
+                type_tree = var_decl.children[-1]
+                kind = self._get_kind(type_tree)
+                init_code = self._get_init_code(type_tree)
+                if kind is None or init_code is None:
+                    return None
+                
+                for child in var_decl.children[:-1]:
+                    var_name = child.get_attribute("value")
+                    if not self._type_context.is_var(var_name):
+                        self._type_context.set_local_var_type(var_name, type_tree)
+                    self._kinds[var_name] = kind
+                    columns.append((var_name, kind[0], init_code))
+        
+        guarded_stmts: List[AttributedTree] = []
+        groups: List[Tuple[int, ...]] = []
+        automaton_trans = self._body.get_child_by_name("automaton_trans", raise_exception=False)
+        if automaton_trans is not None:
+            for transition in automaton_trans.children:
+                stmts = [transition.children[0]] if transition.name == "transition" else transition.children
+                groups.append(tuple(range(len(guarded_stmts), len(guarded_stmts) + len(stmts))))
+                guarded_stmts += stmts
+        
+        # The port fields read by the guards, gathered once per step: python code -> local name
+        gathers: Dict[str, str] = {}
+        guard_codes = []
+        for guarded_stmt in guarded_stmts:
+            resolved = self._translate_vector_term(self._folder.fold(guarded_stmt.children[0]), gathers)
+            if resolved is None or resolved[1] != "bool":
+                return None
+            
+            python_code, _, is_column = resolved
+            guard_codes.append(python_code if is_column else "numpy.full(self.n, " + python_code + ")")
+        
+        fire_bodies = []
+        for guarded_stmt in guarded_stmts:
+            lines = []
+            value_names = count()
+            env = self._interval_analyzer.refine(self._folder.fold(guarded_stmt.children[0]), {})
+            for stmt in guarded_stmt.children[1:]:
+                if stmt.name != "assign_stmt" or not self._translate_vector_assign(stmt, lines, value_names, env):
+                    return None
+            fire_bodies.append(lines)
+        
+        read_names = set()
+        for guarded_stmt in guarded_stmts:
+            read_names |= get_read_set(guarded_stmt.children[0])
+        watched_ports = tuple(["id_" + port_name for port_name in port_names if port_name in read_names])
+
+        with self._emitter.block("class " + self._actual_name + "(Batch):"):
+            self._emitter.line("groups = (" + "".join([repr(group) + ", " for group in groups]).rstrip(" ") + ")")
+            self._emitter.line("watched_ports = " + repr(watched_ports))
+
+            self._emitter.line()
+            with self._emitter.block("def __init__(" + ", ".join(["self", "n"] + ["id_" + port_name for port_name in port_names]) + "):"):
+                self._emitter.line("super().__init__(n)")
+                for port_name in port_names:
+                    self._emitter.line("self.id_" + port_name + " = id_" + port_name)
+                for var_name, kind, init_code in columns:
+                    self._emitter.line("self.id_" + var_name + " = numpy.full(n, " + init_code + ", " + COLUMN_DTYPES[kind] + ")")
+            
+            self._emitter.line()
+            with self._emitter.block("def guards(self):"):
+                for python_code, local_name in gathers.items():
+                    self._emitter.line(local_name + " = " + python_code)
+                
+                with self._emitter.block("return ("):
+                    for python_code in guard_codes:
+                        self._emitter.line(python_code + ",")
+                self._emitter.line(")")
+            
+            for i in range(len(fire_bodies)):
+                self._emitter.line()
+                with self._emitter.block("def _fire_" + str(i) + "(self, mask):"):
+                    for line in fire_bodies[i]:
+                        self._emitter.line(line)
+                    if not fire_bodies[i]:
+                        self._emitter.line("pass")
+            
+            self._emitter.line()
+            self._emitter.line("f_fns = (" + "".join(["_fire_" + str(i) + ", " for i in range(len(fire_bodies))]).rstrip(" ") + ")")
+        
+        return []
+
+    @staticmethod
+    def _get_kind(type_tree: TypeTree) -> Tuple[str, Tuple[int, int] | None] | None:
+        '''
+        The kind of the values of a column ("bool", "int" or "real"), with the bounds of the bounded ints, or None if the type cannot be held by a column.
+        '''
+        while type_tree.name in ("init", "init_type"):
+            type_tree = type_tree.children[0]
         
-        python_code = "if " + guard_code + ":\n" + indent_code(stmt_code) + "\n"
-
-        return python_code, requests
-
-    def _translate_guarded_stmt_grp(self, guarded_stmt_grp: AttributedTree) -> Tuple[str, List[ExpansionRequest]]:
-        assert guarded_stmt_grp.name == "guarded_stmt_grp"
+        if type_tree.name in ("bool", "real"):
+            return (type_tree.name, None)
         
-        result_code = []
-
-        all_requests = []
-        guards = []
-        stmt_codes = []
-
-        for guarded_stmt in guarded_stmt_grp.children:
-            guard_code, stmt_code, requests = self._decompose_guarded_stmt(guarded_stmt)
-            guards.append(guard_code)
-            stmt_codes.append(stmt_code)
-            all_requests += requests
-
-        guard_list_code = "g_lst = [" + ", ".join(guards) + "]\n"
-        result_code.append(guard_list_code)
-        result_code.append("choiced = random.choice(list([i for i in range(" + str(guarded_stmt_grp.n_children) + "if g_lst[i]]))\n")
-
-        for i in range(guarded_stmt_grp.n_children):
-            result_code.append("if choiced == " + str(i) + ": \n")
-            result_code.append(indent_code(stmt_codes[i]))
-            result_code.append("\n")
+        if type_tree.name == "bounded_int":
+            l, r = type_tree.get_attribute("l"), type_tree.get_attribute("r")
+            if -INT64_MAX <= l and r <= INT64_MAX:
+                return ("int", (l, r))
         
-        return "".join(result_code), all_requests
-    
-    def translate(self) -> Tuple[str, List[ExpansionRequest]]:
-        result_code = []
-        all_requests = []
+        return None
 
-        automaton_vars = self._body.get_child_by_name("automaton_vars")
+    def _get_init_code(self, type_tree: TypeTree) -> str | None:
+        '''
+        The initial value of a column, or None if it is not a constant. A column cannot hold None: the entries without initial value are zeros.
+        '''
+        if type_tree.name == "init_type":
+            term_tree = type_tree.get_attribute("init_term")
+        elif type_tree.name == "init":
+            term_tree = type_tree.get_attribute("term")
+        else:
+            return "0"
+        
+        term_tree = self._folder.fold(term_tree)
+        if term_tree.name != "VALUE" or type(term_tree.get_attribute("value")) not in (bool, int, float):
+            return None
+        
+        return repr(term_tree.get_attribute("value"))
 
-        for var_decl in automaton_vars.children:
-            python_code, requests = self._translate_var_decl(var_decl)
-            result_code.append(python_code)
-            all_requests.append(requests)
+    def _get_int_interval(self, term_tree: AttributedTree, env: Dict[str, Tuple[float, float]] = {}) -> Tuple[float, float] | None:
+        '''
+        The bounds of an integer term, or None if they are unknown or some partial result may not fit in 64 bits.
+        '''
+        if term_tree.name in ("term_c", "term_d"):
+            interval = self._interval_analyzer.evaluate(term_tree.children[0], env)
+            for i in range(1, term_tree.n_children, 2):
+                operand_interval = self._interval_analyzer.evaluate(term_tree.children[i + 1], env)
+                if interval is None or operand_interval is None:
+                    return None
+                
+                interval = apply_interval_operator(term_tree.children[i].name, interval, operand_interval)
+                if interval is None or interval[0] < -INT64_MAX or interval[1] > INT64_MAX:
+                    return None
             
-        automaton_trans = self._body.get_child_by_name("automaton_trans")
+            return interval
+        
+        interval = self._interval_analyzer.evaluate(term_tree, env)
+        if interval is None or interval[0] < -INT64_MAX or interval[1] > INT64_MAX:
+            return None
+        
+        return interval
 
-        for transition in automaton_trans.children:
-            python_code, requests = self._translate_transition(transition)
-            result_code.append(python_code)
-            all_requests.append(requests)
+    def _translate_vector_term(self, term_tree: AttributedTree, gathers: Dict[str, str] | None) -> Tuple[str, str, bool] | None:
+        '''
+        The python code computing a (folded) term for all the instances, its kind of value, and whether it is a column (otherwise it is a scalar, the same for all the instances). Return None if the term cannot be vectorized.
 
-        result_code = "".join(result_code)
+        gathers: the port fields already gathered into locals, extended with the new ones (None to gather them where they are read)
+        '''
+        if term_tree.name == "VALUE":
+            value = term_tree.get_attribute("value")
+            if type(value) == bool:
+                return (repr(value), "bool", False)
+            if type(value) == int and -INT64_MAX <= value <= INT64_MAX:
+                return (repr(value), "int", False)
+            if type(value) == float:
+                return (repr(value), "real", False)
+            return None
+        
+        if term_tree.name == "IDENTIFIER":
+            var_name = term_tree.get_attribute("value")
+            if var_name not in self._kinds or self._type_context.is_port(var_name):
+                return None
+            return ("self.id_" + var_name, self._kinds[var_name][0], True)
+        
+        if term_tree.name == "dot_term":
+            port, field = term_tree.children
+            if port.name != "IDENTIFIER" or not self._type_context.is_port(port.get_attribute("value")):
+                return None
+            
+            port_name = port.get_attribute("value")
+            field_name = field.get_attribute("value")
+            if field_name == "value":
+                kind = self._kinds[port_name][0]
+                python_code = "gather(self.id_" + port_name + ", 'shared', " + COLUMN_DTYPES[kind] + ")"
+            elif field_name in ("reqRead", "reqWrite"):
+                kind = "bool"
+                python_code = "gather(self.id_" + port_name + ", " + repr(field_name) + ", numpy.bool_)"
+            else:
+                return None
+            
+            if gathers is not None:
+                python_code = gathers.setdefault(python_code, "pf_" + str(len(gathers)))
+            return (python_code, kind, True)
+        
+        if term_tree.name == "term_b":
+            operator, operand = term_tree.children
+            resolved = self._translate_vector_term(operand, gathers)
+            if resolved is None:
+                return None
+            
+            python_code, kind, is_column = resolved
+            if operator.name == "NOT":
+                return ("numpy.logical_not(" + python_code + ")", "bool", is_column) if kind == "bool" else None
+            if kind == "bool" or (kind == "int" and self._get_int_interval(term_tree) is None):
+                return None
+            if operator.name == "MIN":
+                return ("(-" + python_code + ")", kind, is_column)
+            return resolved
+        
+        if term_tree.name in ("term_g", "term_h"):
+            operands = [self._translate_vector_term(child, gathers) for child in term_tree.children]
+            if any([resolved is None or resolved[1] != "bool" for resolved in operands]):
+                return None
+            
+            connective = " & " if term_tree.name == "term_g" else " | "
+            return ("(" + connective.join([resolved[0] for resolved in operands]) + ")", "bool", any([resolved[2] for resolved in operands]))
+        
+        if term_tree.name in ("term_c", "term_d", "term_e", "term_f"):
+            # Chained comparisons are not vectorized
+            if term_tree.name in ("term_e", "term_f") and term_tree.n_children != 3:
+                return None
+            
+            operands = [self._translate_vector_term(child, gathers) for child in term_tree.children[0::2]]
+            if any([resolved is None for resolved in operands]):
+                return None
+            
+            kinds = set([resolved[1] for resolved in operands])
+            is_column = any([resolved[2] for resolved in operands])
+            operators = [child.name for child in term_tree.children[1::2]]
+            
+            if term_tree.name == "term_f" and kinds == {"bool"}:
+                return ("(" + operands[0][0] + " " + OPERATORS[operators[0]] + " " + operands[1][0] + ")", "bool", is_column)
+            if "bool" in kinds:
+                return None
+            
+            is_real = "real" in kinds
+            python_code = [operands[0][0]]
+            for i in range(len(operators)):
+                if operators[i] in ("DIV", "MOD") and is_real:
+                    divisor = term_tree.children[2 * i + 2]
+                    if divisor.name != "VALUE" or divisor.get_attribute("value") == 0:
+                        return None
+                
+                python_code.append("//" if operators[i] == "DIV" and not is_real else OPERATORS[operators[i]])
+                python_code.append(operands[i + 1][0])
+            python_code = "(" + " ".join(python_code) + ")"
+            
+            if term_tree.name in ("term_e", "term_f"):
+                return (python_code, "bool", is_column)
+            if not is_real and self._get_int_interval(term_tree) is None:
+                return None
+            return (python_code, "real" if is_real else "int", is_column)
+        
+        return None
 
-        result_code = "async def " + "run(self, " + self._template_manager.get_signature_string(infer_original_name(self._actual_name))[1:] + ":\n" + indent_code(result_code) + "\n"
+    def _get_vector_target(self, term_tree: AttributedTree) -> Tuple[str, str | None, Tuple[str, Tuple[int, int] | None]] | None:
+        '''
+        The column or the ports assigned by a LHS term, the field of the ports (None for a column), and the kind of the assigned values.
+        '''
+        if term_tree.name == "IDENTIFIER":
+            var_name = term_tree.get_attribute("value")
+            if var_name not in self._kinds or self._type_context.is_port(var_name):
+                return None
+            return ("self.id_" + var_name, None, self._kinds[var_name])
+        
+        if term_tree.name == "dot_term":
+            port, field = term_tree.children
+            if port.name != "IDENTIFIER" or not self._type_context.is_port(port.get_attribute("value")):
+                return None
+            
+            port_name = port.get_attribute("value")
+            field_name = field.get_attribute("value")
+            if field_name == "value":
+                return ("self.id_" + port_name, "shared", self._kinds[port_name])
+            if field_name in ("reqRead", "reqWrite"):
+                return ("self.id_" + port_name, field_name, ("bool", None))
+        
+        return None
 
-        result_code = "class " + self._actual_name + ":\n" + indent_code(result_code)
+    def _translate_vector_assign(self, assignment: AttributedTree, lines: List[str], value_names: count, env: Dict[str, Tuple[float, float]]) -> bool:
+        '''
+        Append to `lines` the masked assignment of the firing instances. The values are all computed before they are assigned. Return False if the assignment cannot be vectorized.
 
-        return result_code, all_requests
+        `env` holds the bounds of the integer variables known to hold before the assignment, as in `LowLevelTranslator._translate_assign`. It is updated in-place.
+        '''
+        lhs_tree = assignment.get_child_by_name("lhs")
+        rhs_tree = assignment.get_child_by_name("rhs")
+        if lhs_tree.n_children != rhs_tree.n_children:
+            return False
+        
+        targets = [self._get_vector_target(term_tree) for term_tree in lhs_tree.children]
+        assigned_columns = [target[0] for target in targets if target is not None and target[1] is None]
+
+        writes = []
+        intervals = {}
+        for i in range(lhs_tree.n_children):
+            target = targets[i]
+            rhs_term = self._folder.fold(rhs_tree.children[i])
+            resolved = self._translate_vector_term(rhs_term, None)
+            if target is None or resolved is None:
+                return False
+            
+            target_code, field, (kind, bounds) = target
+            python_code, rhs_kind, _ = resolved
+            if rhs_kind != kind and not (kind == "real" and rhs_kind == "int"):
+                return False
+            
+            if bounds is not None:
+                interval = self._get_int_interval(rhs_term, env)
+                if interval is None or interval[0] < bounds[0] or interval[1] > bounds[1]:
+                    python_code = "check_bounded_column(" + python_code + ", mask, " + str(bounds[0]) + ", " + str(bounds[1]) + ")"
+                    interval = bounds
+                if field is None:
+                    intervals[target_code[len("self.id_"):]] = interval
+            
+            # A column assigned in place by the same statement is copied first
+            if python_code in assigned_columns and len(assigned_columns) > 1:
+                python_code = "numpy.copy(" + python_code + ")"
+            
+            value_name = "v" + str(next(value_names))
+            lines.append(value_name + " = " + python_code)
+            writes.append((target_code, field, value_name))
+        
+        for target_code, field, value_name in writes:
+            if field is None:
+                lines.append("numpy.putmask(" + target_code + ", mask, " + value_name + ")")
+            else:
+                lines.append("scatter(" + target_code + ", " + repr(field) + ", mask, " + value_name + ")")
+        
+        env.update(intervals)
+        return True
 
 class SystemTranslator(ObjectTranslator):
-    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager ,body: AttributedTree):
-        super().__init__(type_context, actual_name, template_manager, body)
+    def __init__(self, type_context: TypeContext, actual_name: str, template_manager: TemplateManager ,body: AttributedTree, emitter: CodeEmitter | None = None, options: TranslationOptions | None = None, automaton_bodies: Dict[str, AttributedTree] | None = None, system_bodies: Dict[str, AttributedTree] | None = None):
+        '''
+        automaton_bodies: the bodies of the automata of the program, which can be stepped in a static order (see `_get_static_order`) or fused (see `_fuse`)
+        system_bodies: the bodies of the systems of the program, which are flattened into their parents (see `_expand_connections`)
+        '''
+        super().__init__(type_context, actual_name, template_manager, body, emitter, options)
         self.connections: Dict[str, ConnectionTable] = {}
+        self._automaton_bodies = {} if automaton_bodies is None else automaton_bodies
+        self._system_bodies = {} if system_bodies is None else system_bodies
+
+        # The lines of the system function, and the product automata emitted before it
+        self._connection_code: List[str] = []
+        self._products: List[Tuple[str, TypeContext, AttributedTree, str]] = []
+
+        # The names of the batches emitted before the system function
+        self._batches: List[str] = []
 
     def _parse_components(self, system_comp: AttributedTree) -> List[ExpansionRequest]:
         assert system_comp.name == "system_comp"
@@ -401,124 +1511,476 @@ class SystemTranslator(ObjectTranslator):
             node_name = node.get_attribute("value")
             self._type_context.set_internal_node(node_name)
     
-    def _parse_connections(self, system_conn: AttributedTree) -> Tuple[str, List[ExpansionRequest]]:
+    def _parse_connections(self, system_conn: AttributedTree) -> List[ExpansionRequest]:
+        '''
+        Generate the code creating the nodes and starting the tasks of the components, in `_connection_code`.
+        '''
         assert system_conn.name == "system_conn"
 
         requests = []
         code_for_entities = []
         code_for_nodes = []
-        all_node_names = []
-
-        for connection_decl in system_conn.children:
-            if connection_decl.name == "entity_connection":
-                node_names = []
 
-                connection_name = connection_decl.get_child_by_name("IDENTIFIER")
-                
-                connection_template_apply = connection_decl.get_child_by_name("template_apply", raise_exception=False)
+        # The ports of the system, given by the parent
+        system_ports = set(["id_" + port_name for port_name in self._get_port_names(infer_original_name(self._actual_name))])
 
-                if connection_template_apply == None:
-                    connection_template_args = []
-                else:
-                    connection_template_args = parse_template_apply(connection_template_apply)
-                
-                expansion_request = ExpansionRequest(connection_name, connection_template_args)
+        requests, entities = self._expand_connections(system_conn, {port_name[len("id_"):]: port_name for port_name in system_ports}, "", [infer_original_name(self._actual_name)])
+        all_node_names = [node_name for entity in entities for node_name in entity[1]]
 
-                expansion_datum = self._template_manager.query(expansion_request, raise_exception=False)
+        # The components take part in the rendezvous of the nodes connected to their ports, which are not static like the system ports
+        component_nodes = [node_name for component_name in self.connections for node_name in self.connections[component_name].get_arguments()]
+        all_node_names += component_nodes
+        external_nodes = system_ports | set(component_nodes)
 
-                if expansion_datum == None:
-                    expansion_datum = self._template_manager.create(expansion_request)
-                    requests.append(expansion_request)
-                
-                for port_name_tree in connection_decl.get_children_by_name("port_name"):
-                    if port_name_tree.name == "comp_port_name":
-                        comp_port_name = (port_name_tree.children[0].get_attribute("value"), port_name_tree.children[1].get_attribute("value"))
-                        node_names.append(self._create_anonymous_node(comp_port_name))
-                    elif port_name_tree.name == "sys_port_name":
-                        port_name = port_name_tree.children[0].get_attribute("value")
-                        node_names.append(port_name)
-                
-                code_for_entities.append("tg.create_task(" + expansion_datum.actual_name + "().run(" + ", ".join(node_names) + "))\n")
-                
-                all_node_names += node_names
-            else:
-                raise Exception
+        if not self._options.state_classes:
+            for actual_name, node_names, _, _, _ in entities:
+                code_for_entities.append("tg.create_task(" + actual_name + "().run(" + ", ".join(node_names) + "))")
+        
+        if self._options.state_classes and entities and self._options.batch_threshold > 0:
+            entities = self._batch(entities, code_for_entities)
+        
+        if self._options.state_classes and entities and self._options.fusion_limit > 0:
+            entities = self._fuse(entities, external_nodes)
+        
+        if self._options.state_classes and entities:
+            stages = self._get_static_order(entities, external_nodes)
+            if stages:
+                # The acyclic part is stepped in a fixed order, without waking its stages (see `m_lib.Pipeline`)
+                stage_codes = [entities[i][0] + "(" + ", ".join(entities[i][1]) + ")" for i in stages]
+                stage_nodes = dict.fromkeys([node_name for i in stages for node_name in entities[i][1]])
+                code_for_entities.append("scheduler.add(Pipeline(" + ", ".join(stage_codes) + "), ports=(" + ", ".join(stage_nodes) + ",))")
+            
+            static = set(stages)
+            for i in range(len(entities)):
+                if i not in static:
+                    code_for_entities.append("scheduler.spawn(" + ", ".join([entities[i][0]] + entities[i][1]) + ")")
         
+        # Every entity connected to a node takes part in its rendezvous
+        n_parties: Dict[str, int] = {}
         for node_name in all_node_names:
-            code_for_nodes.append(node_name + " = Node() \n")
+            n_parties[node_name] = n_parties.get(node_name, 0) + 1
+        for node_name in n_parties:
+            if node_name in system_ports:
+                continue
+            code_for_nodes.append(node_name + " = Node(parties=" + str(n_parties[node_name]) + ")")
         
         for component_name in self.connections:
             connection_table = self.connections[component_name]
-            code_for_entities.append("tg.create_task(" + connection_table.translate() + ")\n")
+            if self._options.state_classes:
+                code_for_entities.append("scheduler.spawn(" + ", ".join([connection_table.actual_name] + connection_table.get_arguments()) + ")")
+            else:
+                code_for_entities.append("tg.create_task(" + connection_table.translate() + ")")
+
+        self._connection_code = code_for_nodes + code_for_entities
+        
+        return requests
+
+    def _expand_connections(self, system_conn: AttributedTree, port_nodes: Dict[str, str], prefix: str, expanding: List[str]) -> Tuple[List[ExpansionRequest], List[Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None]]]:
+        '''
+        The expansion requests and the entities connected by `system_conn`: (actual name, node names, port directions, body if it is an automaton, expansion datum).
+
+        The sub-systems are flattened: their entities are connected in place of them, to the nodes given to their ports, and their own nodes are renamed with a prefix. The sub-systems which cannot be flattened (see `_can_flatten`) are kept as entities.
+
+        port_nodes: the ports of the system (expanded), and the nodes given to them
+        prefix: the prefix of the nodes of the system
+        expanding: the systems being expanded, which are not flattened again (recursion)
+        '''
+        assert system_conn.name == "system_conn"
+
+        requests = []
+        entities = []
+        n_subsystems = 0
+
+        for connection_decl in system_conn.children:
+            if connection_decl.name != "entity_connection":
+                raise Exception
+            
+            node_names = []
+
+            connection_name = connection_decl.get_child_by_name("IDENTIFIER").get_attribute("value")
+            
+            connection_template_apply = connection_decl.get_child_by_name("template_apply", raise_exception=False)
+
+            if connection_template_apply == None:
+                connection_template_args = []
+            else:
+                connection_template_args = parse_template_apply(connection_template_apply)
+            
+            # The port names are aliased to "comp_port_name" and "sys_port_name" by the grammar
+            for port_name_tree in [child for child in connection_decl.children if child.name in ("comp_port_name", "sys_port_name")]:
+                if port_name_tree.name == "comp_port_name":
+                    comp_port_name = (port_name_tree.children[0].get_attribute("value"), port_name_tree.children[1].get_attribute("value"))
+                    node_names.append(self._create_anonymous_node(comp_port_name))
+                elif port_name_tree.name == "sys_port_name":
+                    port_name = port_name_tree.children[0].get_attribute("value")
+                    if port_name in port_nodes:
+                        # A port of the system, given by the parent
+                        node_names.append(port_nodes[port_name])
+                    else:
+                        node_names.append(prefix + port_name)
+            
+            subsystem_body = self._system_bodies.get(connection_name)
+            if subsystem_body is not None and self._can_flatten(connection_name, subsystem_body, connection_template_args, expanding):
+                # A flattened sub-system is not expanded on its own
+                subsystem_ports = dict(zip(self._get_port_names(connection_name), node_names))
+                subsystem_prefix = prefix + "sub" + str(n_subsystems) + "_"
+                n_subsystems += 1
+
+                subsystem_requests, subsystem_entities = self._expand_connections(subsystem_body.get_child_by_name("system_conn"), subsystem_ports, subsystem_prefix, expanding + [connection_name])
+                requests += subsystem_requests
+                entities += subsystem_entities
+                continue
+            
+            expansion_request = ExpansionRequest(connection_name, connection_template_args)
+
+            expansion_datum = self._template_manager.query(expansion_request, raise_exception=False)
+
+            if expansion_datum == None:
+                expansion_datum = self._template_manager.create(expansion_request)
+                requests.append(expansion_request)
+            
+            entities.append((expansion_datum.actual_name, node_names, expansion_datum.expanded_signature.get_port_IOs(), self._automaton_bodies.get(connection_name), expansion_datum))
+        
+        return requests, entities
+
+    def _batch(self, entities: List[Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None]], code_for_entities: List[str]) -> List[Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None]]:
+        '''
+        Emit a batch (see `BatchTranslator`) for each automaton connected at least `batch_threshold` times, and the code adding it to the scheduler. Return the entities which are not batched.
+        '''
+        instances: Dict[str, List[int]] = {}
+        for i in range(len(entities)):
+            if entities[i][3] is not None and entities[i][4] is not None:
+                instances.setdefault(entities[i][0], []).append(i)
+        
+        batched = set()
+        for indices in instances.values():
+            if len(indices) < self._options.batch_threshold:
+                continue
+            
+            _, _, _, body, expansion_datum = entities[indices[0]]
+            param_names = expansion_datum.expanded_signature.get_param_names()
+            signature_string = "(" + ", ".join(["id_" + param_name for param_name in param_names]) + ")"
+
+            actual_name = self._actual_name + "_batch_" + str(len(self._batches))
+            translator = BatchTranslator(expansion_datum.expanded_context.copy(), actual_name, self._template_manager, body, self._emitter, self._options, signature_string)
+            if translator.translate() is None:
+                continue
+            self._emitter.line()
+            self._batches.append(actual_name)
+
+            # The k-th port of every instance
+            port_tuples = ["(" + "".join([entities[i][1][k] + ", " for i in indices]).rstrip(" ") + ")" for k in range(len(param_names))]
+            node_names = [node_name for i in indices for node_name in entities[i][1]]
+            code_for_entities.append("scheduler.add(" + actual_name + "(" + ", ".join([str(len(indices))] + port_tuples) + "), ports=(" + "".join([node_name + ", " for node_name in node_names]).rstrip(" ") + "))")
+            batched.update(indices)
+        
+        return [entities[i] for i in range(len(entities)) if i not in batched]
+
+    def _get_port_names(self, name: str) -> List[str]:
+        '''
+        The port names of an entity without template arguments, in the order of its signature.
+        '''
+        signature_string = self._template_manager.get_signature_string(name)
+        return [port_name[len("id_"):] for port_name in signature_string[1:-1].split(", ") if port_name]
+
+    @staticmethod
+    def _can_flatten(system_name: str, system_body: AttributedTree, template_args: List[AttributedTree], expanding: List[str]) -> bool:
+        '''
+        Whether a sub-system can be flattened into its parent: it is not being expanded, has no template arguments, and connects only entities to nodes (the components declared in `system_comp` keep their own connection tables).
+        '''
+        if system_name in expanding or template_args:
+            return False
+        
+        system_comp = system_body.get_child_by_name("system_comp", raise_exception=False)
+        if system_comp is not None and system_comp.n_children > 0:
+            return False
+        
+        system_conn = system_body.get_child_by_name("system_conn", raise_exception=False)
+        if system_conn is None:
+            return False
+        
+        for connection_decl in system_conn.children:
+            if connection_decl.name != "entity_connection":
+                return False
+            if any([child.name == "comp_port_name" for child in connection_decl.children]):
+                return False
+        
+        return True
 
-        python_code = "".join(code_for_nodes) + "".join(code_for_entities)
+    @staticmethod
+    def _get_connection_graph(entities: List[Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None]]) -> Tuple[DirectedGraph, Dict[str, List[Tuple[int, str | None]]], Set[int]]:
+        '''
+        The graph with an edge from every entity writing a node (through an "Out" port) to every entity reading it (the ports without direction do both). Also return the entities connected to every node, with the direction of their port, and the entities both writing and reading a node.
+        '''
+        graph = DirectedGraph(set([str(i) for i in range(len(entities))]))
+
+        node_members: Dict[str, List[Tuple[int, str | None]]] = {}
+        for i in range(len(entities)):
+            node_names, port_IOs = entities[i][1], entities[i][2]
+            for node_name, port_IO in zip(node_names, port_IOs):
+                node_members.setdefault(node_name, []).append((i, port_IO))
+        
+        self_loops = set()
+        for node_name in node_members:
+            members = node_members[node_name]
+            for j in range(len(members)):
+                for l in range(len(members)):
+                    writer, writer_IO = members[j]
+                    reader, reader_IO = members[l]
+                    if j == l or writer_IO == "In" or reader_IO == "Out":
+                        continue
+                    
+                    if writer == reader:
+                        self_loops.add(writer)
+                    else:
+                        graph.add_edge((str(writer), str(reader)))
+        
+        return graph, node_members, self_loops
+
+    def _get_static_order(self, entities: List[Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None]], system_ports: Set[str]) -> List[int]:
+        '''
+        The entities stepped by a single `m_lib.Pipeline`, in the topological order of the connection graph (see `_get_connection_graph`).
+
+        The pipeline takes the automata outside the cycles of the graph, whose nodes connect only such automata: the synchronizations with the other entities, which are woken by the scheduler, and with the parent system (through the ports of the system) stay dynamic. Return [] if fewer than two entities remain.
+        '''
+        graph, node_members, self_loops = self._get_connection_graph(entities)
+        
+        static = set()
+        for component in graph.strongly_connected_components():
+            i = int(component[0])
+            if len(component) == 1 and i not in self_loops and entities[i][3] is not None and not system_ports.intersection(entities[i][1]):
+                static.add(i)
+        
+        # An entity sharing a node with a dynamic one is dynamic too
+        changed = True
+        while changed:
+            changed = False
+            for node_name in node_members:
+                members = set([i for i, _ in node_members[node_name]])
+                if not members <= static and members & static:
+                    static -= members
+                    changed = True
+        
+        if len(static) < 2:
+            return []
+        
+        static_graph = DirectedGraph(set([str(i) for i in static]), [edge for edge in graph.edges if int(edge[0]) in static and int(edge[1]) in static])
+        
+        return [int(node) for node in static_graph.topo_sort(key=int)]
+
+    def _fuse(self, entities: List[Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None]], system_ports: Set[str]) -> List[Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None]]:
+        '''
+        Replace the automata of every cycle of the connection graph (see `_get_connection_graph`) by their product (see `optimizer.ProductBuilder`), whose transitions synchronizing on the nodes connecting only them are joined. The products are translated before the system function.
+
+        A cycle is kept as it is if it contains an entity which is not an automaton, an automaton with template arguments or connected twice to a node, or if its product has more than `fusion_limit` transitions.
+        '''
+        graph, node_members, _ = self._get_connection_graph(entities)
+
+        fused = set()
+        products = []
+        for component in graph.strongly_connected_components():
+            if len(component) < 2:
+                continue
+            
+            cluster = sorted([int(node) for node in component])
+            product = self._build_product(entities, cluster, node_members, system_ports)
+            if product is not None:
+                fused |= set(cluster)
+                products.append(product)
+        
+        return [entities[i] for i in range(len(entities)) if i not in fused] + products
+
+    def _build_product(self, entities: List[Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None]], cluster: List[int], node_members: Dict[str, List[Tuple[int, str | None]]], system_ports: Set[str]) -> Tuple[str, List[str], List[str | None], AttributedTree | None, ExpansionDatum | None] | None:
+        for i in cluster:
+            _, node_names, _, body, expansion_datum = entities[i]
+            if body is None or expansion_datum.template_args or len(set(node_names)) != len(node_names):
+                return None
+        
+        # The nodes of the cluster, in order, with their port in the product
+        node_ports: Dict[str, str] = {}
+        for i in cluster:
+            for node_name in entities[i][1]:
+                node_ports.setdefault(node_name, "fp" + str(len(node_ports)))
         
-        return python_code, requests
+        internal_nodes = [node_name for node_name in node_ports if node_name not in system_ports and all([i in cluster for i, _ in node_members[node_name]])]
+        parties = {node_ports[node_name]: [cluster.index(i) for i, _ in node_members[node_name]] for node_name in internal_nodes}
+
+        # The context of the product: the ports of the members, and their variables renamed apart
+        type_context = entities[cluster[0]][4].expanded_context
+        members = []
+        port_IOs: Dict[str, str | None] = {}
+        try:
+            for k in range(len(cluster)):
+                _, node_names, _, body, expansion_datum = entities[cluster[k]]
+                member_context = expansion_datum.expanded_context
+
+                names = {}
+                for param_name, node_name in zip(expansion_datum.expanded_signature.get_param_names(), node_names):
+                    names[param_name] = node_ports[node_name]
+                    if node_ports[node_name] not in port_IOs:
+                        port_type, port_IO = member_context.get_param_type(param_name, with_IO=True)
+                        type_context.set_param_type(node_ports[node_name], port_type, port_IO)
+                        port_IOs[node_ports[node_name]] = port_IO
+                
+                automaton_vars = body.get_child_by_name("automaton_vars", raise_exception=False)
+                if automaton_vars is not None:
+                    for var_decl in automaton_vars.children:
+                        for child in var_decl.children[:-1]:
+                            var_name = child.get_attribute("value")
+                            names[var_name] = "f" + str(k) + "_" + var_name
+                            type_context.set_local_var_type(names[var_name], member_context.type_of_var(var_name) if member_context.is_var(var_name) else var_decl.children[-1])
+                
+                members.append(rename_identifiers(body, names))
+        except NameError:
+            return None
+        
+        product_body = ProductBuilder(self._options.fusion_limit).build(members, parties)
+        if product_body is None:
+            return None
+        
+        actual_name = self._actual_name + "_product_" + str(len(self._products))
+        external_nodes = [node_name for node_name in node_ports if node_name not in internal_nodes]
+        signature_string = "(" + ", ".join(["id_" + node_ports[node_name] for node_name in node_ports]) + ")"
+        self._products.append((actual_name, type_context, product_body, signature_string))
+
+        # The internal nodes are still created by the system, and given to the product like the external ones
+        return (actual_name, list(node_ports), [port_IOs[node_ports[node_name]] if node_name in external_nodes else None for node_name in node_ports], product_body, None)
 
     def _create_anonymous_node(self, comp_port_name: Tuple[str, str]) -> str:
-        #TODO
-        pass
+        '''
+        The node connected to the port of a component declared in `system_comp`, created the first time the port is connected.
+        '''
+        component_name, port_name = comp_port_name
+        if component_name not in self.connections:
+            raise NameError(f"'{component_name}' is not a component of the system.")
+        
+        connection_table = self.connections[component_name]
+        node_name = connection_table.get_node(port_name)
+        if node_name is None:
+            node_name = "anon_" + component_name + "_" + port_name
+            connection_table.set_node(port_name, node_name)
+        
+        return node_name
 
-    def translate(self) -> Tuple[str, List[ExpansionRequest]]:
+    def translate(self) -> List[ExpansionRequest]:
         all_requests = []
         
         system_comp = self._body.get_child_by_name("system_comp", raise_exception=False)
         system_inter = self._body.get_child_by_name("system_inter", raise_exception=False)
         system_conn = self._body.get_child_by_name("system_conn", raise_exception=False)
         
-        all_requests += self._parse_components(system_comp)
-        self._parse_inter(system_comp)
+        if system_comp is not None:
+            all_requests += self._parse_components(system_comp)
+        if system_inter is not None:
+            self._parse_inter(system_inter)
+
+        signature_string = self._template_manager.get_signature_string(infer_original_name(self._actual_name))
 
-        code, requests = self._parse_connections(system_conn)
-        all_requests += requests
+        if self._options.state_classes:
+            # The system adds its components to the scheduler running it (see `m_lib.Scheduler`)
+            header = "def " + self._actual_name + "(scheduler" + (", " if signature_string != "()" else "") + signature_string[1:] + ":"
+        else:
+            header = "async def " + self._actual_name + signature_string + ":"
+
+        if system_conn is not None:
+            all_requests += self._parse_connections(system_conn)
 
-        code = "async def " + self._actual_name + "(" + self._template_manager.get_signature_string(infer_original_name(self._actual_name)) + "): \n" + indent_code(code)
+        for actual_name, type_context, product_body, product_signature_string in self._products:
+            translator = AutomatonTranslator(type_context, actual_name, self._template_manager, product_body, self._emitter, self._options, product_signature_string)
+            all_requests += translator.translate()
+            self._emitter.line()
+
+        with self._emitter.block(header):
+            for line in self._connection_code:
+                self._emitter.line(line)
+            
+            if not self._connection_code:
+                self._emitter.line("pass")
         
-        return code, all_requests
+        return all_requests
     
 
 
 class TermTranslator(Translator):
-    def __init__(self, type_context: TypeContext, template_manager: TemplateManager, term_tree: AttributedTree):
-        super().__init__()
+    def __init__(self, type_context: TypeContext, template_manager: TemplateManager, term_tree: AttributedTree, options: TranslationOptions | None = None, shared_terms: "Dict[Tuple, ResolvedTerm] | None" = None, fresh_names: "count | None" = None, var_prefix: str = "id_"):
+        '''
+        shared_terms: fingerprint -> the local holding the sub-terms already computed (see `CommonSubtermEliminator`)
+        fresh_names: the counter numbering the locals of inlined functions, shared by the nested inlined terms
+        var_prefix: prefix of the python names of the variables and ports, e.g. "self.id_" for the state of an automaton class
+        '''
+        super().__init__(options=options)
         self._type_context = type_context
         self._template_manager = template_manager
         self._term_tree = term_tree
+        self._shared_terms = {} if shared_terms is None else shared_terms
+        self._fingerprints: Dict[int, Tuple] = {}
+        self._fresh_names = count() if fresh_names is None else fresh_names
+        self._var_prefix = var_prefix
     
     def translate(self) -> "ResolvedTerm":
-        DFS_manager = DFSManager(self._term_tree, self._translate)
+        term_tree = ConstantFolder(self._type_context).fold(self._term_tree)
+        if self._shared_terms:
+            self._fingerprints = get_fingerprints(term_tree)
+        DFS_manager = DFSManager(term_tree, self._translate)
         return DFS_manager.run()
 
     def _translate(self, current_tree: AttributedTree, children_resolved: "List[ResolvedTerm]") -> "ResolvedTerm":
+        # Shared sub-terms
+        if self._shared_terms:
+            shared_term = self._shared_terms.get(self._fingerprints[id(current_tree)])
+            if shared_term is not None:
+                return ResolvedTerm(shared_term.python_code, shared_term.type_tree, [], shared_term.additional_info)
+        
+        # Operator tokens
+        if current_tree.name in OPERATORS:
+            return ResolvedTerm(OPERATORS[current_tree.name], None, [], additional_info="operator")
+        
         # Resolve info from children
         python_code_of_children: List[str] = []
         type_trees_of_children: List[TypeTree] = []
         requests_of_children: List[ExpansionRequest] = []
         for child_resolved in children_resolved:
+            if child_resolved is None or child_resolved.additional_info == "operator":
+                continue
+
             python_code_of_children.append(child_resolved.python_code)
             
-            if child_resolved.type_tree == None and current_tree.name != "dot_term":
+            if child_resolved.type_tree == None and current_tree.name not in ("dot_term", "func_term", "struct_term"):
                 raise Exception #TODO
             type_trees_of_children.append(child_resolved.type_tree)
 
-            requests_of_children.append(child_resolved.expansion_requests)
+            requests_of_children += child_resolved.expansion_requests
+        
+        # Operations
+        if current_tree.name in OPERATOR_TERMS:
+            return self._translate_operation(current_tree, children_resolved, type_trees_of_children, requests_of_children)
         
         # Pure value
         if current_tree.name == "VALUE":
             value = current_tree.get_attribute("value")
 
-            additional_info = ""
-
             if type(value) == int:
-                return ResolvedTerm(f"MInt({value})", get_int_type(), [], additional_info=value)
+                type_tree = get_bounded_int_type(value, value)
+                boxed_type = "MInt"
             elif type(value) == float:
-                return ResolvedTerm(f"MReal({value})", get_real_type(), [])
+                type_tree = get_real_type()
+                boxed_type = "MReal"
             elif type(value) == bool:
-                return ResolvedTerm(f"MBool({value})", get_bool_type(), [])
+                type_tree = get_bool_type()
+                boxed_type = "MBool"
             elif type(value) == str:
-                return ResolvedTerm(f"MChar({value})", get_char_type(), [])
+                type_tree = get_char_type()
+                boxed_type = "MChar"
             else:
                 raise Exception #TODO
+            
+            # Literals are unboxed native values unless in checked mode
+            if self._options.checked:
+                python_code = f"{boxed_type}({value!r})"
+            else:
+                python_code = repr(value)
+            
+            return ResolvedTerm(python_code, type_tree, [], additional_info=value)
         
         # Identifier (var/enum)
         if current_tree.name == "IDENTIFIER":
@@ -528,9 +1990,8 @@ class TermTranslator(Translator):
 
             if self._type_context.is_var(identifier): #var
                 type_tree = self._type_context.type_of_var(identifier)
-                python_code = "id_" + identifier
-            
-            if self._type_context.is_enum_type(identifier): #enum
+                python_code = self._var_prefix + identifier
+            elif self._type_context.is_enum_type(identifier): #enum
                 type_tree = None
                 python_code = identifier
                 additional_info = "enum"
@@ -542,7 +2003,7 @@ class TermTranslator(Translator):
         
         if current_tree.name == "func_term":
             # Get function name
-            function_name = current_tree.get_child_by_name("IDENTIFIER")
+            function_name = current_tree.children[0].get_attribute("value")
             
             # Get template info
             template_apply = current_tree.get_child_by_name("template_apply", raise_exception=False)
@@ -558,27 +2019,35 @@ class TermTranslator(Translator):
             expansion_datum = self._template_manager.query(expansion_request, raise_exception=False)
 
             if expansion_datum == None:
-                expansion_datum = self._template_manager.create(expansion_datum)
+                expansion_datum = self._template_manager.create(expansion_request)
                 requests_of_children.append(expansion_request)
             
+            argument_indices = [i for i in range(1, current_tree.n_children) if current_tree.children[i].name != "template_apply"]
+            argument_trees = [current_tree.children[i] for i in argument_indices]
+            arguments_resolved = [children_resolved[i] for i in argument_indices]
+
+            inlined_term = self._inline(function_name, expansion_datum, argument_trees, arguments_resolved)
+            if inlined_term is not None:
+                return ResolvedTerm(inlined_term.python_code, inlined_term.type_tree, requests_of_children + inlined_term.expansion_requests)
+
             signature = expansion_datum.expanded_signature
             actual_name = expansion_datum.actual_name
             
-            python_code = actual_name + signature.validate_and_convert(children_resolved)
+            python_code = actual_name + signature.validate_and_convert(arguments_resolved, self._options.checked).python_code
             returned_type = signature.get_return_type()
 
             return ResolvedTerm(python_code, returned_type, requests_of_children)
         
         if current_tree.name == "struct_term":
-            #TODO: normalize the tree
-            python_code = []
-            fields = current_tree.get_attribute("fields")
-            type_tree = TypeTree.build_strcut_type(fields , type_trees_of_children)
+            # The children are the field names followed by their values
+            fields = tuple([field_tree.get_attribute("value") for field_tree in current_tree.children[0::2]])
+            values_resolved = children_resolved[1::2]
 
-            # Generate dictionary code
-            for i in range(len(current_tree.n_children)):
-                python_code.append(f"{fields[i]}: {python_code_of_children[i]}")
-            python_code = r"{" + ", ".join(python_code) + r"}"
+            type_tree = TypeTree.build_struct_type(fields, [value_resolved.type_tree for value_resolved in values_resolved])
+
+            # Generate record code
+            class_name = self._template_manager.get_record_class_name(fields)
+            python_code = class_name + "(" + ", ".join([value_resolved.python_code for value_resolved in values_resolved]) + ")"
             
             return ResolvedTerm(python_code, type_tree, requests_of_children)
 
@@ -621,17 +2090,8 @@ class TermTranslator(Translator):
                 
                 return ResolvedTerm(python_code, type_tree, requests_of_children)
             
-            if children_resolved[0].type_tree.name == "struct_type":
-                field = python_code_of_children[1]
-
-                python_code = r"("+ python_code_of_children[0] + r")" + "." + field
-                
-                type_tree = type_trees_of_children[0].get_child_by_name(field)
-                
-                return ResolvedTerm(python_code, type_tree, requests_of_children)
-
-            port_name = children_resolved[0].python_code
-            port_field = children_resolved[1].python_code
+            port_name = current_tree.children[0].get_attribute("value", raise_exception=False)
+            port_field = current_tree.children[1].get_attribute("value")
             if self._type_context.is_port(port_name):
                 if port_field == "reqRead":
                     type_tree = get_bool_type()
@@ -639,21 +2099,41 @@ class TermTranslator(Translator):
                     type_tree = get_bool_type()
                 elif port_field == "value":
                     type_tree = self._type_context.get_param_type(port_name)
+
+                    # The immutable and copy-on-write values are handed over without copy
+                    if not self._options.checked and get_transfer_class(type_tree) != "mutable":
+                        port_field = "shared"
                 else:
-                    raise NameError(f"Ports do not have a field named'{port_name}'")
+                    raise NameError(f"Ports do not have a field named'{port_field}'")
+                
+                python_code = python_code_of_children[0] + "." + port_field
+
+                return ResolvedTerm(python_code, type_tree, requests_of_children)
+            
+            struct_type = children_resolved[0].type_tree.de_init()
+            if struct_type.name == "struct":
+                field = current_tree.children[1].get_attribute("value")
+
+                # Records keep their fields in slots
+                python_code = r"("+ python_code_of_children[0] + r")" + "." + field
+                
+                type_tree = struct_type.children[struct_type.get_attribute("fields").index(field)]
+                
+                return ResolvedTerm(python_code, type_tree, requests_of_children)
             
             raise Exception #TODO
         
         if current_tree.name == "brack_term":
             python_code = r"(" + python_code_of_children[0] + r")[" + python_code_of_children[1] + r"]"
-            if type_trees_of_children[0] == "tuple_type":
+            container_type = type_trees_of_children[0].de_init()
+            if container_type.name == "tuple":
                 assert isinstance(children_resolved[1].additional_info, int)
                 
-                type_tree = type_trees_of_children[1].children[0].copy()
-            elif type_trees_of_children[0] == "array_type" or type_trees_of_children[0] == "list_type":
-                type_tree = type_trees_of_children[0].children[0].copy()
-            elif type_trees_of_children[0] == "map_type":
-                type_tree = type_trees_of_children[0].children[1].copy()
+                type_tree = container_type.children[children_resolved[1].additional_info].copy()
+            elif container_type.name == "array" or container_type.name == "list":
+                type_tree = container_type.children[0].copy()
+            elif container_type.name == "map":
+                type_tree = container_type.children[1].copy()
             else:
                 raise Exception #TODO
             
@@ -669,9 +2149,167 @@ class TermTranslator(Translator):
 
             return ResolvedTerm(python_code, type_tree, requests_of_children)            
 
+    def _inline(self, function_name: str, expansion_datum: "ExpansionDatum", argument_trees: List[AttributedTree], arguments_resolved: "List[ResolvedTerm]") -> "ResolvedTerm | None":
+        '''
+        Translate a call by substituting the body of the function, if it is small and non-recursive. Return None if the call is kept.
+
+        The coercions of the arguments and of the returned value are specialized to the types at the call site.
+        '''
+        function_body = self._template_manager.get_function_body(function_name)
+        if function_body is None or get_size(function_body) > self._options.inline_threshold:
+            return None
+        
+        if is_recursive(function_name, self._template_manager.get_function_body):
+            return None
+        
+        term_tree = FunctionInliner().expand(function_body)
+        if term_tree is None:
+            return None
+        
+        signature = expansion_datum.expanded_signature
+        function_context = expansion_datum.expanded_context
+        param_names = signature.get_param_names()
+        if len(param_names) != len(arguments_resolved):
+            raise Exception #TODO
+        
+        arguments = {}
+        for i in range(len(param_names)):
+            argument_resolved = arguments_resolved[i]
+            python_code = argument_resolved.type_tree.get_coercion_code(function_context.get_param_type(param_names[i]), argument_resolved.python_code, self._options.checked)
+            
+            is_checked = python_code != argument_resolved.python_code
+            is_atomic = argument_trees[i].n_children == 0 and not is_checked
+            arguments.update({param_names[i]: (python_code, is_atomic, is_checked)})
+        
+        resolved_term = InlinedTermTranslator(function_context, self._template_manager, term_tree, arguments, self._options, self._fresh_names).translate()
+        if resolved_term is None:
+            return None
+        
+        python_code = resolved_term.type_tree.get_coercion_code(signature.get_return_type(), resolved_term.python_code, self._options.checked)
+        
+        return ResolvedTerm(python_code, signature.get_return_type(), resolved_term.expansion_requests)
+
+    def _translate_operation(self, current_tree: AttributedTree, children_resolved: "List[ResolvedTerm]", type_trees_of_children: List[TypeTree], requests: List[ExpansionRequest]) -> "ResolvedTerm":
+        if current_tree.name == "term_b":
+            operator, operand = children_resolved
+            python_code = "(" + operator.python_code + operand.python_code + ")"
+
+            if operator.python_code == OPERATORS["NOT"]:
+                return ResolvedTerm(python_code, get_bool_type(), requests)
+            
+            return ResolvedTerm(python_code, operand.type_tree, requests)
+        
+        if current_tree.name == "term_g" or current_tree.name == "term_h":
+            connective = " and " if current_tree.name == "term_g" else " or "
+            python_code = "(" + connective.join([child.python_code for child in children_resolved if child.additional_info != "operator"]) + ")"
+
+            return ResolvedTerm(python_code, get_bool_type(), requests)
+
+        is_real = any([type_tree.name == "real" for type_tree in type_trees_of_children])
+
+        python_code = []
+        for child in children_resolved:
+            if child.python_code == OPERATORS["DIV"] and not is_real:
+                python_code.append("//")
+            else:
+                python_code.append(child.python_code)
+        python_code = "(" + " ".join(python_code) + ")"
+
+        if current_tree.name in ("term_e", "term_f"):
+            return ResolvedTerm(python_code, get_bool_type(), requests)
+        
+        if is_real:
+            return ResolvedTerm(python_code, get_real_type(), requests)
+        
+        return ResolvedTerm(python_code, get_int_type(), requests)
+
+class InlinedTermTranslator(TermTranslator):
+    '''
+    Translate the term computed by an inlined function body (see `FunctionInliner`) in the context of the function.
+
+    The value of every parameter and let is computed once, by an assignment expression to a fresh local where it is first evaluated (see `FunctionInliner.plan`).
+    '''
+    def __init__(self, type_context: TypeContext, template_manager: TemplateManager, term_tree: AttributedTree, arguments: Dict[str, Tuple[str, bool, bool]], options: TranslationOptions | None = None, fresh_names: "count | None" = None):
+        '''
+        arguments: parameter name -> (python code of the coerced argument, whether the code is cheap enough to be repeated, whether it checks the argument at runtime)
+        '''
+        super().__init__(type_context, template_manager, term_tree, options, fresh_names=fresh_names)
+        self._arguments = arguments
+        self._decisions: Dict[int, Tuple[Any, str]] = {}
+        self._local_names: Dict[Any, str] = {}
+
+        # Bindings whose code checks a value at runtime, and bindings stored in a local
+        self._checked_bindings: Set[Any] = set()
+        self._bound: Set[Any] = set()
+    
+    def translate(self) -> "ResolvedTerm | None":
+        '''
+        Return None if the body cannot be inlined: a runtime check of an argument or a variable would be skipped.
+        '''
+        term_tree = ConstantFolder(self._type_context).fold(self._term_tree)
+        self._decisions = FunctionInliner.plan(term_tree, set(self._arguments))
+
+        DFS_manager = DFSManager(term_tree, self._translate)
+        resolved_term = DFS_manager.run()
+
+        if not self._checked_bindings <= self._bound:
+            return None
+        
+        return resolved_term
+
+    def _bind(self, current_tree: AttributedTree, python_code: str, is_checked: bool, type_tree: TypeTree, requests: List[ExpansionRequest]) -> "ResolvedTerm":
+        if id(current_tree) not in self._decisions:
+            return ResolvedTerm("(" + python_code + ")", type_tree, requests)
+        
+        binding, decision = self._decisions[id(current_tree)]
+
+        if is_checked:
+            self._checked_bindings.add(binding)
+        
+        if decision == "inline":
+            return ResolvedTerm("(" + python_code + ")", type_tree, requests)
+        
+        if binding not in self._local_names:
+            self._local_names.update({binding: "inl_" + str(next(self._fresh_names))})
+        local_name = self._local_names[binding]
+        
+        if decision == "ref":
+            return ResolvedTerm(local_name, type_tree, [])
+        
+        self._bound.add(binding)
+        return ResolvedTerm("(" + local_name + " := " + python_code + ")", type_tree, requests)
+
+    def _translate(self, current_tree: AttributedTree, children_resolved: "List[ResolvedTerm]") -> "ResolvedTerm":
+        # Variable not assigned yet
+        if current_tree.name == "init_term":
+            return InitTermTranslator(self._type_context, self._template_manager, current_tree.get_attribute("type"), self._options).translate()
+        
+        # Variable
+        if current_tree.name == "let_term":
+            var_name = current_tree.get_attribute("value")
+            value_resolved = children_resolved[0]
+
+            type_tree = self._type_context.type_of_var(var_name)
+            python_code = value_resolved.type_tree.get_coercion_code(type_tree, value_resolved.python_code, self._options.checked)
+
+            return self._bind(current_tree, python_code, python_code != value_resolved.python_code, type_tree, value_resolved.expansion_requests)
+        
+        # Parameter
+        if current_tree.name == "IDENTIFIER" and id(current_tree) in self._decisions:
+            param_name = current_tree.get_attribute("value")
+            python_code, is_atomic, is_checked = self._arguments[param_name]
+
+            type_tree = self._type_context.get_param_type(param_name)
+            if is_atomic:
+                return ResolvedTerm(python_code, type_tree, [])
+            
+            return self._bind(current_tree, python_code, is_checked, type_tree, [])
+        
+        return super()._translate(current_tree, children_resolved)
+
 class InitTermTranslator(Translator):
-    def __init__(self, type_context: TypeContext, template_manager: TemplateManager, type_tree: TypeTree):
-        super().__init__()
+    def __init__(self, type_context: TypeContext, template_manager: TemplateManager, type_tree: TypeTree, options: TranslationOptions | None = None):
+        super().__init__(options=options)
         self._type_context = type_context
         self._template_manager = template_manager
         self._type_tree = type_tree
@@ -690,7 +2328,7 @@ class InitTermTranslator(Translator):
         if current_tree.name == "init_type":
             term_tree = current_tree.get_attribute("init_term")
             
-            resolved_term = TermTranslator(self._type_context, self._template_manager, term_tree).translate()
+            resolved_term = TermTranslator(self._type_context, self._template_manager, term_tree, self._options).translate()
 
             assert resolved_term.type_tree <= current_tree
             
@@ -698,17 +2336,23 @@ class InitTermTranslator(Translator):
         
         if current_tree.name == "array_type":            
             length = current_tree.get_attribute("length")
-            python_code = r"[" + ', '.join([children_returns[0].python_code] * length) + r"]"
+            
+            # Numeric entries are unboxed into a buffer
+            typecode = get_buffer_typecode(current_tree)
+            if typecode is not None and not self._options.checked:
+                # A buffer cannot hold None: the entries without initial value are zeros
+                entry_code = children_returns[0].python_code
+                python_code = f"array({typecode!r}, [{'0' if entry_code == 'None' else entry_code}]) * {length}"
+            else:
+                python_code = r"[" + ', '.join([children_returns[0].python_code] * length) + r"]"
             
             return ResolvedTerm(python_code, None, requests)
         
         if current_tree.name == "struct_type":
-            fields = current_tree.get_attribute("fields")
+            fields = tuple(current_tree.get_attribute("fields"))
             
-            python_code = []
-            for i in range(current_tree.n_children):
-                python_code.append(f"{fields[i]}: {children_returns[i].python_code}")
-            python_code = r"{" + ", ".join(python_code) + r"}"
+            class_name = self._template_manager.get_record_class_name(fields)
+            python_code = class_name + "(" + ", ".join(python_code_from_children) + ")"
             
             return ResolvedTerm(python_code, None, requests)
         
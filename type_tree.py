@@ -1,17 +1,23 @@
 from typing import List, Tuple, Dict, Set, Any, Callable
+from array import array
 from utils import AttributedTree, DFSManager, TreeAttributes, parse_template_apply
 
 
 class TypeTree(AttributedTree):
-    def __init__(self, tree: AttributedTree):
-        tree_copy = tree.copy()
-        super().__init__(tree_copy.name, tree_copy.attributes, tree_copy.children)
-
-    def __init__(self, name: str, attributes: TreeAttributes | Dict, children: "List[TypeTree]"):
-        super().__init__(name, attributes, children)
+    def __init__(self, name: "str | AttributedTree", attributes: TreeAttributes | Dict | None = None, children: "List[TypeTree] | None" = None):
+        '''
+        Either build a type tree from its parts, or copy an existing tree (`TypeTree(tree)`).
+        '''
+        if isinstance(name, AttributedTree):
+            super().__init__(name.name, name.attributes.copy(), [TypeTree(child) for child in name.children])
+        else:
+            super().__init__(name, {} if attributes is None else attributes, [] if children is None else children)
 
     def copy(self) -> "TypeTree":
         return TypeTree(super().copy())
+    
+    def deepcopy(self) -> "TypeTree":
+        return TypeTree(super().deepcopy())
 
     def get_init_term(self) -> AttributedTree:
         if self.name == "init":
@@ -306,7 +312,7 @@ class TypeTree(AttributedTree):
                 _t1_idx = _t1_fields.index(_t2_field)
 
                 _t1_subtree = _t1.children[_t1_idx]
-                _t2_subtree = _t1.children[_t2_idx]
+                _t2_subtree = _t2.children[_t2_idx]
 
                 coercion = _t1_subtree.get_coercion(_t2_subtree)
 
@@ -319,9 +325,100 @@ class TypeTree(AttributedTree):
         
         raise TypeError
 
-    def get_s11n_code(self) -> Tuple:
-        #TODO
-        pass
+    def get_coercion_code(self, another_type: "TypeTree", python_code: str, checked: bool = False) -> str:
+        '''
+        Generate the code converting the value of `python_code` (which is of this type) to `another_type`.
+
+        If `checked` is False, a runtime check is only generated where the coercion actually narrows the value. Otherwise, every coercion goes through `m_lib.convert`.
+        '''
+        coercion = self.get_coercion(another_type)
+
+        if coercion == None:
+            raise TypeError(f"Cannot convert '{self.name}' to '{another_type.name}'")
+        
+        if checked:
+            return f"convert({python_code}, {coercion!r})"
+        
+        if is_identity_coercion(coercion):
+            return python_code
+        
+        if coercion[0] == "struct":
+            # A record of the same layout whose fields need no conversion is shared, as it is copied on write
+            source_type = self.de_init()
+            target_type = another_type.de_init()
+            if source_type.get_attribute("fields") == target_type.get_attribute("fields") and get_transfer_class(target_type) == "copy_on_write":
+                field_codes = [source_type.children[i].get_coercion_code(target_type.children[i], "field") for i in range(source_type.n_children)]
+                if all([field_code == "field" for field_code in field_codes]):
+                    return python_code
+        
+        if coercion[0] in ("array", "list"):
+            # Numeric arrays are copied buffer to buffer, and their range is checked at once
+            typecode = get_buffer_typecode(another_type)
+            entry_coercion = coercion[-1]
+
+            # The buffers of a longer array type are padded to its length
+            source_type = self.de_init()
+            if coercion[0] == "array" and (source_type.name != "array" or int(source_type.get_attribute("length")) != coercion[1]):
+                length_code = f", {coercion[1]}"
+            else:
+                length_code = ""
+            
+            if typecode is not None and entry_coercion == "direct":
+                # Same buffers are shared, as they are copied on write
+                if get_buffer_typecode(self) == typecode and not length_code:
+                    return python_code
+                
+                return f"copy_buffer({python_code}, {typecode!r}{length_code})"
+            
+            if typecode is not None and entry_coercion[0] == "bounded":
+                _, l, r = entry_coercion
+                
+                source_entry = get_entry_type(self)
+                if source_entry is not None and source_entry.name == "bounded_int" and l <= source_entry.get_attribute("l") and source_entry.get_attribute("r") <= r:
+                    if get_buffer_typecode(self) == typecode and not length_code:
+                        return python_code
+                    
+                    return f"copy_buffer({python_code}, {typecode!r}{length_code})"
+                
+                return f"check_bounded_buffer({python_code}, {typecode!r}, {l}, {r}{length_code})"
+        
+        if coercion[0] == "bounded":
+            _, l, r = coercion
+            
+            source_type = self.de_init()
+            if source_type.name == "bounded_int" and l <= source_type.get_attribute("l") and source_type.get_attribute("r") <= r:
+                return python_code
+            
+            return f"check_bounded({python_code}, {l}, {r})"
+        
+        return f"convert({python_code}, {coercion!r})"
+
+    def get_s11n_code(self) -> Tuple | str:
+        '''
+        The serialization code of the values of this type, as `m_lib.pack` takes it: the coercion of the type to itself. Only the integers with bounds and the composite types have a code of their own, the other values are ("direct").
+        '''
+        type_tree = self.de_init()
+
+        if type_tree.name == "bounded_int":
+            return ("bounded", type_tree.get_attribute("l"), type_tree.get_attribute("r"))
+        
+        if type_tree.name in ("tuple", "union"):
+            return (type_tree.name, *[child.get_s11n_code() for child in type_tree.children])
+        
+        if type_tree.name == "array":
+            return ("array", int(type_tree.get_attribute("length")), type_tree.children[0].get_s11n_code())
+        
+        if type_tree.name == "list":
+            return ("list", type_tree.children[0].get_s11n_code())
+        
+        if type_tree.name == "map":
+            return ("map", type_tree.children[0].get_s11n_code(), type_tree.children[1].get_s11n_code())
+        
+        if type_tree.name == "struct":
+            fields = type_tree.get_attribute("fields")
+            return ("struct", *[(fields[i], type_tree.children[i].get_s11n_code()) for i in range(type_tree.n_children)])
+        
+        return ("direct")
 
     def __le__(self, another_type: "TypeTree") -> bool:
         coercion = self.get_coercion(another_type)
@@ -333,6 +430,98 @@ class TypeTree(AttributedTree):
 
         return coercion != None
 
+def get_bounded_int_type(l: int, r: int):
+    return TypeTree("bounded_int", {"l": l, "r": r}, [])
+
+def is_identity_coercion(coercion: Tuple | str) -> bool:
+    '''
+    Whether the coercion leaves every value unchanged (so that no code needs to be generated for it).
+    '''
+    if coercion == "direct":
+        return True
+    
+    if coercion[0] == "tuple":
+        return all([is_identity_coercion(component) for component in coercion[1:]])
+    
+    return False
+
+# The integer typecodes of `array`, from the smallest, with the range of their entries
+INT_TYPECODES: List[Tuple[str, int, int]] = []
+for _typecode in ("b", "B", "h", "H", "i", "I", "q", "Q"):
+    _n_bits = 8 * array(_typecode).itemsize
+    if _typecode.islower():
+        INT_TYPECODES.append((_typecode, -(1 << (_n_bits - 1)), (1 << (_n_bits - 1)) - 1))
+    else:
+        INT_TYPECODES.append((_typecode, 0, (1 << _n_bits) - 1))
+
+def get_entry_type(type_tree: TypeTree) -> TypeTree | None:
+    '''
+    The type of the entries of an array or list type (None for the other types).
+    '''
+    while type_tree.name in ("init", "init_type"):
+        type_tree = type_tree.children[0]
+    
+    if type_tree.name not in ("array", "array_type", "list", "list_type"):
+        return None
+    
+    entry_type = type_tree.children[0]
+    while entry_type.name in ("init", "init_type"):
+        entry_type = entry_type.children[0]
+    
+    return entry_type
+
+def get_buffer_typecode(type_tree: TypeTree) -> str | None:
+    '''
+    The `array` typecode of the buffer holding the values of an array or list type, if its entries are numeric. Otherwise (and for the other types) the values are python lists, and None is returned.
+
+    Bounded ints are stored in the smallest typecode covering their range, ints in 64 bits, reals as doubles and bools as bytes.
+    '''
+    entry_type = get_entry_type(type_tree)
+    if entry_type is None:
+        return None
+    
+    if entry_type.name == "int":
+        return "q"
+    
+    if entry_type.name == "bounded_int":
+        l, r = entry_type.get_attribute("l"), entry_type.get_attribute("r")
+        for typecode, typecode_l, typecode_r in INT_TYPECODES:
+            if typecode_l <= l and r <= typecode_r:
+                return typecode
+        
+        return None
+    
+    if entry_type.name == "real":
+        return "d"
+    
+    if entry_type.name == "bool":
+        return "B"
+    
+    return None
+
+def get_transfer_class(type_tree: TypeTree) -> str:
+    '''
+    How the values of a type are handed over by ports and assignments:
+    - "immutable": scalars, enums, and tuples and unions of them. The values are shared.
+    - "copy_on_write": arrays, lists, maps and structs whose entries are immutable. The values are shared, and a holder updating one in place copies it first (see `LowLevelTranslator`).
+    - "mutable": the other types, whose values are copied as a whole.
+    '''
+    while type_tree.name in ("init", "init_type"):
+        type_tree = type_tree.children[0]
+    
+    if type_tree.name in ("int", "bounded_int", "real", "bool", "char", "IDENTIFIER", "enum_type"):
+        return "immutable"
+    
+    transfer_classes = [get_transfer_class(child) for child in type_tree.children]
+    
+    if type_tree.name in ("tuple", "tuple_type", "union", "union_type"):
+        return "immutable" if all([transfer_class == "immutable" for transfer_class in transfer_classes]) else "mutable"
+    
+    if type_tree.name in ("array", "array_type", "list", "list_type", "map", "map_type", "struct", "struct_type"):
+        return "copy_on_write" if all([transfer_class == "immutable" for transfer_class in transfer_classes]) else "mutable"
+    
+    return "mutable"
+
 def get_int_type():
     return TypeTree(AttributedTree("int"))
 
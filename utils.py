@@ -1,7 +1,8 @@
 import lark
 import re
 import os
-from typing import Dict, List, Set, Tuple, Any, Callable
+from typing import Dict, List, Set, Tuple, Any, Callable, TextIO
+from contextlib import contextmanager
 from queue import Queue
 
 class TreeAttributes:
@@ -11,6 +12,12 @@ class TreeAttributes:
     def __getitem__(self, key: str) -> Any:
         return self._data[key]
     
+    def __iter__(self):
+        return iter(self._data)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+    
     def __setitem__(self, key: str, val: "int | float | bool | str | AttributedTree"):
         conditions = [\
             isinstance(val, int),\
@@ -109,9 +116,9 @@ class AttributedTree:
                     if hasattr(val, "deepcopy"):
                         new_attributes.update({key : val.deepcopy()})
                     elif hasattr(val, "copy"):
-                        new_attributes.update({key, val.copy()})
+                        new_attributes.update({key: val.copy()})
                     else:
-                        new_attributes.update({key, val})
+                        new_attributes.update({key: val})
                 
                 attr_tree = AttributedTree(current_tree.name, new_attributes, stack_children[-1])
 
@@ -206,12 +213,7 @@ class AttributedTree:
         return name in self.attributes
 
 class DFSManager:
-    def __init__(self, tree: AttributedTree, node_operation: Callable[[AttributedTree, List], Any]):
-        self._tree = tree
-        self._node_operation = node_operation
-        self._root_operation = lambda x : x
-    
-    def __init__(self, tree: AttributedTree, node_operation: Callable[[AttributedTree, List], Any], root_operation: Callable[[Any], Any]):
+    def __init__(self, tree: AttributedTree, node_operation: Callable[[AttributedTree, List], Any], root_operation: Callable[[Any], Any] = lambda x : x):
         self._tree = tree
         self._node_operation = node_operation
         self._root_operation = root_operation
@@ -234,7 +236,8 @@ class DFSManager:
                 children_returns.append([])
             elif actual_n_children == expected_n_children:
                 tree_stack.pop()
-                children_returns[-1].append(self._node_operation(current_tree, children_returns.pop()))
+                current_return = self._node_operation(current_tree, children_returns.pop())
+                children_returns[-1].append(current_return)
                 current_tree = tree_stack[-1]
             else:
                 raise Exception
@@ -269,10 +272,10 @@ class DirectedGraph:
         self.out_degrees = {}
 
         for node in nodes:
-            self.add_node(self, node)
+            self.add_node(node)
         
         for edge in edges:
-            self.add_edge(self, edge)
+            self.add_edge(edge)
     
     def add_node(self, node: str):       
         self.nodes.add(node)
@@ -319,31 +322,96 @@ class DirectedGraph:
 
         self.nodes.remove(node)
         self.in_degrees.pop(node)
+        self.out_degrees.pop(node)
 
     def copy(self) -> "DirectedGraph":
         return DirectedGraph(self.nodes.copy(), self.edges.copy())
 
-    def topo_sort(self) -> List[str]:
+    def topo_sort(self, key: Callable[[str], Any] | None = None) -> List[str]:
+        '''
+        If `key` is given, the smallest source node by `key` comes first, so that the order does not depend on the iteration order of the set of nodes.
+        '''
         DAG_copy = self.copy()
         result = []
 
         while True:
-            if DAG_copy.nodes == []:
+            if not DAG_copy.nodes:
                 return result
             
-            source_node = None
-            for node in DAG_copy.in_degrees:
-                if DAG_copy.in_degrees[node] == 0:
-                    source_node = node
-                    break
+            source_nodes = [node for node in DAG_copy.in_degrees if DAG_copy.in_degrees[node] == 0]
+            if not source_nodes:
+                source_node = None
+            elif key is None:
+                source_node = source_nodes[0]
+            else:
+                source_node = min(source_nodes, key=key)
             
             if source_node is None:
                 raise ValueError("Loop in a directed graph.")
             
-            result.append(node)
+            result.append(source_node)
 
             DAG_copy.remove_node(source_node)
 
+    def get_successors(self) -> Dict[str, List[str]]:
+        successors = {node: [] for node in self.nodes}
+        for src, tar in self.edges:
+            successors[src].append(tar)
+        
+        return successors
+
+    def strongly_connected_components(self) -> List[List[str]]:
+        '''
+        The strongly connected components (Tarjan's algorithm), the sources of the condensed graph first: every edge between two components goes from an earlier one to a later one.
+        '''
+        successors = self.get_successors()
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in sorted(self.nodes):
+            if root in index:
+                continue
+            
+            # Iterative depth-first search: (node, iterator over its successors)
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(successors[root]))]
+            while work:
+                node, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(successors[child])))
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                    continue
+                
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        
+        # Tarjan's algorithm completes the sinks first
+        components.reverse()
+        return components
+
 def eval_placeholders(t : lark.Tree, tokens : List[Dict[str, Any]]) -> lark.Tree:
     '''
     This method evaluates the placeholders "Id@<id>" and "Val@<id>" in a Lark syntax tree. That is, those placeholders will be replaced with their actual value (stored in `tokens`).
@@ -453,13 +521,70 @@ def parse_template_apply(template_apply: AttributedTree) -> List[AttributedTree]
     assert template_apply.name == "template_apply"
     pass
 
-def indent_code(python_code: str, level: int = 1) -> str:
-    lines = re.split(r"\r\n|\r|\n", python_code)
+class CodeEmitter:
+    '''
+    A buffered sink of python code lines. The emitter keeps track of the current indentation level, so every line is written once at its final depth.
 
-    for i in range(len(lines)):
-        lines[i] = "    " * level + lines[i]
-    
-    return "\n".join(lines)
+    If `sink` is given, `flush` writes the buffered lines to it and empties the buffer. Otherwise the code is kept in memory until `getvalue` is called.
+    '''
+    def __init__(self, sink: TextIO | None = None, indent_unit: str = "    "):
+        self._sink = sink
+        self._indent_unit = indent_unit
+        self._level = 0
+        self._lines: List[str] = []
+
+    @property
+    def level(self) -> int:
+        return self._level
+
+    def line(self, python_code: str = ""):
+        '''
+        Append a single line at the current indentation level.
+        '''
+        if python_code:
+            self._lines.append(self._indent_unit * self._level + python_code)
+        else:
+            self._lines.append("")
+
+    def lines(self, python_code: str):
+        '''
+        Append a (possibly multi-line) code snippet. The relative indentation inside the snippet is kept.
+        '''
+        for line in re.split(r"\r\n|\r|\n", python_code):
+            if line.strip():
+                self.line(line)
+
+    def indent(self):
+        self._level += 1
+
+    def dedent(self):
+        if self._level == 0:
+            raise ValueError("Cannot dedent below level 0.")
+        
+        self._level -= 1
+
+    @contextmanager
+    def block(self, header: str):
+        '''
+        Write `header` (e.g. "if x:") and indent everything emitted inside the `with` statement.
+        '''
+        self.line(header)
+        self.indent()
+        try:
+            yield self
+        finally:
+            self.dedent()
+
+    def flush(self):
+        if self._sink is None:
+            return
+        
+        for line in self._lines:
+            self._sink.write(line + "\n")
+        self._lines = []
+
+    def getvalue(self) -> str:
+        return "\n".join(self._lines) + "\n"
 
 def infer_original_name(actual_name: str) -> str:
     parts = actual_name.split("_")